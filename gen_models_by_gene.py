@@ -1,23 +1,33 @@
 from gocamgen.gocamgen import AssocGoCamModel
 from gocamgen.gpad_extensions_mapper import ExtensionsMapper
 from gocamgen.filter_rule import AssocFilter, FilterRule, get_filter_rule
-from gocamgen.collapsed_assoc import extract_properties
-from gocamgen.errors import GocamgenException, GeneErrorSet
+from gocamgen.errors import GocamgenException, GeneErrorSet, error_type_name
 from gocamgen.utils import ShexException
-from ontobio.io.gpadparser import GpadParser
-from ontobio.ontol_factory import OntologyFactory
+from gocamgen.ontology_snapshot import OntologySnapshotCache, DEFAULT_SNAPSHOT_DIR
+from gocamgen.relations import load_relation_resolver, load_relation_algebra, RO_HANDLE, GOREL_HANDLE
+from gocamgen.closure_index import load_closure_index
+from gocamgen.writers import NQuadsWriter, ModelArchiveWriter, model_nquads
+from gocamgen.manifest import ModelManifest, gene_content_hash, run_context_hash
+from gocamgen.gpad_source import GpadSource, as_gpad_source
+from gocamgen.stage_timer import StageTimer
+from gocamgen.journal import RunJournal
+from gocamgen.template_cache import TranslationTemplateCache
+from gocamgen.gpad_reader import GpadReader, close_line_stores
+from gocamgen.gpad_cache import GpadCache, load_gpad_cache
 # from ontobio.ecomap import EcoMap
 import argparse
+import hashlib
 import logging
-import requests
 from requests.exceptions import ConnectionError
-import gzip
+import heapq
+import os
+import tempfile
 import time
+import multiprocessing
+from collections import deque
+from itertools import islice
 from os import path
 # from abc import ABC, abstractmethod
-from rdflib.graph import ConjunctiveGraph
-from rdflib.store import Store
-from rdflib import plugin
 
 logging.basicConfig()
 logger = logging.getLogger(__name__)
@@ -32,176 +42,545 @@ parser.add_argument('-m', '--mod', help="MOD rules to follow for filtering and t
 parser.add_argument('-d', '--output_directory', help="Directory to output model ttl files to")
 parser.add_argument('-r', '--report', help="Generate report", action="store_const", const=True)
 parser.add_argument('-N', '--nquads', help="Filepath to write model file in N-Quads format")
+parser.add_argument('-l', '--layout', choices=["flat", "sharded"], default="flat",
+                    help="flat writes every model straight into --output_directory. sharded spreads them over "
+                         "subdirectories named by the first 2 hex digits of a hash of the gene ID.")
+parser.add_argument('-a', '--archive', help="Write all models into this .tar, .tar.gz/.tgz or .zip file instead of "
+                                            "separate files, plus a gene-to-member index at <archive>.index.tsv")
+parser.add_argument('--stream', help="Parse, filter and group annotations lazily, one gene at a time. Unsorted "
+                                     "input is grouped through an on-disk external sort.",
+                    action="store_const", const=True)
+parser.add_argument('-i', '--incremental', help="Only regenerate models whose gene's annotations changed since the "
+                                                "last run, according to the manifest next to --output_directory. "
+                                                "Models of genes no longer in the GPAD are deleted.",
+                    action="store_const", const=True)
+parser.add_argument('--ontology_snapshot_dir', default=DEFAULT_SNAPSHOT_DIR,
+                    help="Directory of compiled RO/GOREL/GO snapshots used to warm-start ontology loading")
+parser.add_argument('--offline', help="Use existing ontology snapshots without checking sources for new versions",
+                    action="store_const", const=True)
+parser.add_argument('--resume', help="Pick up an interrupted run where it stopped, skipping genes already in its "
+                                     "journal. Partially written N-Quads output is truncated to the last complete "
+                                     "model.", action="store_const", const=True)
+parser.add_argument('--fast_writer', help="Write each model's Turtle in one pass over its triples instead of through "
+                                          "rdflib's serializer", action="store_const", const=True)
+parser.add_argument('--deterministic_ids', help="Derive model, individual and evidence IRIs from the gene ID and "
+                                                "annotation instead of random UUIDs, and date models by their latest "
+                                                "annotation, so unchanged models are byte-identical between runs",
+                    action="store_const", const=True)
+parser.add_argument('--template_cache_size', type=int, default=10000,
+                    help="Max number of annotation shapes (qualifiers, term, extensions, with/from) to keep translated "
+                         "subgraph templates for across genes. 0 disables the cache.")
+parser.add_argument('--strict_gpad', help="Run every GPAD line through ontobio's GpadParser ID validation instead "
+                                          "of the fast tokenizer, dropping lines it rejects",
+                    action="store_const", const=True)
+parser.add_argument('--gpad_cache', help="Keep a pre-parsed, memory-mapped copy of a local GPAD next to it "
+                                         "(<gpad_file>.cache/) and load from it while the GPAD is unchanged",
+                    action="store_const", const=True)
+parser.add_argument('-w', '--workers', type=int, default=1,
+                    help="Number of worker processes to translate models in. Workers are forked after ontologies are "
+                         "loaded so they share them copy-on-write.")
 
 # GoCamInputHandler
 
 
+# Can't get logical_definitions w/ ont.create("go"), need to load ontology via PURL
+GO_HANDLE = "http://purl.obolibrary.org/obo/go.owl"
+
+
 class GoCamBuilder:
-    def __init__(self):
-        self.ro_ontology = OntologyFactory().create("http://purl.obolibrary.org/obo/ro.owl")
-        self.gorel_ontology = OntologyFactory().create("http://release.geneontology.org/2019-03-18/ontology/extensions/gorel.obo")
-        # Can't get logical_definitions w/ ont.create("go"), need to load ontology via PURL
-        self.go_ontology = OntologyFactory().create("http://purl.obolibrary.org/obo/go.owl")
-        self.ext_mapper = ExtensionsMapper(go_ontology=self.go_ontology, ro_ontology=self.ro_ontology)
-        self.store = plugin.get('IOMemory', Store)()
+    def __init__(self, snapshot_cache: OntologySnapshotCache = None, stage_timer: StageTimer = None,
+                 deterministic_ids=False, template_cache_size=10000):
+        if snapshot_cache is None:
+            snapshot_cache = OntologySnapshotCache()
+        self.snapshot_cache = snapshot_cache
+        if stage_timer is None:
+            stage_timer = StageTimer()
+        self.stage_timer = stage_timer
+        self.ro_ontology = snapshot_cache.load(RO_HANDLE)
+        self.gorel_ontology = snapshot_cache.load(GOREL_HANDLE)
+        self.go_ontology = snapshot_cache.load(GO_HANDLE)
+        self.relation_resolver = load_relation_resolver(snapshot_cache, RO_HANDLE, GOREL_HANDLE, self.ro_ontology,
+                                                        self.gorel_ontology)
+        self.relation_algebra = load_relation_algebra(snapshot_cache, RO_HANDLE, GO_HANDLE, self.ro_ontology,
+                                                      self.go_ontology)
+        self.closure_index = load_closure_index(snapshot_cache, GO_HANDLE, self.go_ontology)
+        self.ext_mapper = ExtensionsMapper(go_ontology=self.go_ontology, ro_ontology=self.ro_ontology,
+                                           closure_index=self.closure_index, relation_resolver=self.relation_resolver)
+        self.deterministic_ids = deterministic_ids
+        self.template_cache = TranslationTemplateCache(template_cache_size)
 
     def translate_to_model(self, gene, assocs):
-        model = AssocGoCamModel(gene, assocs, store=self.store)
+        # Each model gets its own short-lived graph. Callers close() it once it's written out.
+        model = AssocGoCamModel(gene, assocs, deterministic_ids=self.deterministic_ids)
         model.extensions_mapper = self.ext_mapper
         model.ontology = self.go_ontology
         model.ro_ontology = self.ro_ontology
         model.gorel_ontology = self.gorel_ontology
-        model.translate()
+        model.relation_resolver = self.relation_resolver
+        model.relation_algebra = self.relation_algebra
+        model.closure_index = self.closure_index
+        model.stage_timer = self.stage_timer
+        model.template_cache = self.template_cache
+        with self.stage_timer.stage("translate"):
+            model.translate()
 
         return model
 
 
 class AssocExtractor:
-    def __init__(self, gpad_file, filter_rule : FilterRule):
-        gpad_parser = GpadParser()
-        assocs = gpad_parser.parse(gpad_file, skipheader=True)
-        self.assocs = extract_properties_from_assocs(assocs)
+    def __init__(self, gpad_file, filter_rule : FilterRule, stage_timer: StageTimer = None, strict=False,
+                 gpad_cache: GpadCache = None, genes=None):
+        if stage_timer is None:
+            stage_timer = StageTimer()
+        self.stage_timer = stage_timer
+        start = StageTimer.clock()
+        if gpad_cache is not None:
+            # With genes, only their rows are read from the cache
+            rows = gpad_cache.rows_for_subjects(genes) if genes is not None else None
+            self.assocs = list(gpad_cache.records(rows))
+        else:
+            self.assocs = list(GpadReader(strict=strict).parse_source(as_gpad_source(gpad_file)))
+        self.stage_timer.add_since("parse", start, count=len(self.assocs))
         self.assoc_filter = AssocFilter(filter_rule)
 
     def group_assocs(self):
         assocs_by_gene = {}
-        for a in self.assocs:
-            # validation function
-            if not self.assoc_filter.validate_line(a):
-                continue
+        start = StageTimer.clock()
+        valid_assocs = self.assoc_filter.filter(self.assocs)
+        self.stage_timer.add_since("filter", start, count=len(self.assocs))
+        start = StageTimer.clock()
+        for a in valid_assocs:
             subject_id = a["subject"]["id"]
             if subject_id in assocs_by_gene:
                 assocs_by_gene[subject_id].append(a)
             else:
                 assocs_by_gene[subject_id] = [a]
+        self.stage_timer.add_since("group", start, count=len(assocs_by_gene))
         return assocs_by_gene
 
 
-def extract_properties_from_assocs(assocs):
-    new_assoc_list = []
-    for a in assocs:
-        new_assoc_list.append(extract_properties(a))
-    return new_assoc_list
+class StreamingAssocExtractor:
+    # Same filtering as AssocExtractor but yields (gene, assocs) groups one at a time so peak memory
+    # depends on the largest gene rather than the whole file.
+    def __init__(self, gpad_file, filter_rule : FilterRule, presorted=None, sort_buffer_lines=500000,
+                 tmp_dir=None, stage_timer: StageTimer = None, strict=False, gpad_cache: GpadCache = None):
+        if stage_timer is None:
+            stage_timer = StageTimer()
+        self.stage_timer = stage_timer
+        self.gpad_source = as_gpad_source(gpad_file)
+        self.gpad_reader = GpadReader(strict=strict)
+        self.assoc_filter = AssocFilter(filter_rule)
+        # None means check the file first
+        self.presorted = presorted
+        self.sort_buffer_lines = sort_buffer_lines
+        self.tmp_dir = tmp_dir
+        self.gpad_cache = gpad_cache
 
+    def group_assocs(self):
+        if self.gpad_cache is not None:
+            yield from self.group_cached_assocs()
+            return
+        if self.presorted is None:
+            # Checking a remote file would mean downloading it twice, so just sort it
+            self.presorted = not self.gpad_source.is_remote() and is_sorted_by_subject(self.gpad_source)
+        with self.gpad_source.open() as gf:
+            if self.presorted:
+                lines = gf
+            else:
+                logger.info("{} is not sorted by DB object ID. Grouping through external sort".format(self.gpad_source))
+                lines = external_sort_gpad_lines(gf, self.sort_buffer_lines, tmp_dir=self.tmp_dir)
+            pending_group = None  # Last gene of the previous batch, which may carry on into this one
+            for records in self.parse_batches(lines):
+                start = StageTimer.clock()
+                gene_groups = [pending_group] if pending_group else []
+                for a in records:
+                    if not gene_groups or a.subject_id != gene_groups[-1][0]:
+                        gene_groups.append((a.subject_id, []))
+                    gene_groups[-1][1].append(a)
+                new_genes = len(gene_groups) - (1 if pending_group else 0)
+                pending_group = gene_groups.pop() if gene_groups else None
+                self.stage_timer.add_since("group", start, count=new_genes)
+                for gene, assocs in gene_groups:
+                    yield from self.filter_group(gene, assocs)
+            if pending_group:
+                yield from self.filter_group(*pending_group)
 
-def unzip(filepath):
-    input_file = gzip.GzipFile(filepath, "rb")
-    s = input_file.read()
-    input_file.close()
+    def group_cached_assocs(self):
+        # The cache already indexes rows by gene in sorted order, so grouping is just the index lookup
+        subject_groups = self.gpad_cache.subject_groups()
+        while True:
+            start = StageTimer.clock()
+            group = next(subject_groups, None)
+            self.stage_timer.add_since("group", start, count=0 if group is None else 1)
+            if group is None:
+                break
+            gene, rows = group
+            start = StageTimer.clock()
+            assocs = list(self.gpad_cache.records(rows))
+            self.stage_timer.add_since("parse", start, count=len(assocs))
+            yield from self.filter_group(gene, assocs)
 
-    target = path.splitext(filepath)[0]
-    logger.info("Gunzipping file: {}".format(filepath))
-    with open(target, "wb") as output:
-        output.write(s)
-    return target
+    def parse_batches(self, lines, batch_size=1000):
+        # Reading (and external sorting) is interleaved with parsing, so lines are pulled a batch at a time:
+        # pulling a batch is booked under "group" along with splitting it by gene, and tokenizing it under "parse".
+        line_iter = iter(lines)
+        while True:
+            start = StageTimer.clock()
+            batch = list(islice(line_iter, batch_size))
+            self.stage_timer.add_since("group", start, count=0)
+            if not batch:
+                break
+            start = StageTimer.clock()
+            records = [r for line in batch if not self.gpad_reader.is_header(line)
+                       for r in self.gpad_reader.parse_line(line)]
+            self.stage_timer.add_since("parse", start, count=len(records))
+            yield records
 
+    def filter_group(self, gene, assocs):
+        if not assocs:
+            return
+        start = StageTimer.clock()
+        valid_assocs = self.assoc_filter.filter(assocs)
+        self.stage_timer.add_since("filter", start, count=len(assocs))
+        if valid_assocs:
+            yield gene, valid_assocs
 
-def handle_gpad_file(args_gpad_file):
-    if args_gpad_file.startswith("http://"):
-        gpad_file_target = args_gpad_file.split("/")[-1]
-        logger.info("Downloading GPAD from {} and saving to {}".format(args_gpad_file, gpad_file_target))
-        response = requests.get(args_gpad_file)
-        with open(gpad_file_target, "wb") as gft:
-            gft.write(response.content)
-        if gpad_file_target.endswith(".gz"):
-            gpad_file = unzip(gpad_file_target)
-        else:
-            gpad_file = gpad_file_target
-    else:
-        gpad_file = args.gpad_file
-    return gpad_file
 
+def gpad_line_subject_key(line):
+    # DB:DB_Object_ID, the same ID GpadParser puts in assoc["subject"]["id"]
+    cols = line.split("\t", 2)
+    if len(cols) < 2:
+        return line
+    return "{}:{}".format(cols[0], cols[1])
 
-def parse_header(gpad_file):
-    header_data = {
-        "date": ""
-    }
-    with open(gpad_file) as gf:
-        for l in gf.readlines():
-            if l.startswith("!"):
-                date_key = "!date: "
-                if l.startswith(date_key):
-                    header_data["date"] = l.split(date_key)[1].split("$")[0].strip()
+
+def is_sorted_by_subject(gpad_file):
+    # Only needs the previous key, so this check doesn't grow with the file
+    previous_key = None
+    with as_gpad_source(gpad_file).open() as gf:
+        for line in gf:
+            if line.startswith("!"):
+                continue
+            key = gpad_line_subject_key(line)
+            if previous_key is not None and key < previous_key:
+                return False
+            previous_key = key
+    return True
+
+
+def external_sort_gpad_lines(lines, buffer_lines, tmp_dir=None):
+    # Sort runs of buffer_lines in memory, spill each to disk, then k-way merge. sorted() and heapq.merge are
+    # both stable so a gene's lines keep their file order.
+    run_paths = []
+    buffer = []
+    try:
+        for line in lines:
+            if line.startswith("!"):
+                continue
+            if not line.endswith("\n"):
+                line += "\n"
+            buffer.append(line)
+            if len(buffer) >= buffer_lines:
+                run_paths.append(write_sorted_run(buffer, tmp_dir))
+                buffer = []
+        if not run_paths:
+            yield from sorted(buffer, key=gpad_line_subject_key)
+            return
+        if buffer:
+            run_paths.append(write_sorted_run(buffer, tmp_dir))
+            buffer = []
+        run_files = [open(rp) for rp in run_paths]
+        try:
+            yield from heapq.merge(*run_files, key=gpad_line_subject_key)
+        finally:
+            for rf in run_files:
+                rf.close()
+    finally:
+        for rp in run_paths:
+            os.remove(rp)
+
+
+def write_sorted_run(lines, tmp_dir=None):
+    with tempfile.NamedTemporaryFile("w", suffix=".gpad.run", dir=tmp_dir, delete=False) as run_file:
+        run_file.writelines(sorted(lines, key=gpad_line_subject_key))
+    return run_file.name
+
+
+def select_genes(gene_groups, specific_genes):
+    found_genes = set()
+    for gene, assocs in gene_groups:
+        if gene in specific_genes:
+            logger.debug("{} filtered annotations to translate for {}".format(len(assocs), gene))
+            found_genes.add(gene)
+            yield gene, assocs
+    for specific_gene in specific_genes:
+        if specific_gene not in found_genes:
+            logger.error("ERROR: specific gene {} not found in filtered annotation list".format(specific_gene))
+
+
+def make_model_and_write_out(builder, gene, assocs, errors, output_directory=None, write_file=True, fast_writer=False,
+                             layout="flat"):
+    # All these shenanigans are to prevent mid-run crashes due to an external resource simply blipping
+    # out for a second.
+    retry_count = 0
+    retry_limit = 5
+    model = None
+    while True:
+        try:
+            start_time = time.time()
+            model = builder.translate_to_model(gene, assocs)
+            # add_to_conjunctive_graph(model, conjunctive_graph)
+            if not write_file:
+                # Caller appends it to the N-Quads output or archive
+                logger.info("Model for {} translated in {} sec".format(gene, (time.time() - start_time)))
             else:
-                break
-    return header_data
+                out_filename = model_output_path(gene, output_directory, layout)
+                if layout == "sharded":
+                    os.makedirs(path.dirname(out_filename), exist_ok=True)
+                with builder.stage_timer.stage("write"):
+                    model.write(out_filename, fast=fast_writer)
+                logger.info("Model for {} written to {} in {} sec".format(gene, out_filename, (time.time() - start_time)))
+        except GocamgenException as ex:
+            errors.add_error(gene, ex)
+        except (TimeoutError, ConnectionError) as ex:
+            # This has been happening randomly and breaking full runs
+            errors.add_error(gene, ex)
+            if retry_count < retry_limit:
+                retry_count += 1
+                continue  # retry
+            errors.add_error(gene, GocamgenException(f"Bailing on model for {gene} after {retry_count} retries"))
+        break  # Done with this model. Move on to the next one.
+    return model
+
+
+def model_output_path(gene, output_directory=None, layout="flat"):
+    out_filename = "{}.ttl".format(gene.replace(":", "_"))
+    if layout == "sharded":
+        # 256 roughly even buckets. Hashed since gene IDs within a MOD share long common prefixes.
+        out_filename = path.join(hashlib.md5(gene.encode()).hexdigest()[:2], out_filename)
+    if output_directory:
+        out_filename = path.join(output_directory, out_filename)
+    return out_filename
+
+
+def skip_unchanged_genes(gene_groups, manifest, context_hash, gene_hashes, seen_genes, output_directory,
+                         layout="flat"):
+    for gene, assocs in gene_groups:
+        seen_genes.add(gene)
+        gene_hash = gene_content_hash(assocs, context_hash)
+        if manifest.is_current(gene, gene_hash, model_output_path(gene, output_directory, layout)):
+            continue
+        gene_hashes[gene] = gene_hash
+        yield gene, assocs
+
+
+def update_manifest(manifest, gene, gene_hashes, errors, output_directory, layout="flat"):
+    gene_hash = gene_hashes.pop(gene, None)
+    if gene_hash is None:
+        return
+    output_path = model_output_path(gene, output_directory, layout)
+    if gene in errors.errors:
+        # Next incremental run retries this gene
+        manifest.mark_stale(gene, output_path)
+    else:
+        manifest.record(gene, gene_hash, output_path)
+
+
+def skip_journaled_genes(gene_groups, journal, manifest, gene_hashes, errors, output_directory, layout="flat"):
+    for gene, assocs in gene_groups:
+        if journal.is_done(gene):
+            if manifest:
+                update_manifest(manifest, gene, gene_hashes, errors, output_directory, layout)
+            continue
+        yield gene, assocs
+
+
+def journal_finished_gene(journal, gene, errors, output_directory, nquads_writer=None, layout="flat"):
+    if nquads_writer:
+        journal.record(gene, None, errors.errors.get(gene, []), nquads_offset=nquads_writer.checkpoint())
+    else:
+        journal.record(gene, model_output_path(gene, output_directory, layout), errors.errors.get(gene, []))
+
+
+# Populated by the parent process right before forking the worker pool
+WORKER_CONTEXT = {}
+
+
+def translate_in_worker(task):
+    gene, assocs = task
+    builder = WORKER_CONTEXT["builder"]
+    # Fresh timer per task - the parent merges it into the run's totals
+    builder.stage_timer = StageTimer()
+    gene_errors = GeneErrorSet()
+    model_data = None
+    model = make_model_and_write_out(builder, gene, assocs, gene_errors,
+                                     output_directory=WORKER_CONTEXT["output_directory"],
+                                     write_file=not (WORKER_CONTEXT["nquads"] or WORKER_CONTEXT["archive"]),
+                                     fast_writer=WORKER_CONTEXT["fast_writer"],
+                                     layout=WORKER_CONTEXT["layout"])
+    if model is not None:
+        # Only the parent writes to the N-Quads file or archive, so ship this model's serialization back
+        if WORKER_CONTEXT["nquads"]:
+            with builder.stage_timer.stage("write"):
+                model_data = model_nquads(model)
+        elif WORKER_CONTEXT["archive"]:
+            with builder.stage_timer.stage("write"):
+                model_data = model.serialize(fast=WORKER_CONTEXT["fast_writer"])
+        model.close()
+    # The task's records were unpickled onto this worker's shared line store - don't keep the GPAD open between tasks
+    close_line_stores()
+    return gene, gene_errors, model_data, builder.stage_timer
+
+
+def imap_bounded(pool, func, iterable, max_in_flight):
+    # Pool.imap drains its whole input up front, so submit tasks in a bounded window instead
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
 
 
 if __name__ == "__main__":
     args = parser.parse_args()
+    if args.incremental and (args.nquads or not args.output_directory):
+        parser.error("--incremental needs --output_directory and can't be combined with --nquads")
+    if args.archive and (args.nquads or args.output_directory or args.resume):
+        parser.error("--archive can't be combined with --nquads, --output_directory or --resume")
 
     filter_rule = get_filter_rule(args.mod)
 
-    gpad_file = handle_gpad_file(args.gpad_file)
-    relevant_header_data = parse_header(gpad_file)
+    gpad_source = GpadSource(args.gpad_file)
+    relevant_header_data = gpad_source.read_header()
     gpad_file_metadata = {
         "source_path": args.gpad_file,
         # TODO: Figure out how to get real creation date from file
-        "download_date": time.ctime(path.getmtime(gpad_file)),
+        "download_date": gpad_source.download_date(),
         "header_date": relevant_header_data["date"]
     }
 
-    extractor = AssocExtractor(gpad_file, filter_rule)
-    assocs_by_gene = extractor.group_assocs()
-    logger.debug("{} distinct genes".format(len(assocs_by_gene)))
+    stage_timer = StageTimer()
+    run_start = StageTimer.clock()
+    specific_genes = args.specific_gene.split(",") if args.specific_gene else None
+    gpad_cache = None
+    if args.gpad_cache:
+        with stage_timer.stage("parse", count=0):
+            gpad_cache = load_gpad_cache(gpad_source, strict=bool(args.strict_gpad))
+    if args.stream:
+        extractor = StreamingAssocExtractor(gpad_source, filter_rule, stage_timer=stage_timer,
+                                            strict=bool(args.strict_gpad), gpad_cache=gpad_cache)
+        gene_groups = extractor.group_assocs()
+    else:
+        extractor = AssocExtractor(gpad_source, filter_rule, stage_timer=stage_timer, strict=bool(args.strict_gpad),
+                                   gpad_cache=gpad_cache, genes=specific_genes)
+        assocs_by_gene = extractor.group_assocs()
+        logger.debug("{} distinct genes".format(len(assocs_by_gene)))
+        gene_groups = assocs_by_gene.items()
 
-    builder = GoCamBuilder()
+    builder = GoCamBuilder(OntologySnapshotCache(args.ontology_snapshot_dir, offline=args.offline),
+                           stage_timer=stage_timer, deterministic_ids=args.deterministic_ids,
+                           template_cache_size=args.template_cache_size)
     errors = GeneErrorSet()  # Errors by gene ID
 
-    def make_model_and_write_out(gene, nquads=False):
-        # All these shenanigans are to prevent mid-run crashes due to an external resource simply blipping
-        # out for a second.
-        retry_count = 0
-        retry_limit = 5
-        while True:
-            try:
-                start_time = time.time()
-                model = builder.translate_to_model(gene, assocs_by_gene[gene])
-                # add_to_conjunctive_graph(model, conjunctive_graph)
-                if nquads:
-                    logger.info(
-                        "Model for {} added to graphstore in {} sec".format(gene, (time.time() - start_time)))
-                else:
-                    out_filename = "{}.ttl".format(gene.replace(":", "_"))
-                    if args.output_directory:
-                        out_filename = path.join(args.output_directory, out_filename)
-                    model.write(out_filename)
-                    logger.info("Model for {} written to {} in {} sec".format(gene, out_filename, (time.time() - start_time)))
-            except GocamgenException as ex:
-                errors.add_error(gene, ex)
-            except (TimeoutError, ConnectionError) as ex:
-                # This has been happening randomly and breaking full runs
-                errors.add_error(gene, ex)
-                if retry_count < retry_limit:
-                    retry_count += 1
-                    continue  # retry
-                errors.add_error(gene, GocamgenException(f"Bailing on model for {gene} after {retry_count} retries"))
-            break  # Done with this model. Move on to the next one.
-
-
-    model_count = 0
-    if args.specific_gene:
-        for specific_gene in args.specific_gene.split(","):
-            if specific_gene not in assocs_by_gene:
-                logger.error("ERROR: specific gene {} not found in filtered annotation list".format(specific_gene))
-            else:
-                logger.debug("{} filtered annotations to translate for {}".format(len(assocs_by_gene[specific_gene]), specific_gene))
-                make_model_and_write_out(specific_gene, args.nquads)
+    if specific_genes:
+        gene_groups = select_genes(gene_groups, specific_genes)
+    elif args.max_model_limit:
+        gene_groups = islice(gene_groups, int(args.max_model_limit))
+
+    manifest = None
+    gene_hashes = {}  # Hashes of genes being (re)generated, recorded in the manifest once written
+    seen_genes = set()
+    if args.incremental:
+        output_options = {"layout": args.layout, "deterministic_ids": bool(args.deterministic_ids),
+                          "fast_writer": bool(args.fast_writer)}
+        context_hash = run_context_hash(builder.snapshot_cache.fingerprints, filter_rule, output_options)
+        manifest = ModelManifest(ModelManifest.manifest_path_for(args.output_directory), context_hash).load()
+        gene_groups = skip_unchanged_genes(gene_groups, manifest, context_hash, gene_hashes, seen_genes,
+                                           args.output_directory, args.layout)
+
+    journal = RunJournal(RunJournal.journal_path_for(args.output_directory, args.nquads or args.archive),
+                         run_params={"gpad_file": args.gpad_file, "mod": args.mod,
+                                     "output_directory": args.output_directory, "nquads": args.nquads,
+                                     "layout": args.layout})
+    if args.resume:
+        try:
+            journal.load()
+        except ValueError as ex:
+            parser.error(str(ex))
+        journal.restore_errors(errors)
+        logger.info("Resuming run - {} genes already done according to {}".format(len(journal.entries),
+                                                                                 journal.journal_path))
+        gene_groups = skip_journaled_genes(gene_groups, journal, manifest, gene_hashes, errors, args.output_directory,
+                                           args.layout)
+    journal.open(resume=args.resume)
+
+    model_count = len(journal.entries)
+    nquads_writer = None
+    if args.nquads:
+        nquads_writer = NQuadsWriter(args.nquads, resume_offset=journal.nquads_offset)
+    archive_writer = None
+    if args.archive:
+        archive_writer = ModelArchiveWriter(args.archive)
+    if args.workers > 1:
+        # Fork only after GoCamBuilder has loaded its ontologies so every worker shares them copy-on-write
+        WORKER_CONTEXT["builder"] = builder
+        WORKER_CONTEXT["output_directory"] = args.output_directory
+        WORKER_CONTEXT["nquads"] = args.nquads
+        WORKER_CONTEXT["fast_writer"] = args.fast_writer
+        WORKER_CONTEXT["archive"] = args.archive
+        WORKER_CONTEXT["layout"] = args.layout
+        with multiprocessing.get_context("fork").Pool(processes=args.workers) as pool:
+            for gene, gene_errors, model_data, task_timer in imap_bounded(pool, translate_in_worker, gene_groups,
+                                                                          max_in_flight=args.workers * 4):
+                errors.merge(gene_errors)
+                stage_timer.merge(task_timer)
+                if model_data:
+                    if nquads_writer:
+                        nquads_writer.write_data(model_data)
+                    else:
+                        archive_writer.write_data(gene, model_output_path(gene, layout=args.layout), model_data)
+                journal_finished_gene(journal, gene, errors, args.output_directory, nquads_writer, args.layout)
+                if manifest:
+                    update_manifest(manifest, gene, gene_hashes, errors, args.output_directory, args.layout)
                 model_count += 1
     else:
-        for gene in assocs_by_gene:
-            make_model_and_write_out(gene, args.nquads)
+        for gene, assocs in gene_groups:
+            model = make_model_and_write_out(builder, gene, assocs, errors,
+                                             output_directory=args.output_directory,
+                                             write_file=not (args.nquads or args.archive),
+                                             fast_writer=args.fast_writer, layout=args.layout)
+            if model is not None:
+                if nquads_writer:
+                    with stage_timer.stage("write"):
+                        nquads_writer.write_model(model)
+                elif archive_writer:
+                    with stage_timer.stage("write"):
+                        archive_writer.write_data(gene, model_output_path(gene, layout=args.layout),
+                                                  model.serialize(fast=args.fast_writer))
+                model.close()
+            journal_finished_gene(journal, gene, errors, args.output_directory, nquads_writer, args.layout)
+            if manifest:
+                update_manifest(manifest, gene, gene_hashes, errors, args.output_directory, args.layout)
             model_count += 1
-            if args.max_model_limit and model_count == int(args.max_model_limit):
-                break
+    if nquads_writer:
+        nquads_writer.close()
+    if archive_writer:
+        archive_writer.close()
+    journal.close()
+    stage_timer.add_since("total", run_start, count=model_count)
 
-    if args.nquads:
-        cg = ConjunctiveGraph(builder.store)
-        cg.serialize(destination=args.nquads, format="nquads")
-        logger.info(f"Full model graphstore written out in N-Quads format to {args.nquads}")
+    if manifest:
+        if not (args.specific_gene or args.max_model_limit):
+            # Only a full pass knows which genes are really gone
+            for gene in manifest.remove_missing_genes(seen_genes):
+                logger.info("Removed model for {} - gene no longer has annotations".format(gene))
+        manifest.save()
+        logger.info("{} of {} genes unchanged since last run".format(len(seen_genes) - model_count, len(seen_genes)))
 
     if args.report:
-        report_file_path = "{}.report".format(gpad_file)
+        report_file_path = gpad_source.report_path()
         with open(report_file_path, "w+") as reportf:
             for k in gpad_file_metadata:
                 reportf.write("{}: {}\n".format(k, gpad_file_metadata[k]))
@@ -209,5 +588,11 @@ if __name__ == "__main__":
             reportf.write("# of models generated: {}\n".format(model_count))
             for gene, errs in errors.errors.items():
                 for ex in errs:
-                    reportf.write(f"{type(ex).__name__} - {gene}: {ex}\n")
+                    reportf.write(f"{error_type_name(ex)} - {gene}: {ex}\n")
+            # Worker stages sum CPU/wall across processes, so they can add up to more than "total"
+            reportf.write("# Stage timings\n")
+            for timing_line in stage_timer.summary_lines():
+                reportf.write("{}\n".format(timing_line))
+            reportf.write("# Stage timings (JSON)\n")
+            reportf.write("{}\n".format(stage_timer.to_json()))
         logger.info("Report file generated at {}".format(report_file_path))
@@ -0,0 +1,117 @@
+import networkx
+import numpy as np
+
+ISA_RELATION = "subClassOf"
+
+
+class AncestorClosureIndex:
+    """
+    Reflexive ancestor closures of every term in an ontology, over is_a only and over all relations. Terms are
+    numbered densely and each closure is a sorted row of term numbers. For every root that gets asked about,
+    the index also keeps a packed bitset over all terms of which ones have that root as an ancestor, so
+    "is X under R" is a single bit test from then on.
+    """
+
+    def __init__(self, terms, isa_closure, all_closure):
+        self.terms = terms
+        self.term_ids = {term: idx for idx, term in enumerate(terms)}
+        self.closures = {True: isa_closure, False: all_closure}  # isa_only -> (indptr, indices)
+        self.root_bits = {}  # (root, isa_only) -> packed bits, 1 per term
+
+    @staticmethod
+    def from_ontology(ontology):
+        graph = ontology.get_graph()
+        terms = sorted(graph.nodes())
+        term_ids = {term: idx for idx, term in enumerate(terms)}
+        isa_parents = networkx.DiGraph()
+        all_parents = networkx.DiGraph()
+        isa_parents.add_nodes_from(range(len(terms)))
+        all_parents.add_nodes_from(range(len(terms)))
+        # ontobio edges point parent -> child
+        for parent, child, data in graph.edges(data=True):
+            all_parents.add_edge(term_ids[child], term_ids[parent])
+            if data.get("pred") == ISA_RELATION:
+                isa_parents.add_edge(term_ids[child], term_ids[parent])
+        return AncestorClosureIndex(terms, closure_rows(isa_parents), closure_rows(all_parents))
+
+    def to_data(self):
+        return {"terms": self.terms, "isa_closure": self.closures[True], "all_closure": self.closures[False]}
+
+    @staticmethod
+    def from_data(data):
+        return AncestorClosureIndex(data["terms"], data["isa_closure"], data["all_closure"])
+
+    def term_id(self, term):
+        return self.term_ids.get(term)
+
+    def closure_row(self, term_id, isa_only=False):
+        indptr, indices = self.closures[isa_only]
+        return indices[indptr[term_id]:indptr[term_id + 1]]
+
+    def descendant_bits(self, root, isa_only=False):
+        # Packed bitset of the terms root is a (reflexive) ancestor of. Built the first time a root is asked about.
+        key = (root, isa_only)
+        bits = self.root_bits.get(key)
+        if bits is None:
+            is_descendant = np.zeros(len(self.terms), dtype=bool)
+            root_id = self.term_id(root)
+            if root_id is not None:
+                indptr, indices = self.closures[isa_only]
+                rows = np.repeat(np.arange(len(self.terms)), np.diff(indptr))
+                is_descendant[rows[indices == root_id]] = True
+            bits = np.packbits(is_descendant)
+            self.root_bits[key] = bits
+        return bits
+
+    def is_under(self, term, root, isa_only=False):
+        term_id = self.term_id(term)
+        if term_id is None:
+            # Not in the ontology - only its own ancestor, same as ontology.ancestors(term, reflexive=True)
+            return term == root
+        bits = self.descendant_bits(root, isa_only)
+        return bool((bits[term_id >> 3] >> (7 - (term_id & 7))) & 1)
+
+    def under_root(self, terms, root, isa_only=False):
+        # Vectorized is_under() - a bool array parallel to terms
+        term_ids = np.array([self.term_ids.get(term, -1) for term in terms], dtype=np.int64)
+        known = term_ids >= 0
+        result = np.array([term == root for term in terms], dtype=bool)
+        if known.any():
+            bits = np.unpackbits(self.descendant_bits(root, isa_only), count=len(self.terms)).astype(bool)
+            result[known] = bits[term_ids[known]]
+        return result
+
+    def ancestors(self, term, isa_only=False, reflexive=True):
+        term_id = self.term_id(term)
+        if term_id is None:
+            return [term] if reflexive else []
+        ancestors = [self.terms[a] for a in self.closure_row(term_id, isa_only)]
+        if not reflexive:
+            ancestors.remove(term)
+        return ancestors
+
+    def bulk_ancestors(self, terms, isa_only=False, reflexive=True):
+        return {term: self.ancestors(term, isa_only, reflexive) for term in terms}
+
+
+def closure_rows(parent_graph):
+    # parent_graph edges point child -> parent. Cycles (e.g. through part_of/has_part) are collapsed into strongly
+    # connected components first, so every member of a cycle gets the same closure.
+    components = networkx.condensation(parent_graph)
+    members = components.graph["mapping"]  # term number -> component
+    component_closures = {}
+    for component in reversed(list(networkx.topological_sort(components))):
+        parts = [np.array(sorted(components.nodes[component]["members"]), dtype=np.int32)]
+        parts.extend(component_closures[parent] for parent in components.successors(component))
+        component_closures[component] = np.unique(np.concatenate(parts))
+    rows = [component_closures[members[term_id]] for term_id in range(parent_graph.number_of_nodes())]
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(row) for row in rows])
+    indices = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int32)
+    return indptr, indices
+
+
+def load_closure_index(snapshot_cache, go_handle, go_ontology):
+    data = snapshot_cache.load_derived("go_closure", [go_handle],
+                                       lambda: AncestorClosureIndex.from_ontology(go_ontology).to_data())
+    return AncestorClosureIndex.from_data(data)
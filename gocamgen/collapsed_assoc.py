@@ -2,18 +2,21 @@ from typing import List
 from ontobio.ontol_factory import OntologyFactory
 from ontobio.io.gpadparser import GpadParser
 from ontobio.io.assocparser import SplitLine
+from gocamgen.utils import sort_terms_by_ontology_specificity
 
 GPAD_PARSER = GpadParser()
 BINDING_ROOT = "GO:0005488"  # binding
 IPI_ECO_CODE = "ECO:0000353"
+NESTED_EXTENSION_RELATIONS = ['occurs_in', 'part_of']  # Switch to turn on/off extension nesting
 
 
 class CollapsedAssociationSet:
     def __init__(self, associations):
         self.associations = associations
         self.collapsed_associations = []
-        self.assoc_dict = {}
+        self.assoc_dict = {}  # header_key() -> CollapsedAssociation, in the order they were created
         self.go_ontology = None
+        self.closure_index = None
 
     def setup_ontologies(self):
         if self.go_ontology is None:
@@ -46,9 +49,9 @@ class CollapsedAssociationSet:
             with_from = a["evidence"]["with_support_from"]
             eco_code = a["evidence"]["type"]
             extensions = get_annot_extensions(a)
-            with_froms = get_with_froms(a)  # Handle pipe separation according to import requirements
-            is_protein_binding = eco_code == IPI_ECO_CODE and BINDING_ROOT in self.go_ontology.ancestors(term, reflexive=True)
+            is_protein_binding = eco_code == IPI_ECO_CODE and self.is_binding_term(term)
             if is_protein_binding:
+                with_froms = get_with_froms(a)  # Handle pipe separation according to import requirements
                 cas = self.find_or_create_collapsed_associations(subj_id, qualifiers, term, with_froms, extensions)
                 with_from = None  # Don't use ontobio-parsed with_from on lines
             else:
@@ -57,6 +60,13 @@ class CollapsedAssociationSet:
                 # Line
                 association_line = CollapsedAssociationLine(a, with_from)
                 ca.lines.append(association_line)
+        for ca in self.collapsed_associations:
+            ca.extension_sets()
+
+    def is_binding_term(self, term):
+        if self.closure_index is not None:
+            return self.closure_index.is_under(term, BINDING_ROOT)
+        return BINDING_ROOT in self.go_ontology.ancestors(term, reflexive=True)
 
     def find_or_create_collapsed_association(self, subj_id, qualifiers, term, with_from, extensions):
         query_header = {
@@ -71,12 +81,13 @@ class CollapsedAssociationSet:
         }
         if with_from:
             query_header['evidence'] = {'with_support_from': sorted(with_from)}
-        for ca in self.collapsed_associations:
-            if ca.header == query_header:
-                return ca
-        new_ca = CollapsedAssociation(query_header)
-        self.collapsed_associations.append(new_ca)
-        return new_ca
+        key = header_key(query_header)
+        ca = self.assoc_dict.get(key)
+        if ca is None:
+            ca = CollapsedAssociation(query_header)
+            self.assoc_dict[key] = ca
+            self.collapsed_associations.append(ca)
+        return ca
 
     def find_or_create_collapsed_associations(self, subj_id, qualifiers, term, with_froms, extensions):
         cas = []
@@ -93,6 +104,7 @@ class CollapsedAssociation:
     def __init__(self, header):
         self.header = header
         self.lines: List[CollapsedAssociationLine] = []
+        self.normalized_extension_sets = None
 
     def subject_id(self):
         if "subject" in self.header and "id" in self.header["subject"]:
@@ -107,6 +119,12 @@ class CollapsedAssociation:
             return self.header["object_extensions"].get("union_of")
         return {}
 
+    def extension_sets(self):
+        # Ready-to-translate ExtensionSets, worked out once per collapsed association
+        if self.normalized_extension_sets is None:
+            self.normalized_extension_sets = normalize_extension_sets(self.annot_extensions() or [])
+        return self.normalized_extension_sets
+
     def qualifiers(self):
         return self.header.get("qualifiers")
 
@@ -123,8 +141,10 @@ class CollapsedAssociation:
 
 
 class CollapsedAssociationLine:
+    __slots__ = ("assoc", "references", "evidence_code", "date", "assigned_by", "annotation_properties", "with_from")
+
     def __init__(self, assoc, with_from=None):
-        self.source_line = assoc["source_line"]
+        self.assoc = assoc  # Source line is only read back from this when an evidence comment needs it
         self.references = sorted(assoc["evidence"]["has_supporting_reference"])
         self.evidence_code = assoc["evidence"]["type"]
         self.date = assoc["date"]
@@ -135,6 +155,10 @@ class CollapsedAssociationLine:
         if "annotation_properties" in assoc:
             self.annotation_properties = assoc["annotation_properties"]
 
+    @property
+    def source_line(self):
+        return self.assoc["source_line"]
+
     def as_dict(self):
         ds = {
             "source_line": self.source_line,
@@ -152,6 +176,94 @@ class CollapsedAssociationLine:
         return ds
 
 
+class ExtensionSet:
+    """
+    One intersection of annotation extensions in canonical form: (relation, filler) tuples, deduped, with
+    repeated occurs_in/part_of fillers pulled out into specific-to-general chains for nesting.
+    """
+
+    def __init__(self, extensions):
+        self.extensions = extensions  # Tuple of (relation, filler) in GPAD order
+        nested = []
+        nested_relations = set()
+        for relation in NESTED_EXTENSION_RELATIONS:
+            fillers = [filler for rel, filler in extensions if rel == relation]
+            if len(fillers) > 1:
+                try:
+                    nested.append((relation, tuple(sort_terms_by_ontology_specificity(list(fillers))), True))
+                except KeyError:
+                    # Unknown ontology. Left for translate to raise on, same as before this was precomputed,
+                    # since only extension sets following the rules get nested.
+                    nested.append((relation, tuple(fillers), False))
+                nested_relations.add(relation)
+        self.nested = tuple(nested)  # (relation, fillers, is_sorted)
+        self.unnested = tuple(ext for ext in extensions if ext[0] not in nested_relations)
+
+    def as_dicts(self):
+        return [{"property": relation, "filler": filler} for relation, filler in self.extensions]
+
+    def key(self):
+        # Extension order within an intersection doesn't change its meaning
+        return frozenset(self.extensions)
+
+    def __eq__(self, other):
+        return isinstance(other, ExtensionSet) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __str__(self):
+        return ",".join("{}({})".format(relation, filler) for relation, filler in self.extensions)
+
+
+def dedupe_extension_tuples(extensions):
+    return tuple(dict.fromkeys((ext["property"], ext["filler"]) for ext in extensions))
+
+
+def normalize_extension_sets(union_of):
+    ext_sets = []
+    seen = set()  # Order-independent, so e.g. split sets that come out of two different splits aren't repeated
+    for uo in union_of:
+        exts = dedupe_extension_tuples(uo["intersection_of"])
+        if frozenset(exts) not in seen:
+            seen.add(frozenset(exts))
+            ext_sets.append(exts)
+    split_sets = set()
+    # Split on multiple occurs_in's to the same ontology, one set per occurs_in. Split sets are themselves
+    # checked again, so occurs_in's repeated across several ontologies end up fully split.
+    idx = 0
+    while idx < len(ext_sets):
+        exts = ext_sets[idx]
+        idx += 1
+        onto_grouping = {}
+        for ext in exts:
+            if ext[0] == "occurs_in":
+                onto_grouping.setdefault(ext[1].split(":")[0], []).append(ext)
+        for ont_prefix, occurs_in_exts in onto_grouping.items():
+            if len(occurs_in_exts) > 1:
+                split_sets.add(exts)
+                other_exts = tuple(ext for ext in exts if ext[0] != "occurs_in" or ext[1].split(":")[0] != ont_prefix)
+                for ext in occurs_in_exts:
+                    new_exts = other_exts + (ext,)
+                    if frozenset(new_exts) not in seen:
+                        seen.add(frozenset(new_exts))
+                        ext_sets.append(new_exts)
+    return [ExtensionSet(exts) for exts in ext_sets if exts not in split_sets]
+
+
+def freeze(value):
+    # Hashable stand-in for a JSON-like value that's equal exactly when the values are ==
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def header_key(header):
+    return freeze(header)
+
+
 def get_annot_extensions(annot):
     if "object_extensions" in annot:
         return annot["object_extensions"]
@@ -161,7 +273,16 @@ def get_annot_extensions(annot):
 
 
 def get_with_froms(annot):
-    source_line = annot["source_line"]
+    with_from_groups = getattr(annot, "with_from_groups", None)
+    if with_from_groups is not None:
+        # Already split by GpadReader
+        return [list(group) for group in with_from_groups]
+    # A plain ontobio association only has its with/froms merged into one list, so each is its own pipe group.
+    # An empty column is still one (empty) group, same as GpadReader.
+    return [[with_from] for with_from in annot["evidence"]["with_support_from"]] or [[]]
+
+
+def with_from_groups_from_line(source_line):
     vals = source_line.split("\t")
     with_from_col = vals[6]
     # Parse into array (by "|") of arrays (by ",")
@@ -190,6 +311,9 @@ def extract_properties_from_string(prop_col):
 
 
 def extract_properties(annot):
+    if hasattr(annot, "annotation_properties"):
+        # GpadRecord, parsed when the line was read
+        return annot
     cols = annot["source_line"].rstrip().split("\t")
     if len(cols) >= 12:
         prop_col = cols[11]
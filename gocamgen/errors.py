@@ -14,6 +14,19 @@ class ShexException(GocamgenException):
     pass
 
 
+class JournaledError(GocamgenException):
+    # Error restored from a run journal on --resume. Reports under the original exception's type name.
+    def __init__(self, type_name, message):
+        GocamgenException.__init__(self, message)
+        self.type_name = type_name
+
+
+def error_type_name(error):
+    if isinstance(error, JournaledError):
+        return error.type_name
+    return type(error).__name__
+
+
 class GeneErrorSet:
     def __init__(self):
         self.errors = {}
@@ -22,3 +35,8 @@ class GeneErrorSet:
         if gene not in self.errors:
             self.errors[gene] = []
         self.errors[gene].append(error)
+
+    def merge(self, other_error_set):
+        for gene, errs in other_error_set.errors.items():
+            for ex in errs:
+                self.add_error(gene, ex)
@@ -33,6 +33,37 @@ class FilterRule(ABC):
         if rule_ds.get("unwanted_properties") is not None:
             self.unwanted_properties = rule_ds["unwanted_properties"]
 
+    def compile(self, eco_code):
+        # The rule as a single predicate over sets, built once. eco_code maps an ECO class to its GAF evidence code.
+        unwanted_codes = frozenset(self.unwanted_evidence_codes)
+        unwanted_refs_by_code = {}
+        for code, ref in self.unwanted_evi_code_ref_combos:
+            unwanted_refs_by_code.setdefault(code, set()).add(ref)
+        unwanted_properties = frozenset(self.unwanted_properties)
+        # Attribute -> values any one of which meets the requirement, e.g. the allowed provided_by's
+        allowed_values = {}
+        for attr in self.required_attributes:
+            for k, values in attr.items():
+                allowed_values.setdefault(k, set()).update(values)
+        allowed_values = list(allowed_values.items())
+
+        def predicate(assoc):
+            evidence = assoc["evidence"]
+            evi_code = eco_code(evidence["type"])
+            if evi_code in unwanted_codes:
+                return False
+            unwanted_refs = unwanted_refs_by_code.get(evi_code)
+            if unwanted_refs is not None and not unwanted_refs.isdisjoint(evidence["has_supporting_reference"]):
+                return False
+            if unwanted_properties and "annotation_properties" in assoc \
+                    and not unwanted_properties.isdisjoint(assoc["annotation_properties"]):
+                return False
+            if allowed_values and not any(assoc[k] in values for k, values in allowed_values):
+                return False
+            return True
+
+        return predicate
+
     @abstractmethod
     def mod_id(self):
         pass
@@ -82,27 +113,20 @@ class AssocFilter:
     def __init__(self, filter_rule : FilterRule):
         self.filter_rule = filter_rule
         self.ecomap = EcoMap()
+        self.eco_codes = {}  # ECO class -> GAF code, filled in as each distinct ECO class turns up
+        self.predicate = filter_rule.compile(self.eco_code)
+
+    def eco_code(self, eco_class):
+        try:
+            return self.eco_codes[eco_class]
+        except KeyError:
+            evi_code = self.ecomap.ecoclass_to_coderef(eco_class)[0]
+            self.eco_codes[eco_class] = evi_code
+            return evi_code
 
     def validate_line(self, assoc):
-        evi_code = self.ecomap.ecoclass_to_coderef(assoc["evidence"]["type"])[0]
-        if evi_code in self.filter_rule.unwanted_evidence_codes:
-            return False
-        if len(self.filter_rule.unwanted_evi_code_ref_combos) > 0:
-            references = assoc["evidence"]["has_supporting_reference"]
-            for evi_ref_combo in self.filter_rule.unwanted_evi_code_ref_combos:
-                if evi_ref_combo[0] == evi_code and evi_ref_combo[1] in references:
-                    return False
-        if len(self.filter_rule.unwanted_properties) > 0 and "annotation_properties" in assoc:
-            for up in self.filter_rule.unwanted_properties:
-                if up in assoc["annotation_properties"]:
-                    return False
-        if len(self.filter_rule.required_attributes) > 0:
-            meets_requirement = False
-            for attr in self.filter_rule.required_attributes:
-                # a[attr] is dict
-                for k in attr.keys():
-                    if assoc[k] in attr[k]:
-                        meets_requirement = True
-            if not meets_requirement:
-                return False
-        return True
\ No newline at end of file
+        return self.predicate(assoc)
+
+    def filter(self, assocs):
+        predicate = self.predicate
+        return [a for a in assocs if predicate(a)]
@@ -1,4 +1,4 @@
-from ontobio.rdfgen.assoc_rdfgen import CamRdfTransform, TurtleRdfWriter, genid, prefix_context
+from ontobio.rdfgen.assoc_rdfgen import CamRdfTransform, TurtleRdfWriter, prefix_context
 from ontobio.vocabulary.relations import OboRO, Evidence
 from ontobio.vocabulary.upper import UpperLevel
 # from ontobio.util.go_utils import GoAspector
@@ -8,16 +8,22 @@ from rdflib.namespace import OWL, RDF
 from rdflib import Literal
 from rdflib.term import URIRef
 from rdflib.namespace import Namespace
-import rdflib
 # import networkx
 # import logging
 # import argparse
 import datetime
+import io
 import os.path as path
 import logging
 from gocamgen.triple_pattern_finder import TriplePattern, TriplePatternFinder
 from gocamgen.subgraphs import AnnotationSubgraph
 from gocamgen.collapsed_assoc import CollapsedAssociationSet, CollapsedAssociation
+from gocamgen.stage_timer import StageTimer
+from gocamgen.writers import FastTripleWriter, write_graph_fast
+from gocamgen.triple_buffer import TripleBuffer
+from gocamgen.iri_minter import IriMinter, collapsed_association_scope, latest_annotation_date
+from gocamgen.relations import RelationResolver, RelationAlgebra
+from gocamgen.template_cache import AnnotationTemplate, GENE_PLACEHOLDER, annotation_shape_key
 from gocamgen.utils import sort_terms_by_ontology_specificity, ShexHelper, ShexException
 
 
@@ -91,16 +97,23 @@ REGULATES_CHAIN_RELATIONS = [
 SHEX_HELPER = ShexHelper()
 
 
-def has_regulation_target_bucket(ontology, term):
-    ancestors = ontology.ancestors(term, reflexive=True)
+def has_regulation_target_bucket(ontology, term, closure_index=None):
+    if closure_index is not None:
+        def is_under(root):
+            return closure_index.is_under(term, root)
+    else:
+        ancestors = ontology.ancestors(term, reflexive=True)
+
+        def is_under(root):
+            return root in ancestors
     buckets = []
-    if "GO:0065009" in ancestors:
+    if is_under("GO:0065009"):
         buckets.append("a")
-    if "GO:0010468" in ancestors:
+    if is_under("GO:0010468"):
         buckets.append("b")
-    if "GO:0002092" in ancestors or "GO:0042176" in ancestors:
+    if is_under("GO:0002092") or is_under("GO:0042176"):
         buckets.append("c")
-    if "GO:0019538" in ancestors or "GO:0032880" in ancestors:
+    if is_under("GO:0019538") or is_under("GO:0032880"):
         buckets.append("d")
     return buckets
 
@@ -128,16 +141,25 @@ class GoCamEvidence:
         self.with_from = with_from
         self.id = None
 
+    def key(self):
+        # Everything that ends up on the evidence individual. Evidences with equal keys can share one individual.
+        return (self.evidence_code, tuple(sorted(self.references)), self.date, tuple(sorted(self.contributors)),
+                self.with_from)
+
     @staticmethod
     def create_from_annotation(annot):
-        evidence_code = annot["evidence"]["type"]
-        references = annot["evidence"]["has_supporting_reference"]
-        annot_date = "{0:%Y-%m-%d}".format(datetime.datetime.strptime(annot["date"], "%Y%m%d"))
-        source_line = annot["source_line"].rstrip().replace("\t", " ")
+        return GoCamEvidence.create_from_fields(annot["evidence"]["type"],
+                                                annot["evidence"]["has_supporting_reference"],
+                                                annot["date"], annot["source_line"], annot.get("annotation_properties"))
+
+    @staticmethod
+    def create_from_fields(evidence_code, references, date, source_line, annotation_properties=None):
+        annot_date = "{0:%Y-%m-%d}".format(datetime.datetime.strptime(date, "%Y%m%d"))
+        source_line = source_line.rstrip().replace("\t", " ")
         # contributors = handle_annot_properties() # Need annot_properties to be parsed w/ GpadParser first
         contributors = []
-        if "annotation_properties" in annot and "contributor" in annot["annotation_properties"]:
-            contributors = annot["annotation_properties"]["contributor"]
+        if annotation_properties and "contributor" in annotation_properties:
+            contributors = annotation_properties["contributor"]
         if len(contributors) == 0:
             contributors = [GoCamEvidence.DEFAULT_CONTRIBUTOR]
 
@@ -150,7 +172,8 @@ class GoCamEvidence:
     def create_from_collapsed_association(collapsed_association: CollapsedAssociation):
         evidences = []
         for line in collapsed_association:
-            evidence = GoCamEvidence.create_from_annotation(line.as_dict())
+            evidence = GoCamEvidence.create_from_fields(line.evidence_code, line.references, line.date,
+                                                        line.source_line, line.annotation_properties)
             if line.with_from:
                 evidence.with_from = ",".join(line.with_from)
             evidences.append(evidence)
@@ -181,26 +204,48 @@ class GoCamModel():
         "located_in": "RO:0001025",
     }
 
-    def __init__(self, modeltitle, connection_relations=None, store=None):
-        cam_writer = CamTurtleRdfWriter(modeltitle, store=store)
+    def __init__(self, modeltitle, connection_relations=None, store=None, iri_minter=None, model_date=None):
+        cam_writer = CamTurtleRdfWriter(modeltitle, store=store, iri_minter=iri_minter, model_date=model_date)
         self.writer = AnnotonCamRdfTransform(cam_writer)
         self.modeltitle = modeltitle
         self.classes = []
         self.individuals = {}   # Maintain entity-to-IRI dictionary. Prevents dup individuals but we may want dups?
-        # TODO: Refactor to make graph more prominent
-        self.graph = self.writer.writer.graph
         if connection_relations is None:
             self.connection_relations = GoCamModel.relations_dict
         else:
             self.connection_relations = connection_relations
         self.declare_properties()
 
-    def write(self, filename, format='ttl'):
-        if path.splitext(filename)[1] != ".ttl":
-            filename += ".ttl"
+    @property
+    def graph(self):
+        # Translation builds into the writer's TripleBuffer - the rdflib Graph only gets made on first access
+        return self.writer.writer.graph
+
+    def write(self, filename, format='ttl', fast=False):
+        extension = ".nt" if format == "nt" else ".ttl"
+        if path.splitext(filename)[1] != extension:
+            filename += extension
+        if fast:
+            # Single pass over the triples instead of rdflib's sorting, in-memory turtle serializer
+            write_graph_fast(self.writer.writer.triple_source(), filename, format)
+            return
         with open(filename, 'wb') as f:
             self.writer.writer.serialize(destination=f, format=format)
 
+    def serialize(self, format='ttl', fast=False):
+        # Same output as write() but as bytes, for sinks that aren't one file per model (e.g. archives)
+        if fast:
+            out = io.StringIO()
+            FastTripleWriter(self.writer.writer.triple_source(), format).write(out)
+            return out.getvalue().encode("utf-8")
+        out = io.BytesIO()
+        self.writer.writer.serialize(destination=out, format=format)
+        return out.getvalue()
+
+    def close(self):
+        # Release the model's graph once it's been written out so long runs don't accumulate models in memory
+        self.writer.writer.close()
+
     def declare_properties(self):
         # AnnotionProperty
         self.writer.emit_type(URIRef("http://geneontology.org/lego/evidence"), OWL.AnnotationProperty)
@@ -217,10 +262,11 @@ class GoCamModel():
             self.classes.append(class_id)
 
     def declare_individual(self, entity_id):
-        entity = genid(base=self.writer.writer.base + '/')
+        entity = self.writer.writer.iri_minter.individual_iri(self.writer.writer.base + '/')
         # TODO: Make this add_to_graph
         self.writer.emit_type(entity, self.writer.uri(entity_id))
         self.writer.emit_type(entity, OWL.NamedIndividual)
+        self.writer.index_individual(entity, entity_id)
         self.individuals[entity_id] = entity
         return entity
 
@@ -233,6 +279,7 @@ class GoCamModel():
         self.writer.emit(stmt_id, OWL.annotatedSource, source_id)
         self.writer.emit(stmt_id, OWL.annotatedProperty, property_id)
         self.writer.emit(stmt_id, OWL.annotatedTarget, target_id)
+        self.writer.index_axiom(statement, stmt_id)
         self.writer.emit_type(property_id, OWL.ObjectProperty)
 
         if evidence:
@@ -275,9 +322,8 @@ class GoCamModel():
         return axiom_id
 
     def add_evidence(self, axiom, evidence: GoCamEvidence):
-        # Try finding existing evidence object containing same type and references
-        # ev_id = self.writer.find_or_create_evidence_id(ev)
-        ev_id = self.writer.create_evidence(evidence)
+        # Reuse the model's existing evidence individual if there's one with the same code, refs, date, etc.
+        ev_id = self.writer.find_or_create_evidence_id(evidence)
         self.writer.emit(axiom, URIRef("http://geneontology.org/lego/evidence"), ev_id)
         ### Emit ev fields to axiom here TODO: Couple evidence and axiom emitting together
         self.writer.emit(axiom, DC.date, Literal(evidence.date))
@@ -304,7 +350,7 @@ class GoCamModel():
                     annot_mf = source_annoton.molecular_function["object"]["id"]
                 except:
                     annot_mf = ""
-                if self.writer.writer.graph.__contains__((u,rel,None)) and gene_connection.object_id != annot_mf:
+                if self.writer.writer.contains((u, rel, None)) and gene_connection.object_id != annot_mf:
                     source_id = self.declare_individual(gene_connection.object_id)
                     source_annoton.individuals[gene_connection.object_id] = source_id
                     break
@@ -326,14 +372,11 @@ class GoCamModel():
         self.writer.emit_axiom(source_id, property_id, target_id)
 
     def uri_list_for_individual(self, individual):
-        uri_list = []
-        graph = self.writer.writer.graph
-        for t in graph.triples((None,None,self.writer.uri(individual))):
-            uri_list.append(t[0])
-        return uri_list
+        # Every individual gets typed through the writer's class index, so no need to scan the graph
+        return list(self.writer.individuals_by_class.get(individual, []))
 
     def triples_by_ids(self, subject, relation_uri, object_id):
-        graph = self.writer.writer.graph
+        graph = self.writer.writer
 
         triples = []
         if subject.__class__.__name__ == "URIRef" or subject is None:
@@ -354,13 +397,16 @@ class GoCamModel():
 
     def individual_label_for_uri(self, uri):
         ind_list = []
-        graph = self.writer.writer.graph
+        graph = self.writer.writer
         for t in graph.triples((uri, RDF.type, None)):
             if t[2] != OWL.NamedIndividual: # We know OWL.NamedIndividual triple does't contain the label so don't return it
                 ind_list.append(t[2])
         return ind_list
 
     def class_for_uri(self, uri):
+        class_curie = self.writer.class_by_individual.get(uri)
+        if class_curie is not None:
+            return class_curie
         try:
             class_curie = contract_uri_wrapper(self.individual_label_for_uri(uri)[0])[0]
             return class_curie
@@ -371,27 +417,18 @@ class GoCamModel():
         if property_uri is None:
             property_uri = OWL.annotatedSource
         axiom_list = []
-        graph = self.writer.writer.graph
+        graph = self.writer.writer
         for uri in self.uri_list_for_individual(source):
             for t in graph.triples((None, property_uri, uri)):
                 axiom_list.append(t[0])
         return axiom_list
 
     def find_bnode(self, triple):
-        (subject,predicate,object_id) = triple
-        s_triples = self.writer.writer.graph.triples((None, OWL.annotatedSource, subject))
-        s_bnodes = [s for s,p,o in s_triples]
-        p_triples = self.writer.writer.graph.triples((None, OWL.annotatedProperty, predicate))
-        p_bnodes = [s for s,p,o in p_triples]
-        o_triples = self.writer.writer.graph.triples((None, OWL.annotatedTarget, object_id))
-        o_bnodes = [s for s,p,o in o_triples]
-        bnodes = set(s_bnodes) & set(p_bnodes) & set(o_bnodes)
-        if len(bnodes) > 0:
-            return list(bnodes)[0]
+        return self.writer.find_bnode(triple)
 
     def triples_involving_individual(self, ind_id, relation=None):
         # "involving" meaning individual (URI) is either subject or object
-        graph = self.writer.writer.graph
+        graph = self.writer.writer
         found_triples = list(graph.triples((ind_id, relation, None)))
         for t in graph.triples((None, relation, ind_id)):
             if t not in found_triples:
@@ -400,215 +437,210 @@ class GoCamModel():
 
 
 class AssocGoCamModel(GoCamModel):
-    ENABLES_O_RELATION_LOOKUP = {}
-
-    def __init__(self, modeltitle, assocs, connection_relations=None, store=None):
-        GoCamModel.__init__(self, modeltitle, connection_relations, store)
+    def __init__(self, modeltitle, assocs, connection_relations=None, store=None, deterministic_ids=False):
+        iri_minter = None
+        model_date = None
+        if deterministic_ids:
+            iri_minter = IriMinter(model_key=modeltitle)
+            model_date = latest_annotation_date(assocs)
+        GoCamModel.__init__(self, modeltitle, connection_relations, store, iri_minter, model_date)
         self.associations = CollapsedAssociationSet(assocs)
         self.ontology = None
         self.ro_ontology = None
         self.gorel_ontology = None
+        self.relation_resolver = None
+        self.relation_algebra = None
+        self.closure_index = None  # Normally shared from GoCamBuilder
         self.extensions_mapper = None
         self.default_contributor = "http://orcid.org/0000-0002-6659-0416"
-        self.graph.bind("GOREL", GOREL)  # Because GOREL isn't in context.jsonld's
+        self.stage_timer = StageTimer()
+        self.template_cache = None  # Normally shared from GoCamBuilder
+        self.relation_declarations = None  # Fallback relations seen while building a template
+        self.writer.writer.bind("GOREL", GOREL)  # Because GOREL isn't in context.jsonld's
 
     def translate(self):
 
         self.associations.go_ontology = self.ontology
-        self.associations.collapse_annotations()
+        self.associations.closure_index = self.closure_index
+        with self.stage_timer.stage("collapse", count=len(self.associations.associations)):
+            self.associations.collapse_annotations()
 
         for a in self.associations:
-
-            term = a.object_id()
+            # IRIs minted for this annotation don't shift when other annotations come and go
+            self.writer.writer.iri_minter.set_scope(collapsed_association_scope(a))
 
             # Add evidences tied to axiom_ids
             evidences = GoCamEvidence.create_from_collapsed_association(a)
 
-            annotation_extensions = a.annot_extensions()
-
-            # Translate extension - maybe add function argument for custom translations?
-            if not annotation_extensions:
-                annot_subgraph = self.translate_primary_annotation(a)
-                # For annots w/o extensions, this is where we write subgraph to model
+            # This is where we write subgraphs to model
+            for annot_subgraph in self.annotation_subgraphs(a):
                 annot_subgraph.write_to_model(self, evidences)
-            else:
-                aspect = self.extensions_mapper.go_aspector.go_aspect(term)
-
-                # TODO: Handle deduping in collapsed_assoc - need access to extensions_mapper.dedupe_extensions
-                annotation_extensions = self.extensions_mapper.dedupe_extensions(annotation_extensions)
-
-                # Split on those multiple occurs_in(same NS) extensions
-                # TODO: Cleanup/refactor this splitting into separate method
-                extension_sets_to_remove = []
-                for uo in annotation_extensions:
-                    # Grab occurs_in's
-                    # Make a new uo if situation found
-                    occurs_in_exts = [ext for ext in uo['intersection_of'] if ext["property"] == "occurs_in"]
-                    # onto_grouping = {
-                    #     "CL": [{}, {}],
-                    #     "EMAPA": [{}]
-                    # }
-                    onto_grouping = {}
-                    for ext in occurs_in_exts:
-                        ont_prefix = ext["filler"].split(":")[0]
-                        if ont_prefix not in onto_grouping:
-                            onto_grouping[ont_prefix] = []
-                        onto_grouping[ont_prefix].append(ext)
-                    for ont_prefix, exts in onto_grouping.items():
-                        if len(exts) > 1:
-                            if uo not in extension_sets_to_remove:
-                                extension_sets_to_remove.append(uo)  # Remove original set when we're done splitting
-                            for ext in exts:
-                                # Create new 'intersection_of' list
-                                new_exts_list = []
-                                # Add ext to this new list if its prefix is not ont_prefix
-                                for int_of_ext in uo['intersection_of']:
-                                    if int_of_ext["property"] != "occurs_in" or int_of_ext["filler"].split(":")[0] != ont_prefix:
-                                        # Add the extensions that don't currently concern us
-                                        new_exts_list.append(int_of_ext)
-                                # Then add occurs_in ext in current iteration
-                                new_exts_list.append(ext)
-                                annotation_extensions.append({"intersection_of": new_exts_list})
-                # Remove original, un-split extension from list so it isn't translated
-                [annotation_extensions.remove(ext_set) for ext_set in extension_sets_to_remove]
-
-                for uo in annotation_extensions:
-                    int_bits = []
-                    for rel in uo["intersection_of"]:
-                        int_bits.append("{}({})".format(rel["property"], rel["filler"]))
-                    ext_str = ",".join(int_bits)
-
-                    annot_subgraph = self.translate_primary_annotation(a)
-
-                    intersection_extensions = self.extensions_mapper.dedupe_extensions(uo['intersection_of'])
-                    is_cool = self.extensions_mapper.annot_following_rules(intersection_extensions, aspect, term)
-                    # is_cool = True  # Open the flood gates
-                    if is_cool:
-                        logger.debug("GOOD: {}".format(ext_str))
-                        # Nesting repeated extension relations (i.e. occurs_in, part_of)
-                        ext_rels_to_nest = ['occurs_in', 'part_of']  # Switch to turn on/off extension nesting
-                        for ertn in ext_rels_to_nest:
-                            nest_exts = [ext for ext in intersection_extensions if ext["property"] == ertn]
-                            if len(nest_exts) > 1:
-                                # Sort by specific term to general term
-                                sorted_nest_ext_terms = sort_terms_by_ontology_specificity(
-                                    [ne["filler"] for ne in nest_exts])
-                                # Translate
-                                loc_subj_n = annot_subgraph.get_anchor()
-                                loc_subj_term = AnnotationSubgraph.node_class(loc_subj_n)
-                                for idx, ne_term in enumerate(sorted_nest_ext_terms):
-                                    # location_relation could be part_of, occurs_in, or located_in
-                                    # Figure out what types of classes these are
-                                    # Use case here is matching to ShEx shape class
-                                    subj_shape = SHEX_HELPER.shape_from_class(loc_subj_term,
-                                                                              self.extensions_mapper.go_aspector)
-                                    loc_obj_n = annot_subgraph.add_instance_of_class(ne_term)
-                                    obj_shape = SHEX_HELPER.shape_from_class(ne_term,
-                                                                             self.extensions_mapper.go_aspector)
-                                    # location_relation = "BFO:0000050"  # part_of
-                                    try:
-                                        location_relation = SHEX_HELPER.relation_lookup(subj_shape, obj_shape)
-                                    except ShexException as ex:
-                                        raise ShexException(ex.message + f" for {loc_subj_term} to {ne_term}")
-                                    if idx == 0 and ertn == "occurs_in":
-                                        location_relation = "BFO:0000066"  # occurs_in - because MF -> @<AnatomicalEntity> OR @<CellularComponent>
-                                    annot_subgraph.add_edge(loc_subj_n, location_relation, loc_obj_n)
-
-                                    loc_subj_term = ne_term  # For next iteration
-                                    loc_subj_n = loc_obj_n  # For next iteration
-                                # Remove from intersection_extensions because this is now already translated
-                                [intersection_extensions.remove(ext) for ext in nest_exts]
-                        for rel in intersection_extensions:
-                            ext_relation = rel["property"]
-                            ext_target = rel["filler"]
-                            if ext_relation not in list(INPUT_RELATIONS.keys()) + list(HAS_REGULATION_TARGET_RELATIONS.keys()):
-                                # No RO term yet. Try looking up in RO
-                                relation_term = self.translate_relation_to_ro(ext_relation)
-                                if relation_term:
-                                    # print("Ext relation {} auto-mapped to {} in {}".format(ext_relation, relation_term, a.subject_id()))
-                                    INPUT_RELATIONS[ext_relation] = relation_term
-                            if ext_relation in INPUT_RELATIONS:
+        self.extensions_mapper.go_aspector.write_cache()
+
+    def annotation_subgraphs(self, annotation: CollapsedAssociation):
+        # Subgraphs are built once per annotation shape as a gene-independent template, then filled in with the gene
+        start = StageTimer.clock()
+        key = annotation_shape_key(annotation)
+        template = None
+        if self.template_cache is not None:
+            template = self.template_cache.get(key)
+        if template is None:
+            stage = "template_miss"
+            self.relation_declarations = []
+            try:
+                template = AnnotationTemplate(self.translate_annotation_subgraphs(annotation, GENE_PLACEHOLDER),
+                                              self.relation_declarations)
+            finally:
+                self.relation_declarations = None
+            if self.template_cache is not None:
+                self.template_cache.put(key, template)
+        else:
+            stage = "template_hit"
+        for relation, relation_label in template.relation_declarations:
+            self.declare_fallback_relation(relation, relation_label)
+        annot_subgraphs = template.instantiate(annotation.subject_id())
+        self.stage_timer.add_since(stage, start)
+        return annot_subgraphs
+
+    def translate_annotation_subgraphs(self, a: CollapsedAssociation, gp_id):
+        term = a.object_id()
+        annot_subgraphs = []
+        extension_sets = a.extension_sets()
+
+        # Translate extension - maybe add function argument for custom translations?
+        if not extension_sets:
+            annot_subgraphs.append(self.translate_primary_annotation(a, gp_id))
+        else:
+            aspect = self.extensions_mapper.go_aspector.go_aspect(term)
+
+            # Deduping and splitting of multiple occurs_in(same NS) extensions is done in collapse
+            for ext_set in extension_sets:
+                ext_str = str(ext_set)
+
+                annot_subgraph = self.translate_primary_annotation(a, gp_id)
+
+                is_cool = self.extensions_mapper.annot_following_rules(ext_set.as_dicts(), aspect, term)
+                # is_cool = True  # Open the flood gates
+                if is_cool:
+                    logger.debug("GOOD: {}".format(ext_str))
+                    # Nesting repeated extension relations (i.e. occurs_in, part_of)
+                    for ertn, sorted_nest_ext_terms, is_sorted in ext_set.nested:
+                        if not is_sorted:
+                            # Raises on the unknown ontology prefix
+                            sort_terms_by_ontology_specificity(list(sorted_nest_ext_terms))
+                        # Translate
+                        loc_subj_n = annot_subgraph.get_anchor()
+                        loc_subj_term = AnnotationSubgraph.node_class(loc_subj_n)
+                        for idx, ne_term in enumerate(sorted_nest_ext_terms):
+                            # location_relation could be part_of, occurs_in, or located_in
+                            # Figure out what types of classes these are
+                            # Use case here is matching to ShEx shape class
+                            subj_shape = SHEX_HELPER.shape_from_class(loc_subj_term,
+                                                                      self.extensions_mapper.go_aspector)
+                            loc_obj_n = annot_subgraph.add_instance_of_class(ne_term)
+                            obj_shape = SHEX_HELPER.shape_from_class(ne_term,
+                                                                     self.extensions_mapper.go_aspector)
+                            # location_relation = "BFO:0000050"  # part_of
+                            try:
+                                location_relation = SHEX_HELPER.relation_lookup(subj_shape, obj_shape)
+                            except ShexException as ex:
+                                raise ShexException(ex.message + f" for {loc_subj_term} to {ne_term}")
+                            if idx == 0 and ertn == "occurs_in":
+                                location_relation = "BFO:0000066"  # occurs_in - because MF -> @<AnatomicalEntity> OR @<CellularComponent>
+                            annot_subgraph.add_edge(loc_subj_n, location_relation, loc_obj_n)
+
+                            loc_subj_term = ne_term  # For next iteration
+                            loc_subj_n = loc_obj_n  # For next iteration
+                    # Nested extensions are already translated
+                    for ext_relation, ext_target in ext_set.unnested:
+                        if ext_relation not in list(INPUT_RELATIONS.keys()) + list(HAS_REGULATION_TARGET_RELATIONS.keys()):
+                            # No RO term yet. Try looking up in RO
+                            relation_term = self.translate_relation_to_ro(ext_relation)
+                            if relation_term:
+                                # print("Ext relation {} auto-mapped to {} in {}".format(ext_relation, relation_term, a.subject_id()))
+                                INPUT_RELATIONS[ext_relation] = relation_term
+                        if ext_relation in INPUT_RELATIONS:
+                            ext_target_n = annot_subgraph.add_instance_of_class(ext_target)
+                            # Need to find what mf we're talking about
+                            anchor_n = annot_subgraph.get_anchor()
+                            annot_subgraph.add_edge(anchor_n, INPUT_RELATIONS[ext_relation], ext_target_n)
+                        elif ext_relation in REGULATES_CHAIN_RELATIONS:
+                            # Get target MF from primary term (BP) e.g. GO:0007346 regulates some mitotic cell cycle
+                            regulates_rel, regulated_term = self.get_rel_and_term_in_logical_definitions(term)
+                            if regulates_rel:
+                                regulated_term_n = annot_subgraph.add_instance_of_class(regulated_term)
+                                anchor_n = annot_subgraph.get_anchor()
+                                annot_subgraph.add_edge(anchor_n, regulates_rel, regulated_term_n)
+                                ext_target_n = annot_subgraph.add_instance_of_class(ext_target)
+                                # Need to derive chained relation (e.g. "occurs_in") from this ext rel. Just replace("regulates_o_", "")?
+                                chained_rel_label = ext_relation.replace("regulates_o_", "")
+                                chained_rel = INPUT_RELATIONS.get(chained_rel_label)
+                                if chained_rel is None:
+                                    chained_rel = self.translate_relation_to_ro(chained_rel_label)
+                                annot_subgraph.add_edge(regulated_term_n, chained_rel, ext_target_n)
+                            else:
+                                logger.warning("Couldn't get regulates relation from LD of: {}".format(term))
+                        elif ext_relation in HAS_REGULATION_TARGET_RELATIONS:
+                            if aspect == 'P':
+                                # For BP annotations, translate 'has regulation target' to 'has input'.
                                 ext_target_n = annot_subgraph.add_instance_of_class(ext_target)
-                                # Need to find what mf we're talking about
                                 anchor_n = annot_subgraph.get_anchor()
-                                annot_subgraph.add_edge(anchor_n, INPUT_RELATIONS[ext_relation], ext_target_n)
-                            elif ext_relation in REGULATES_CHAIN_RELATIONS:
-                                # Get target MF from primary term (BP) e.g. GO:0007346 regulates some mitotic cell cycle
-                                regulates_rel, regulated_term = self.get_rel_and_term_in_logical_definitions(term)
-                                if regulates_rel:
-                                    regulated_term_n = annot_subgraph.add_instance_of_class(regulated_term)
-                                    anchor_n = annot_subgraph.get_anchor()
-                                    annot_subgraph.add_edge(anchor_n, regulates_rel, regulated_term_n)
-                                    ext_target_n = annot_subgraph.add_instance_of_class(ext_target)
-                                    # Need to derive chained relation (e.g. "occurs_in") from this ext rel. Just replace("regulates_o_", "")?
-                                    chained_rel_label = ext_relation.replace("regulates_o_", "")
-                                    chained_rel = INPUT_RELATIONS.get(chained_rel_label)
-                                    if chained_rel is None:
-                                        chained_rel = self.translate_relation_to_ro(chained_rel_label)
-                                    annot_subgraph.add_edge(regulated_term_n, chained_rel, ext_target_n)
-                                else:
-                                    logger.warning("Couldn't get regulates relation from LD of: {}".format(term))
-                            elif ext_relation in HAS_REGULATION_TARGET_RELATIONS:
-                                if aspect == 'P':
-                                    # For BP annotations, translate 'has regulation target' to 'has input'.
-                                    ext_target_n = annot_subgraph.add_instance_of_class(ext_target)
-                                    anchor_n = annot_subgraph.get_anchor()
-                                    annot_subgraph.add_edge(anchor_n, INPUT_RELATIONS['has_input'], ext_target_n)
-                                else:
-                                    buckets = has_regulation_target_bucket(self.ontology, term)
-                                    if len(buckets) > 0:
-                                        bucket = buckets[0]  # Or express all buckets?
-                                        # Four buckets
-                                        if bucket in ["a", "d"]:
-                                            regulates_rel, regulated_mf = self.get_rel_and_term_in_logical_definitions(term)
-                                            if regulates_rel and regulated_mf:
-                                                # [GP-A]<-enabled_by-[root MF]-regulates->[molecular function Z]-enabled_by->[GP-B]
-                                                ext_target_n = annot_subgraph.add_instance_of_class(ext_target)
-                                                regulated_mf_n = annot_subgraph.add_instance_of_class(regulated_mf)
-                                                annot_subgraph.add_edge(regulated_mf_n, ro.enabled_by, ext_target_n)
-                                                anchor_n = annot_subgraph.get_anchor()
-                                                annot_subgraph.add_edge(anchor_n, regulates_rel, regulated_mf_n)
-                                                # TODO: Suppress/delete (GP-A)<-enabled_by-(root MF)-part_of->(term) aka involved_in_translated
-                                                # Remove (anchor_uri, None, term)
-                                                # Is this anchor_uri always going to the root_mf?
-                                                # Will the term individual be used for anything else?
-                                                #   Other comma-delimited extensions on same annotation?
-                                                # has_during? occurs_in?
-                                                # WB:WBGene00001173 GO:0051343 ['has_regulation_target', 'occurs_in'] ['a']
-                                                # WB:WBGene00006652 GO:0045944 ['has_regulation_target', 'occurs_in'] ['b']
-                                                # WB:WBGene00003639 GO:0036003 ['happens_during', 'has_regulation_target'] ['b']
-                                                # Other comma-delimited extensions (e.g. happens_during, has_input) need this triple?
-                                                # WB:WBGene00002335 GO:1902685 ['has_regulation_target', 'occurs_in'] ['d']
-                                            else:
-                                                logger.warning("Couldn't get regulates relation and/or regulated term from LD of: {}".format(term))
-                                        elif bucket in ["b", "c"]:
-                                            regulates_rel, regulated_term = self.get_rel_and_term_in_logical_definitions(term)
-                                            if regulates_rel:
-                                                # find 'Y subPropertyOf regulates_rel' in RO where Y will be `causally
-                                                # upstream of` relation
-                                                # Ex. GO:0045944 -> RO:0002213 -> RO:0002304
-                                                # edges(RO:0002213) only returns subProperties. Need superProperties
-                                                # Gettin super properties
-                                                causally_upstream_relation = self.get_causally_upstream_relation(regulates_rel)
-                                                # GP-A<-enabled_by-[root MF]-part_of->[regulation of Z]-has_input->GP-B,-causally upstream of (positive/negative effect)->[root MF]-enabled_by->GP-B
-                                                ext_target_n = annot_subgraph.add_instance_of_class(ext_target)
-                                                anchor_n = annot_subgraph.get_anchor()  # TODO: Gotta find MF. MF no longer anchor if primary term is BP
-                                                annot_subgraph.add_edge(anchor_n, INPUT_RELATIONS["has input"], ext_target_n)
-                                                root_mf_b_n = annot_subgraph.add_instance_of_class(upt.molecular_function)
-                                                annot_subgraph.add_edge(anchor_n, causally_upstream_relation, root_mf_b_n)
-                                                annot_subgraph.add_edge(root_mf_b_n, ro.enabled_by, ext_target_n)
-                                                # WB:WBGene00001574 GO:1903363 ['happens_during', 'has_regulation_target'] ['c', 'd']
-                                            else:
-                                                logger.warning("Couldn't get regulates relation from LD of: {}".format(term))
-
-                    else:
-                        logger.debug("BAD: {}".format(ext_str))
-                    # For annots w/ extensions, this is where we write subgraph to model
-                    annot_subgraph.write_to_model(self, evidences)
-        self.extensions_mapper.go_aspector.write_cache()
+                                annot_subgraph.add_edge(anchor_n, INPUT_RELATIONS['has_input'], ext_target_n)
+                            else:
+                                buckets = has_regulation_target_bucket(self.ontology, term, self.closure_index)
+                                if len(buckets) > 0:
+                                    bucket = buckets[0]  # Or express all buckets?
+                                    # Four buckets
+                                    if bucket in ["a", "d"]:
+                                        regulates_rel, regulated_mf = self.get_rel_and_term_in_logical_definitions(term)
+                                        if regulates_rel and regulated_mf:
+                                            # [GP-A]<-enabled_by-[root MF]-regulates->[molecular function Z]-enabled_by->[GP-B]
+                                            ext_target_n = annot_subgraph.add_instance_of_class(ext_target)
+                                            regulated_mf_n = annot_subgraph.add_instance_of_class(regulated_mf)
+                                            annot_subgraph.add_edge(regulated_mf_n, ro.enabled_by, ext_target_n)
+                                            anchor_n = annot_subgraph.get_anchor()
+                                            annot_subgraph.add_edge(anchor_n, regulates_rel, regulated_mf_n)
+                                            # TODO: Suppress/delete (GP-A)<-enabled_by-(root MF)-part_of->(term) aka involved_in_translated
+                                            # Remove (anchor_uri, None, term)
+                                            # Is this anchor_uri always going to the root_mf?
+                                            # Will the term individual be used for anything else?
+                                            #   Other comma-delimited extensions on same annotation?
+                                            # has_during? occurs_in?
+                                            # WB:WBGene00001173 GO:0051343 ['has_regulation_target', 'occurs_in'] ['a']
+                                            # WB:WBGene00006652 GO:0045944 ['has_regulation_target', 'occurs_in'] ['b']
+                                            # WB:WBGene00003639 GO:0036003 ['happens_during', 'has_regulation_target'] ['b']
+                                            # Other comma-delimited extensions (e.g. happens_during, has_input) need this triple?
+                                            # WB:WBGene00002335 GO:1902685 ['has_regulation_target', 'occurs_in'] ['d']
+                                        else:
+                                            logger.warning("Couldn't get regulates relation and/or regulated term from LD of: {}".format(term))
+                                    elif bucket in ["b", "c"]:
+                                        regulates_rel, regulated_term = self.get_rel_and_term_in_logical_definitions(term)
+                                        if regulates_rel:
+                                            # find 'Y subPropertyOf regulates_rel' in RO where Y will be `causally
+                                            # upstream of` relation
+                                            # Ex. GO:0045944 -> RO:0002213 -> RO:0002304
+                                            # edges(RO:0002213) only returns subProperties. Need superProperties
+                                            # Gettin super properties
+                                            causally_upstream_relation = self.get_causally_upstream_relation(regulates_rel)
+                                            # GP-A<-enabled_by-[root MF]-part_of->[regulation of Z]-has_input->GP-B,-causally upstream of (positive/negative effect)->[root MF]-enabled_by->GP-B
+                                            ext_target_n = annot_subgraph.add_instance_of_class(ext_target)
+                                            anchor_n = annot_subgraph.get_anchor()  # TODO: Gotta find MF. MF no longer anchor if primary term is BP
+                                            annot_subgraph.add_edge(anchor_n, INPUT_RELATIONS["has input"], ext_target_n)
+                                            root_mf_b_n = annot_subgraph.add_instance_of_class(upt.molecular_function)
+                                            annot_subgraph.add_edge(anchor_n, causally_upstream_relation, root_mf_b_n)
+                                            annot_subgraph.add_edge(root_mf_b_n, ro.enabled_by, ext_target_n)
+                                            # WB:WBGene00001574 GO:1903363 ['happens_during', 'has_regulation_target'] ['c', 'd']
+                                        else:
+                                            logger.warning("Couldn't get regulates relation from LD of: {}".format(term))
+
+                else:
+                    logger.debug("BAD: {}".format(ext_str))
+                annot_subgraphs.append(annot_subgraph)
+        return annot_subgraphs
 
-    def translate_primary_annotation(self, annotation: CollapsedAssociation):
-        gp_id = annotation.subject_id()
+    def translate_primary_annotation(self, annotation: CollapsedAssociation, gp_id=None):
+        if gp_id is None:
+            gp_id = annotation.subject_id()
         term = annotation.object_id()
         annot_subgraph = AnnotationSubgraph(annotation)
 
@@ -669,36 +701,31 @@ class AssocGoCamModel(GoCamModel):
 
     def translate_relation_to_ro(self, relation_label):
         # Also check in GO_REL and use xref to RO
-        for n in self.ro_ontology.nodes():
-            node_label = self.ro_ontology.label(n)
-            if node_label == relation_label.replace("_", " "):
-                return n
-        for n in self.gorel_ontology.nodes():
-            node_label = self.gorel_ontology.label(n)
-            if node_label == relation_label:
-                gorel_node = self.gorel_ontology.node(n)
-                # What we want will likely be in xref:
-                xrefs = gorel_node['meta'].get('xrefs')
-                if xrefs and len(xrefs) > 0:
-                    for xref in xrefs:
-                        val = xref['val']
-                        if val.startswith('RO') or val.startswith('BFO'):
-                            # print("{} xref'd to {}".format(n, val))
-                            return val
-                    fallback_rel = xrefs[0]['val']  # default to the the first xref - usually GOREL
-                    self.writer.emit_type(URIRef(expand_uri_wrapper(fallback_rel)), OWL.ObjectProperty)
-                    self.writer.emit(URIRef(expand_uri_wrapper(fallback_rel)), RDFS.label, Literal(relation_label))
-                    return fallback_rel
-                # print(gorel_node)  # No such luck so far getting matches
+        if self.relation_resolver is None:
+            # Normally shared from GoCamBuilder
+            self.relation_resolver = RelationResolver.from_ontologies(self.ro_ontology, self.gorel_ontology)
+        relation, is_fallback = self.relation_resolver.resolve(relation_label)
+        if is_fallback:
+            # No RO/BFO xref - default to the the first xref, usually GOREL
+            if self.relation_declarations is not None:
+                # Building a template - declared whenever the template's used
+                self.relation_declarations.append((relation, relation_label))
+            else:
+                self.declare_fallback_relation(relation, relation_label)
+        return relation
+
+    def declare_fallback_relation(self, relation, relation_label):
+        self.writer.emit_type(URIRef(expand_uri_wrapper(relation)), OWL.ObjectProperty)
+        self.writer.emit(URIRef(expand_uri_wrapper(relation)), RDFS.label, Literal(relation_label))
+
+    def get_relation_algebra(self):
+        if self.relation_algebra is None:
+            # Normally shared from GoCamBuilder
+            self.relation_algebra = RelationAlgebra.from_ontologies(self.ro_ontology, self.ontology)
+        return self.relation_algebra
 
     def get_restrictions(self, term):
-        lds = self.ontology.logical_definitions(term)
-        restrictions = []
-        for ld in lds:
-            for r in ld.restrictions:
-                if r[0] in self.ro_ontology.descendants("RO:0002211", reflexive=True):
-                    restrictions.append(r)
-        return restrictions
+        return list(self.get_relation_algebra().restrictions(term))
 
     def get_rel_and_term_in_logical_definitions(self, term):
         term_restrictions = self.get_restrictions(term)
@@ -711,29 +738,8 @@ class AssocGoCamModel(GoCamModel):
             return None, None
 
     def get_causally_upstream_relation(self, relation):
-        regulates = "RO:0002211"
-        causally_upstream_relations = []
-        if relation == regulates or regulates in self.ro_ontology.ancestors(relation):
-            for p in self.ro_ontology.parents(relation,
-                                              relations=['subPropertyOf']):
-                # For GO:0045944 this is grabbing both RO:0002304 and RO:0002211
-                # Need specifically RO:0002304; how to specify?
-                #   regulates_rel will only ever be regulates, positively regulates, or
-                #   negatively regulates. If regulates in parents, grab other term
-                if not p == regulates:
-                    causally_upstream_relations.append(p)
-        # input relations could have some unique logical difference (e.g. positively_regulates vs acts_upstream_of)
-        else:
-            if relation in self.ENABLES_O_RELATION_LOOKUP:
-                return self.ENABLES_O_RELATION_LOOKUP[relation]
-            else:
-                causally_upstream_relation = self.ro_ontology.get_property_chain_axioms(relation)[0].chain_predicate_ids[1]  # always 2nd idx?
-                self.ENABLES_O_RELATION_LOOKUP[relation] = causally_upstream_relation
-                return causally_upstream_relation
-        if len(causally_upstream_relations) > 0:
-            return causally_upstream_relations[0]
-        else:
-            return None
+        # Ex. GO:0045944 -> RO:0002213 -> RO:0002304
+        return self.get_relation_algebra().causally_upstream_relation(relation)
 
 
 class ReferencePreference:
@@ -753,27 +759,71 @@ class ReferencePreference:
 
 
 class CamTurtleRdfWriter(TurtleRdfWriter):
-    def __init__(self, modeltitle, store=None):
-        self.base = genid(base="http://model.geneontology.org")
-        if store is not None:
-            graph = rdflib.Graph(identifier=self.base, store=store)
+    def __init__(self, modeltitle, store=None, iri_minter=None, model_date=None):
+        if iri_minter is None:
+            iri_minter = IriMinter()
+        self.iri_minter = iri_minter
+        self.base = iri_minter.model_iri()
+        self.store = store
+        # Triples go into the buffer while the model's built. The rdflib Graph is materialized from it on first
+        # access of .graph (serialize, N-Quads export, SPARQL) and takes over from there.
+        self.buffer = TripleBuffer()
+        self._graph = None
+        self.bind("owl", OWL)
+        self.bind("obo", "http://purl.obolibrary.org/obo/")
+        self.bind("dc", DC)
+        self.bind("rdfs", RDFS)
+
+        self.add(self.base, RDF.type, OWL.Ontology)
+
+        # Model attributes TODO: Should move outside init
+        self.add(self.base, URIRef("http://purl.org/pav/providedBy"), Literal("http://geneontology.org"))
+        if model_date is None:
+            model_date = now
+        self.add(self.base, DC.date, Literal(str(model_date.year) + "-" + str(model_date.month) + "-" + str(model_date.day)))
+        self.add(self.base, DC.title, Literal(modeltitle))
+        self.add(self.base, DC.contributor, Literal("http://orcid.org/0000-0002-6659-0416")) #TODO
+        self.add(self.base, URIRef("http://geneontology.org/lego/modelstate"), Literal("development"))
+        self.add(self.base, OWL.versionIRI, self.base)
+
+    @property
+    def graph(self):
+        if self._graph is None and self.buffer is not None:
+            self._graph = self.buffer.to_graph(identifier=self.base, store=self.store)
+            self.buffer = None
+        return self._graph
+
+    @graph.setter
+    def graph(self, graph):
+        self._graph = graph
+        self.buffer = None
+
+    def triple_source(self):
+        # Whatever currently holds the triples. Both support iteration and namespaces() for FastTripleWriter.
+        if self.buffer is not None:
+            return self.buffer
+        return self._graph
+
+    def add(self, s, p, o):
+        if self.buffer is not None:
+            self.buffer.add((s, p, o))
         else:
-            graph = rdflib.Graph(identifier=self.base)
-        self.graph = graph
-        self.graph.bind("owl", OWL)
-        self.graph.bind("obo", "http://purl.obolibrary.org/obo/")
-        self.graph.bind("dc", DC)
-        self.graph.bind("rdfs", RDFS)
+            self._graph.add((s, p, o))
 
-        self.graph.add((self.base, RDF.type, OWL.Ontology))
+    def bind(self, prefix, namespace):
+        self.triple_source().bind(prefix, namespace)
 
-        # Model attributes TODO: Should move outside init
-        self.graph.add((self.base, URIRef("http://purl.org/pav/providedBy"), Literal("http://geneontology.org")))
-        self.graph.add((self.base, DC.date, Literal(str(now.year) + "-" + str(now.month) + "-" + str(now.day))))
-        self.graph.add((self.base, DC.title, Literal(modeltitle)))
-        self.graph.add((self.base, DC.contributor, Literal("http://orcid.org/0000-0002-6659-0416"))) #TODO
-        self.graph.add((self.base, URIRef("http://geneontology.org/lego/modelstate"), Literal("development")))
-        self.graph.add((self.base, OWL.versionIRI, self.base))
+    def triples(self, pattern):
+        return self.triple_source().triples(pattern)
+
+    def contains(self, pattern):
+        return pattern in self.triple_source()
+
+    def close(self):
+        if self._graph is not None:
+            self._graph.close()
+        self._graph = None
+        self.buffer = None
 
 
 class AnnotonCamRdfTransform(CamRdfTransform):
@@ -782,29 +832,33 @@ class AnnotonCamRdfTransform(CamRdfTransform):
         self.annotons = []
         self.classes = []
         self.evidences = []
-        self.ev_ids = []
+        self.evidence_ids = {}  # GoCamEvidence.key() -> evidence individual IRI
         self.bp_id = None
+        self.axioms = {}  # (source, property, target) -> axiom bnode. Kept up to date by add_axiom/emit_axiom.
+        self.individuals_by_class = {}  # class CURIE -> individual IRIs, in declaration order
+        self.class_by_individual = {}  # individual IRI -> class CURIE
 
-    # TODO Remove "find" feature
     def find_or_create_evidence_id(self, evidence):
-        for existing_evidence in self.evidences:
-            if evidence.evidence_code == existing_evidence.evidence_code and set(evidence.references) == set(existing_evidence.references):
-                if existing_evidence.id is None:
-                    existing_evidence.id = genid(base=self.writer.base + '/')
-                    self.ev_ids.append(existing_evidence.id)
-                return existing_evidence.id
-        return self.create_evidence(evidence)
+        evidence_key = evidence.key()
+        ev_id = self.evidence_ids.get(evidence_key)
+        if ev_id is None:
+            ev_id = self.create_evidence(evidence)
+            self.evidence_ids[evidence_key] = ev_id
+        else:
+            evidence.id = ev_id
+        return ev_id
 
     def create_evidence(self, evidence):
         # Use/figure out standard for creating URIs
         # Find minerva code to generate URI, add to Noctua doc
-        ev_id = genid(base=self.writer.base + '/')
+        ev_id = self.writer.iri_minter.individual_iri(self.writer.base + '/')
         evidence.id = ev_id
         # ev_cls = self.eco_class(self.uri(evidence.evidence_code))
         # ev_cls = self.eco_class(evidence.evidence_code) # This is already ECO:##### due to a GPAD being used
         ev_cls = self.uri(evidence.evidence_code)
         self.emit_type(ev_id, OWL.NamedIndividual)
         self.emit_type(ev_id, ev_cls)
+        self.index_individual(ev_id, evidence.evidence_code)
         self.emit(ev_id, DC.date, Literal(evidence.date))
         if evidence.with_from:
             self.emit(ev_id, URIRef("http://geneontology.org/lego/evidence-with"), Literal(evidence.with_from))
@@ -816,19 +870,32 @@ class AnnotonCamRdfTransform(CamRdfTransform):
         self.evidences.append(evidence)
         return evidence.id
 
-    # Use only for OWLAxioms
-    # There are two of these methods. AnnotonCamRdfTransform.find_bnode and GoCamModel.find_bnode. Which one is used?
+    def uri(self, id):
+        # Same as CamRdfTransform.uri() but binds prefixes through the writer, which would otherwise
+        # materialize the graph mid-translation
+        if isinstance(id, dict):
+            return self.uri(id['id'])
+        id = self.bad_chars_regex.sub("_", id)
+        uri = expand_uri(id, cmaps=[prefix_context])
+        if uri != id:
+            prefix = id.split(":")[0]
+            self.writer.bind(prefix, prefix_context[prefix])
+        return URIRef(uri)
+
+    def blanknode(self):
+        return self.writer.iri_minter.blank_node()
+
+    # Use only for OWLAxioms. GoCamModel.find_bnode delegates here.
     def find_bnode(self, triple):
-        (subject,predicate,object_id) = triple
-        s_triples = self.writer.graph.triples((None, OWL.annotatedSource, subject))
-        s_bnodes = [s for s,p,o in s_triples]
-        p_triples = self.writer.graph.triples((None, OWL.annotatedProperty, predicate))
-        p_bnodes = [s for s,p,o in p_triples]
-        o_triples = self.writer.graph.triples((None, OWL.annotatedTarget, object_id))
-        o_bnodes = [s for s,p,o in o_triples]
-        bnodes = set(s_bnodes) & set(p_bnodes) & set(o_bnodes)
-        if len(bnodes) > 0:
-            return list(bnodes)[0]
+        return self.axioms.get(tuple(triple))
+
+    def index_individual(self, individual_uri, class_id):
+        self.individuals_by_class.setdefault(class_id, []).append(individual_uri)
+        self.class_by_individual[individual_uri] = class_id
+
+    def index_axiom(self, triple, stmt_id):
+        # First axiom written for a triple is the one find_bnode hands back
+        self.axioms.setdefault(tuple(triple), stmt_id)
 
     def emit_axiom(self, source_id, property_id, target_id):
         stmt_id = self.blanknode()
@@ -836,6 +903,7 @@ class AnnotonCamRdfTransform(CamRdfTransform):
         self.emit(stmt_id, OWL.annotatedSource, source_id)
         self.emit(stmt_id, OWL.annotatedProperty, property_id)
         self.emit(stmt_id, OWL.annotatedTarget, target_id)
+        self.index_axiom((source_id, property_id, target_id), stmt_id)
         return stmt_id
 
     def find_annotons(self, enabled_by, annotons_list=None):
@@ -852,9 +920,10 @@ class AnnotonCamRdfTransform(CamRdfTransform):
     def add_individual(self, individual_id, annoton):
         obj_uri = self.uri(individual_id)
         if individual_id not in annoton.individuals:
-            tgt_id = genid(base=self.writer.base + '/')
+            tgt_id = self.writer.iri_minter.individual_iri(self.writer.base + '/')
             annoton.individuals[individual_id] = tgt_id
             self.emit_type(tgt_id, obj_uri)
             self.emit_type(tgt_id, OWL.NamedIndividual)
+            self.index_individual(tgt_id, individual_id)
         else:
             tgt_id = annoton.individuals[individual_id]
@@ -0,0 +1,321 @@
+import array
+import json
+import logging
+import os
+import shutil
+import sys
+import numpy as np
+from gocamgen.gpad_reader import GpadReader, GpadRecord, line_store_for
+from gocamgen.gpad_source import as_gpad_source
+from gocamgen.ontology_snapshot import file_checksum
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the column layout changes so stale caches get rebuilt instead of misread
+GPAD_CACHE_FORMAT_VERSION = 1
+NO_STRING = -1
+CHUNK_ROWS = 1 << 16
+# One string number per row
+SCALAR_COLUMNS = ["subject", "object", "evidence", "provided_by", "date", "interacting_taxon"]
+# Variable-length string lists per row. annotation_properties are flattened to key, value, key, value...
+LIST_COLUMNS = ["qualifiers", "references", "with_from", "annotation_properties"]
+# Lists of lists per row. extensions are intersections flattened to relation, filler, relation, filler...
+NESTED_COLUMNS = ["with_from_groups", "extensions"]
+
+
+class GpadCache:
+    """
+    Parsed GPAD records stored column by column next to the GPAD (<gpad>.cache/) as numpy arrays that are
+    memory-mapped on load. Every distinct string is stored once, and columns hold string numbers. Rows only
+    become GpadRecords when asked for, and their lines are read back from the GPAD by offset.
+    """
+
+    def __init__(self, cache_dir, gpad_path):
+        self.cache_dir = cache_dir
+        self.line_store = line_store_for(gpad_path)
+        self.arrays = {}
+        for fname in os.listdir(cache_dir):
+            if fname.endswith(".npy"):
+                self.arrays[fname[:-len(".npy")]] = np.load(os.path.join(cache_dir, fname), mmap_mode="r")
+        # String number -> str, decoded as rows are read. The extra None on the end is what NO_STRING (-1) indexes.
+        self.strings = [None] * (len(self.arrays["string_offsets"]) - 1) + [None]
+
+    def __len__(self):
+        return len(self.arrays["line_offset"])
+
+    def string(self, string_id):
+        return self.decode(np.array([string_id]))[0]
+
+    def decode(self, string_ids):
+        # String numbers (numpy array) to strs
+        strings = self.strings
+        offsets = None
+        for string_id in np.unique(string_ids).tolist():
+            if string_id != NO_STRING and strings[string_id] is None:
+                if offsets is None:
+                    offsets = self.arrays["string_offsets"]
+                    data = self.arrays["string_data"]
+                strings[string_id] = sys.intern(data[offsets[string_id]:offsets[string_id + 1]].tobytes()
+                                                .decode("utf-8"))
+        return [strings[string_id] for string_id in string_ids.tolist()]
+
+    def rows_for_subject(self, subject_id):
+        # Binary search over the subject numbers, which are sorted by subject ID
+        subject_keys = self.arrays["subject_keys"]
+        lo, hi = 0, len(subject_keys)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.string(int(subject_keys[mid])) < subject_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == len(subject_keys) or self.string(int(subject_keys[lo])) != subject_id:
+            return np.zeros(0, dtype=np.int64)
+        indptr = self.arrays["subject_row_indptr"]
+        return self.arrays["subject_rows"][indptr[lo]:indptr[lo + 1]]
+
+    def rows_for_subjects(self, subject_ids):
+        rows = [self.rows_for_subject(subject_id) for subject_id in subject_ids]
+        if not rows:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(rows))
+
+    def subject_groups(self):
+        # (subject ID, rows) in subject ID order, the same order an external sort of the GPAD gives
+        subject_keys = self.arrays["subject_keys"]
+        indptr = self.arrays["subject_row_indptr"]
+        subject_rows = self.arrays["subject_rows"]
+        for idx in range(len(subject_keys)):
+            yield self.string(int(subject_keys[idx])), subject_rows[indptr[idx]:indptr[idx + 1]]
+
+    def rows_with_extensions(self):
+        return np.flatnonzero(np.diff(self.arrays["extensions_indptr"]) > 0)
+
+    def records(self, rows=None):
+        # All records in file order, or just those in rows (ascending)
+        if rows is None:
+            for lo in range(0, len(self), CHUNK_ROWS):
+                hi = min(lo + CHUNK_ROWS, len(self))
+                yield from self.chunk_records(lo, hi, range(lo, hi))
+            return
+        for chunk in row_chunks(np.asarray(rows).tolist()):
+            yield from self.chunk_records(chunk[0], chunk[-1] + 1, chunk)
+
+    def chunk_records(self, lo, hi, rows):
+        # Slices every column over rows lo:hi once, then builds the records for the given rows in that range
+        a = self.arrays
+        decode = self.decode
+        scalars = {name: decode(a[name][lo:hi]) for name in SCALAR_COLUMNS}
+        lists = {name: list_column_rows(a[name + "_indptr"], a[name], lo, hi, decode) for name in LIST_COLUMNS}
+        nested = {name: nested_column_rows(a[name + "_indptr"], a[name + "_group_indptr"], a[name], lo, hi, decode)
+                  for name in NESTED_COLUMNS}
+        negated = a["negated"][lo:hi].tolist()
+        has_properties = a["has_properties"][lo:hi].tolist()
+        line_offsets = a["line_offset"][lo:hi].tolist()
+        for row in rows:
+            k = row - lo
+            annotation_properties = None
+            if has_properties[k]:
+                annotation_properties = {}
+                props = lists["annotation_properties"][k]
+                for key, value in zip(props[0::2], props[1::2]):
+                    annotation_properties.setdefault(key, []).append(value)
+            record = GpadRecord(
+                source_line=line_offsets[k],
+                subject_id=scalars["subject"][k],
+                qualifiers=lists["qualifiers"][k],
+                negated=bool(negated[k]),
+                object_id=scalars["object"][k],
+                references=lists["references"][k],
+                evidence_type=scalars["evidence"][k],
+                with_from=lists["with_from"][k],
+                with_from_groups=nested["with_from_groups"][k],
+                interacting_taxon=scalars["interacting_taxon"][k],
+                date=scalars["date"][k],
+                provided_by=scalars["provided_by"][k],
+                extensions=tuple(tuple(zip(group[0::2], group[1::2])) for group in nested["extensions"][k]),
+                annotation_properties=annotation_properties,
+            )
+            record.line_store = self.line_store
+            yield record
+
+
+def row_chunks(rows):
+    # Runs of sorted row numbers spanning fewer than CHUNK_ROWS rows, so each run's columns are sliced once
+    chunk = []
+    for row in rows:
+        if chunk and row - chunk[0] >= CHUNK_ROWS:
+            yield chunk
+            chunk = []
+        chunk.append(row)
+    if chunk:
+        yield chunk
+
+
+def list_column_rows(indptr, values, lo, hi, decode):
+    # Tuple of strs for each row lo:hi
+    bounds = indptr[lo:hi + 1].tolist()
+    base = bounds[0]
+    row_values = decode(values[base:bounds[-1]])
+    return [tuple(row_values[bounds[k] - base:bounds[k + 1] - base]) for k in range(hi - lo)]
+
+
+def nested_column_rows(indptr, group_indptr, values, lo, hi, decode):
+    bounds = indptr[lo:hi + 1].tolist()
+    base = bounds[0]
+    groups = list_column_rows(group_indptr, values, base, bounds[-1], decode)
+    return [tuple(groups[bounds[k] - base:bounds[k + 1] - base]) for k in range(hi - lo)]
+
+
+class ListColumnBuilder:
+    def __init__(self):
+        self.indptr = array.array("q", [0])
+        self.values = array.array("i")
+
+    def append(self, ids):
+        self.values.extend(ids)
+        self.indptr.append(len(self.values))
+
+    def arrays(self, name):
+        return {name + "_indptr": self.indptr, name: self.values}
+
+
+class NestedColumnBuilder:
+    def __init__(self):
+        self.indptr = array.array("q", [0])
+        self.groups = ListColumnBuilder()
+
+    def append(self, groups):
+        for group in groups:
+            self.groups.append(group)
+        self.indptr.append(len(self.groups.indptr) - 1)
+
+    def arrays(self, name):
+        return {name + "_indptr": self.indptr, name + "_group_indptr": self.groups.indptr, name: self.groups.values}
+
+
+def build_gpad_cache(gpad_path, cache_dir, fingerprint, strict=False):
+    string_ids = {}
+
+    def sid(s):
+        if s is None:
+            return NO_STRING
+        string_id = string_ids.get(s)
+        if string_id is None:
+            string_id = len(string_ids)
+            string_ids[s] = string_id
+        return string_id
+
+    scalars = {name: array.array("i") for name in SCALAR_COLUMNS}
+    lists = {name: ListColumnBuilder() for name in LIST_COLUMNS}
+    nested = {name: NestedColumnBuilder() for name in NESTED_COLUMNS}
+    negated = array.array("B")
+    has_properties = array.array("B")
+    line_offsets = array.array("q")
+    rows_by_subject = {}
+    records = GpadReader(strict=strict).parse_source(as_gpad_source(gpad_path))
+    for row, record in enumerate(records):
+        for name, value in [("subject", record.subject_id), ("object", record.object_id),
+                            ("evidence", record.evidence_type), ("provided_by", record.provided_by),
+                            ("date", record.date), ("interacting_taxon", record.interacting_taxon)]:
+            scalars[name].append(sid(value))
+        lists["qualifiers"].append([sid(q) for q in record.qualifiers])
+        lists["references"].append([sid(r) for r in record.references])
+        lists["with_from"].append([sid(wf) for wf in record.with_from])
+        props = record.annotation_properties or {}
+        lists["annotation_properties"].append([sid(s) for key, values in props.items() for value in values
+                                               for s in (key, value)])
+        has_properties.append(record.annotation_properties is not None)
+        nested["with_from_groups"].append([[sid(wf) for wf in group] for group in record.with_from_groups])
+        nested["extensions"].append([[sid(s) for ext in intersection for s in ext]
+                                     for intersection in record.extensions])
+        negated.append(record.negated)
+        line_offsets.append(record.line_ref)
+        rows_by_subject.setdefault(record.subject_id, array.array("q")).append(row)
+
+    columns = {"negated": np.frombuffer(negated, dtype=np.uint8),
+               "has_properties": np.frombuffer(has_properties, dtype=np.uint8),
+               "line_offset": np.frombuffer(line_offsets, dtype=np.int64)}
+    for name, column in scalars.items():
+        columns[name] = np.frombuffer(column, dtype=np.int32)
+    for builders in (lists, nested):
+        for name, builder in builders.items():
+            for array_name, values in builder.arrays(name).items():
+                columns[array_name] = np.frombuffer(values, dtype=np.int64 if values.typecode == "q" else np.int32)
+
+    subjects = sorted(rows_by_subject)
+    columns["subject_keys"] = np.array([string_ids[s] for s in subjects], dtype=np.int32)
+    columns["subject_row_indptr"] = np.cumsum([0] + [len(rows_by_subject[s]) for s in subjects], dtype=np.int64)
+    columns["subject_rows"] = np.concatenate([np.frombuffer(rows_by_subject[s], dtype=np.int64) for s in subjects]) \
+        if subjects else np.zeros(0, dtype=np.int64)
+
+    encoded = [s.encode("utf-8") for s in string_ids]  # dicts keep insertion order, i.e. string number order
+    columns["string_offsets"] = np.cumsum([0] + [len(e) for e in encoded], dtype=np.int64)
+    columns["string_data"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    # Written beside the old cache and swapped in, so an interrupted build never leaves a half-written cache
+    tmp_dir = cache_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name, values in columns.items():
+        np.save(os.path.join(tmp_dir, name + ".npy"), values)
+    write_cache_meta(tmp_dir, {"format_version": GPAD_CACHE_FORMAT_VERSION, "fingerprint": fingerprint,
+                               "strict": strict, "rows": len(line_offsets)})
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.replace(tmp_dir, cache_dir)
+
+
+def gpad_cache_dir(gpad_path, strict=False):
+    return "{}{}.cache".format(gpad_path, ".strict" if strict else "")
+
+
+def read_cache_meta(cache_dir):
+    meta_path = os.path.join(cache_dir, "meta.json")
+    if not os.path.isfile(meta_path):
+        return None
+    try:
+        with open(meta_path) as mf:
+            meta = json.load(mf)
+    except ValueError as ex:
+        logger.warning("Corrupt GPAD cache {} ({}) - Rebuilding...".format(cache_dir, ex))
+        return None
+    if meta.get("format_version") != GPAD_CACHE_FORMAT_VERSION:
+        return None
+    return meta
+
+
+def write_cache_meta(cache_dir, meta):
+    with open(os.path.join(cache_dir, "meta.json"), "w") as mf:
+        json.dump(meta, mf)
+
+
+def load_gpad_cache(gpad_file, strict=False):
+    # The GPAD's cache, (re)built from a full parse if it's missing or stale. None for GPADs that can't have one.
+    gpad_source = as_gpad_source(gpad_file)
+    if not gpad_source.is_seekable():
+        logger.warning("Only plain local GPAD files can be cached. Parsing {} instead".format(gpad_source))
+        return None
+    gpad_path = gpad_source.location
+    cache_dir = gpad_cache_dir(gpad_path, strict)
+    stat = os.stat(gpad_path)
+    meta = read_cache_meta(cache_dir)
+    if meta is not None and meta["fingerprint"]["size"] == stat.st_size:
+        if meta["fingerprint"]["mtime_ns"] == stat.st_mtime_ns:
+            logger.info("Loaded {} from cache {}".format(gpad_path, cache_dir))
+            return GpadCache(cache_dir, gpad_path)
+        # Touched or copied, not necessarily changed
+        if meta["fingerprint"]["sha256"] == file_checksum(gpad_path):
+            meta["fingerprint"]["mtime_ns"] = stat.st_mtime_ns
+            write_cache_meta(cache_dir, meta)
+            logger.info("Loaded {} from cache {}".format(gpad_path, cache_dir))
+            return GpadCache(cache_dir, gpad_path)
+    if meta is not None:
+        logger.info("Cache for {} is stale. Rebuilding".format(gpad_path))
+    fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": file_checksum(gpad_path)}
+    try:
+        build_gpad_cache(gpad_path, cache_dir, fingerprint, strict=strict)
+    except OSError as ex:
+        logger.warning("Couldn't write GPAD cache {} ({}). Parsing {} instead".format(cache_dir, ex, gpad_path))
+        return None
+    logger.info("Cached {} to {}".format(gpad_path, cache_dir))
+    return GpadCache(cache_dir, gpad_path)
@@ -7,6 +7,9 @@ from ontobio.util.go_utils import GoAspector
 from ontobio.rdfgen.assoc_rdfgen import prefix_context
 from gocamgen.filter_rule import *
 from gocamgen.collapsed_assoc import extract_properties
+from gocamgen.gpad_cache import load_gpad_cache
+from gocamgen.relations import RelationResolver, load_relation_resolver, RO_HANDLE, GOREL_HANDLE
+from gocamgen.ontology_snapshot import OntologySnapshotCache
 import json
 import csv
 import os
@@ -33,6 +36,9 @@ parser.add_argument("-r", "--pattern_sourcefile")
 parser.add_argument("-m", "--mod")
 parser.add_argument("-e", "--extensions_list", action='store_const', const=True,
                     help="Print out distinct extensions list")
+parser.add_argument("--gpad_cache", action='store_const', const=True,
+                    help="Read GPADs through their strictly parsed cache (<gpad>.strict.cache/), building it on first "
+                         "use")
 
 ontology_prefixes = []
 for k, v in prefix_context.items():
@@ -111,11 +117,15 @@ def is_valid_ext_pattern(primary_term, ext_relation, ext_namespace, occurence_co
             #   max spec'd and count > - PASS
             #   max spec'd and count <= - PASS
             #   max not spec'd - PASS
+            # Valid pattern root term is an is_a ancestor of GPAD primary term
+            if GO_CLOSURE_INDEX is not None:
+                for t in p.primary_term_roots:
+                    if GO_CLOSURE_INDEX.is_under(primary_term, t, isa_only=True):
+                        return True
+                continue
             # Check ancestors of query term - might take a while
             all_ancestors = GO_ONTOLOGY.ancestors(primary_term, reflexive=True)
             is_a_ancestors = GO_ONTOLOGY.subontology(all_ancestors).ancestors(primary_term, relations=["subClassOf"], reflexive=True)
-            # Cache IS_A_ANCESTORS[primary_term] = is_a_ancestors ?
-            # Valid pattern root term is an is_a ancestor of GPAD primary term
             for t in p.primary_term_roots:
                 if t in is_a_ancestors:
                     return True
@@ -167,9 +177,17 @@ EXTENSION_RELATION_UNIVERSE.append([
 
 RO_ONTOLOGY = None
 GO_ONTOLOGY = None
+GO_CLOSURE_INDEX = None
+RO_RELATION_RESOLVER = None
 
 
-def setup_ontologies(go_ontology=None, ro_ontology=None):
+def setup_ontologies(go_ontology=None, ro_ontology=None, closure_index=None, relation_resolver=None):
+    # relation_resolver should be built from the same RO (e.g. the builder's snapshot-backed one). Without one,
+    # translate_relation_to_ro() builds an RO-only resolver from RO_ONTOLOGY.
+    global RO_RELATION_RESOLVER
+    RO_RELATION_RESOLVER = relation_resolver
+    global GO_CLOSURE_INDEX
+    GO_CLOSURE_INDEX = closure_index
     global GO_ONTOLOGY
     if go_ontology is None:
         GO_ONTOLOGY = OntologyFactory().create("go")
@@ -190,8 +208,9 @@ gpad_indices = {
 
 class CachedGoAspector(GoAspector):
 
-    def __init__(self, cache_filepath=None, go_ontology=GO_ONTOLOGY):
+    def __init__(self, cache_filepath=None, go_ontology=GO_ONTOLOGY, closure_index=None):
         GoAspector.__init__(self, go_ontology)
+        self.closure_index = closure_index
         if cache_filepath is None:
             cache_filepath = "resources/aspect_lookup.json"
         self.cache_filepath = cache_filepath
@@ -211,6 +230,16 @@ class CachedGoAspector(GoAspector):
                 except json.decoder.JSONDecodeError:
                     logger.warning("Corrupt aspect_lookup cache file: {} - Recreating...".format(self.cache_filepath))
 
+    def get_isa_closure(self, go_term):
+        if self.closure_index is not None:
+            return self.closure_index.ancestors(go_term, isa_only=True, reflexive=False)
+        return super(CachedGoAspector, self).get_isa_closure(go_term)
+
+    def is_isa_under(self, go_term, root):
+        if self.closure_index is not None:
+            return self.closure_index.is_under(go_term, root, isa_only=True)
+        return go_term == root or root in self.get_isa_closure(go_term)
+
     def write_cache(self):
         with open(self.cache_filepath, "w+") as af:
             json.dump(self.aspect_lookup, af)
@@ -296,6 +325,16 @@ def filter_rule_validate_lines(annots, assoc_filter):
                 filtered.append(a)
     return filtered
 
+def cached_extension_lines(gpad_cache, assoc_filter):
+    # Same split lines as filter_has_extension() then filter_rule_validate_lines(), only reading rows with extensions
+    lines = []
+    for record in assoc_filter.filter(gpad_cache.records(gpad_cache.rows_with_extensions())):
+        parts = record.source_line.split("\t")
+        if "annotation_properties" in record:
+            parts.append(record.annotation_properties)
+        lines.append(parts)
+    return lines
+
 def sum_combos(extension_counts, combo_list):
     cur_sum = 0
     for c in combo_list:
@@ -363,9 +402,10 @@ def filter_no_rules_broken(annots):
 
 
 class ExtensionsMapper():
-    def __init__(self, go_ontology=None, ro_ontology=None):
-        setup_ontologies(go_ontology, ro_ontology)
-        self.go_aspector = CachedGoAspector("resources/aspect_lookup.json", go_ontology=go_ontology)
+    def __init__(self, go_ontology=None, ro_ontology=None, closure_index=None, relation_resolver=None):
+        setup_ontologies(go_ontology, ro_ontology, closure_index, relation_resolver)
+        self.go_aspector = CachedGoAspector("resources/aspect_lookup.json", go_ontology=go_ontology,
+                                            closure_index=closure_index)
 
     def extensions_list(self, intersection_extensions, row_cols=[]):
         ext_list = []
@@ -435,10 +475,10 @@ d = [
 
 
 def translate_relation_to_ro(relation_label):
-    for n in RO_ONTOLOGY.nodes():
-        node_label = RO_ONTOLOGY.label(n)
-        if node_label == relation_label.replace("_", " "):
-            return n
+    global RO_RELATION_RESOLVER
+    if RO_RELATION_RESOLVER is None:
+        RO_RELATION_RESOLVER = RelationResolver.from_ontologies(RO_ONTOLOGY)
+    return RO_RELATION_RESOLVER.resolve(relation_label)[0]
 
 
 if __name__ == "__main__":
@@ -473,7 +513,8 @@ if __name__ == "__main__":
             for nono in d:
                 if nono in fname:
                     nono_in_fname = True
-            if fname.endswith(".tsv") or nono_in_fname:
+            # Directories include any GPAD caches
+            if fname.endswith(".tsv") or nono_in_fname or os.path.isdir(args.dir + fname):
                 continue
             # filenames.append(args.dir + fname)
             filter_name = get_filter_name(fname)
@@ -481,7 +522,12 @@ if __name__ == "__main__":
             # data = data + GafParser().parse(fname, skipheader=True)
 
     # all_dict = {}
-    extensions_mapper = ExtensionsMapper()
+    # Same snapshot-backed RO and relation lookup (GOREL included) the model builder uses
+    snapshot_cache = OntologySnapshotCache()
+    ro_ontology = snapshot_cache.load(RO_HANDLE)
+    relation_resolver = load_relation_resolver(snapshot_cache, RO_HANDLE, GOREL_HANDLE, ro_ontology,
+                                               snapshot_cache.load(GOREL_HANDLE))
+    extensions_mapper = ExtensionsMapper(ro_ontology=ro_ontology, relation_resolver=relation_resolver)
     gpad_parser = GpadParser()
     print("Creating extension dictionary...")
     ext_dict = {}
@@ -489,69 +535,76 @@ if __name__ == "__main__":
     ext_dict['P'] = {}
     ext_dict['C'] = {}
     for fname in filenames:
-        with open(fname) as f:
+        # Strict, so cached rows go through the same GpadParser validation as filter_rule_validate_lines()
+        gpad_cache = load_gpad_cache(fname, strict=True) if args.gpad_cache else None
+        # filter_rule = get_filter_rule(args.mod)
+        filter_rule = filenames[fname]
+        assoc_filter = AssocFilter(filter_rule)
+        if gpad_cache is not None:
+            print("Loading file from cache:", fname)
+            print("# of GPAD lines in file:", len(gpad_cache))
+            data = cached_extension_lines(gpad_cache, assoc_filter)
+        else:
             data = []
             print("Loading file:", fname)
-            for l in f.readlines():
-                if not l.startswith("!"):
-                    parts = l.split("\t")
-                    # if parts[15] != "" and parts[6] in acceptable_evidence_codes:
-                    data.append(parts)
+            with open(fname) as f:
+                for l in f.readlines():
+                    if not l.startswith("!"):
+                        parts = l.split("\t")
+                        # if parts[15] != "" and parts[6] in acceptable_evidence_codes:
+                        data.append(parts)
             print("# of GPAD lines in file:", len(data))
             data = filter_has_extension(data)
             print("# of GPAD lines having extensions:", len(data))
-            # filter_rule = get_filter_rule(args.mod)
-            filter_rule = filenames[fname]
-            assoc_filter = AssocFilter(filter_rule)
             data = filter_rule_validate_lines(data, assoc_filter)
-            print("Total GPAD count after applying {}: {}".format(filter_rule.__class__.__name__, len(data)))
-
-            for g in data:
-                go_term = g[3]
-                aspect = extensions_mapper.go_aspector.go_aspect(go_term)
-                split_line = SplitLine(line="\t".join(g), values=g, taxon="")  # Needed for ontobio error handling
-                ontobio_extensions = gpad_parser._parse_full_extension_expression(g[10], split_line)
-                ontobio_extensions = extensions_mapper.dedupe_extensions(ontobio_extensions)
-                # ontobio_pattern = {
-                #     'union_of': [
-                #         {
-                #             'intersection_of': [
-                #                 {'property': 'part_of', 'filler': 'CL:0000678'},
-                #                 {'property': 'part_of', 'filler': 'EMAPA:16525'}
-                #             ]
-                #         },
-                #         {
-                #               'intersection_of': [
-                #                   {'property': 'part_of', 'filler': 'CL:0000678'},
-                #                   {'property': 'part_of', 'filler': 'EMAPA:16525'}
-                #               ]
-                #         }
-                #     ]
-                # }
-                for onto_ext in ontobio_extensions:
-                    ext_list = extensions_mapper.extensions_list(onto_ext['intersection_of'], g)
-                    check_ext_result = following_rules(ext_list, aspect, go_term)
-                    if not check_ext_result.is_valid:
-                        ext_key = ",".join(ext_list)
-                        offending_extension = check_ext_result.offending_extension
-                        if offending_extension is None:
-                            offending_extension = check_ext_result.reason
-                        bad_extensions.append([":".join(g[0:2]), go_term, GO_ONTOLOGY.label(go_term), offending_extension, g[10]])
-                        if ext_key not in ext_dict[aspect]:
-                            ext_dict[aspect][ext_key] = [g]
-                        elif g not in ext_dict[aspect][ext_key]:
-                            ext_dict[aspect][ext_key].append(g)
-
-            for aspect in ['F','P','C']:
-                max_count = 0
-                top_k = None
-                example_v = None
-                for k, v in ext_dict[aspect].items():
-                    if len(v) > max_count:
-                        max_count = len(v)
-                        # print(max_count)
-                        top_k = k
-                        example_v = v[0]
+        print("Total GPAD count after applying {}: {}".format(filter_rule.__class__.__name__, len(data)))
+
+        for g in data:
+            go_term = g[3]
+            aspect = extensions_mapper.go_aspector.go_aspect(go_term)
+            split_line = SplitLine(line="\t".join(g), values=g, taxon="")  # Needed for ontobio error handling
+            ontobio_extensions = gpad_parser._parse_full_extension_expression(g[10], split_line)
+            ontobio_extensions = extensions_mapper.dedupe_extensions(ontobio_extensions)
+            # ontobio_pattern = {
+            #     'union_of': [
+            #         {
+            #             'intersection_of': [
+            #                 {'property': 'part_of', 'filler': 'CL:0000678'},
+            #                 {'property': 'part_of', 'filler': 'EMAPA:16525'}
+            #             ]
+            #         },
+            #         {
+            #               'intersection_of': [
+            #                   {'property': 'part_of', 'filler': 'CL:0000678'},
+            #                   {'property': 'part_of', 'filler': 'EMAPA:16525'}
+            #               ]
+            #         }
+            #     ]
+            # }
+            for onto_ext in ontobio_extensions:
+                ext_list = extensions_mapper.extensions_list(onto_ext['intersection_of'], g)
+                check_ext_result = following_rules(ext_list, aspect, go_term)
+                if not check_ext_result.is_valid:
+                    ext_key = ",".join(ext_list)
+                    offending_extension = check_ext_result.offending_extension
+                    if offending_extension is None:
+                        offending_extension = check_ext_result.reason
+                    bad_extensions.append([":".join(g[0:2]), go_term, GO_ONTOLOGY.label(go_term), offending_extension, g[10]])
+                    if ext_key not in ext_dict[aspect]:
+                        ext_dict[aspect][ext_key] = [g]
+                    elif g not in ext_dict[aspect][ext_key]:
+                        ext_dict[aspect][ext_key].append(g)
+
+        for aspect in ['F','P','C']:
+            max_count = 0
+            top_k = None
+            example_v = None
+            for k, v in ext_dict[aspect].items():
+                if len(v) > max_count:
+                    max_count = len(v)
+                    # print(max_count)
+                    top_k = k
+                    example_v = v[0]
 
     def assigner_count(annots, assign):
         count = 0
@@ -0,0 +1,309 @@
+import os
+import re
+import sys
+from ontobio.io.gpadparser import GpadParser
+from gocamgen.collapsed_assoc import extract_properties_from_string, with_from_groups_from_line
+
+RELATION_EXPRESSION = re.compile(r'(.*)\((.*)\)')
+EMPTY = ()
+
+
+class GpadRecord:
+    """
+    One GPAD line, tokenized once. ID strings are interned so a CURIE repeated across lines is stored once, and
+    the with/from pipe groups, annotation properties and extensions are parsed up front. Reads like the
+    ontobio association dict for the keys the filtering and collapsing code looks up.
+
+    The line itself is either held inline or, with a line_store, only as its byte offset in the file.
+    """
+
+    __slots__ = ("line_ref", "line_store", "subject_id", "qualifiers", "negated", "object_id", "references",
+                 "evidence_type", "with_from", "with_from_groups", "interacting_taxon", "date", "provided_by",
+                 "extensions", "annotation_properties")
+
+    def __init__(self, source_line, subject_id, qualifiers, negated, object_id, references, evidence_type, with_from,
+                 with_from_groups, interacting_taxon, date, provided_by, extensions, annotation_properties=None):
+        self.line_ref = source_line  # Byte offset instead when line_store is set
+        self.line_store = None
+        self.subject_id = subject_id
+        self.qualifiers = qualifiers  # Without NOT
+        self.negated = negated
+        self.object_id = object_id
+        self.references = references
+        self.evidence_type = evidence_type
+        self.with_from = with_from  # Sorted, all pipe groups together, like ontobio's with_support_from
+        self.with_from_groups = with_from_groups  # One sorted tuple per pipe group, like get_with_froms()
+        self.interacting_taxon = interacting_taxon
+        self.date = date
+        self.provided_by = provided_by
+        self.extensions = extensions  # Tuple of intersections, each a tuple of (relation, filler)
+        self.annotation_properties = annotation_properties
+
+    @staticmethod
+    def from_assoc(assoc):
+        extensions = tuple(
+            tuple((sys.intern(ext["property"]), sys.intern(ext["filler"])) for ext in uo["intersection_of"])
+            for uo in assoc["object_extensions"].get("union_of", [])
+        )
+        return GpadRecord(
+            source_line=assoc["source_line"],
+            subject_id=sys.intern(assoc["subject"]["id"]),
+            qualifiers=intern_tuple(assoc.get("qualifiers", EMPTY)),
+            negated=assoc["negated"],
+            object_id=sys.intern(assoc["object"]["id"]),
+            references=intern_tuple(assoc["evidence"]["has_supporting_reference"]),
+            evidence_type=sys.intern(assoc["evidence"]["type"]),
+            with_from=intern_tuple(assoc["evidence"]["with_support_from"]),
+            with_from_groups=tuple(intern_tuple(group) for group in with_from_groups_from_line(assoc["source_line"])),
+            interacting_taxon=assoc["interacting_taxon"],
+            date=assoc["date"],
+            provided_by=sys.intern(assoc["provided_by"]),
+            extensions=extensions,
+            annotation_properties=line_properties(assoc["source_line"]),
+        )
+
+    @property
+    def source_line(self):
+        if self.line_store is None:
+            return self.line_ref
+        return self.line_store.line_at(self.line_ref)
+
+    def object_extensions(self):
+        if not self.extensions:
+            return {}
+        return {"union_of": [{"intersection_of": [{"property": relation, "filler": filler}
+                                                  for relation, filler in intersection]}
+                             for intersection in self.extensions]}
+
+    def as_assoc(self):
+        return {key: self[key] for key in self.keys()}
+
+    def keys(self):
+        return [key for key in ASSOC_FIELDS if key in self]
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def __contains__(self, key):
+        if key == "qualifiers":
+            return len(self.qualifiers) > 0
+        if key == "annotation_properties":
+            return self.annotation_properties is not None
+        return key in ASSOC_FIELDS
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return ASSOC_FIELDS[key](self)
+
+    def __str__(self):
+        return self.source_line.rstrip()
+
+
+# ontobio association dict key -> how to build it from a GpadRecord
+ASSOC_FIELDS = {
+    "source_line": lambda r: r.source_line,
+    "subject": lambda r: {"id": r.subject_id, "label": r.subject_id, "fullname": r.subject_id, "synonyms": [],
+                          "taxon": {"id": r.interacting_taxon}},
+    "object": lambda r: {"id": r.object_id},
+    "negated": lambda r: r.negated,
+    "relation": lambda r: {"id": r.qualifiers[0] if r.qualifiers else None},
+    "interacting_taxon": lambda r: r.interacting_taxon,
+    "evidence": lambda r: {"type": r.evidence_type, "with_support_from": list(r.with_from),
+                           "has_supporting_reference": list(r.references)},
+    "subject_extensions": lambda r: [],
+    "object_extensions": lambda r: r.object_extensions(),
+    "aspect": lambda r: None,
+    "provided_by": lambda r: r.provided_by,
+    "date": lambda r: r.date,
+    "qualifiers": lambda r: list(r.qualifiers),
+    "annotation_properties": lambda r: r.annotation_properties,
+}
+
+
+def line_properties(line):
+    # Same rule as extract_properties(): only lines that still have a 12th column after trailing whitespace
+    cols = line.rstrip().split("\t")
+    if len(cols) >= 12:
+        return extract_properties_from_string(cols[11])
+    return None
+
+
+def intern_tuple(ids):
+    if not ids:
+        return EMPTY
+    return tuple(sys.intern(i) for i in ids)
+
+
+def intern_ids(column, delims):
+    if column == "":
+        return EMPTY
+    return tuple(sorted(sys.intern(i) for i in re.split(delims, column)))
+
+
+def decode_line(raw_line):
+    # Same text open() in text mode would give
+    line = raw_line.decode("utf-8")
+    if line.endswith("\r\n"):
+        line = line[:-2] + "\n"
+    return line
+
+
+class GpadLineStore:
+    """
+    Reads GPAD lines back from a plain local file by byte offset, so records don't have to keep their lines in
+    memory. Reads are positional (pread), so forked workers can share one store. Stores come from
+    line_store_for(), and an unpickled store is the process's existing one for that path rather than another
+    open file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def line_at(self, offset):
+        if self.fd is None:
+            self.fd = os.open(self.path, os.O_RDONLY)
+        chunks = []
+        while True:
+            chunk = os.pread(self.fd, 4096, offset)
+            end = chunk.find(b"\n")
+            if end >= 0:
+                chunks.append(chunk[:end + 1])
+                break
+            if not chunk:
+                break
+            chunks.append(chunk)
+            offset += len(chunk)
+        return decode_line(b"".join(chunks))
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __reduce__(self):
+        return line_store_for, (self.path,)
+
+
+# (pid, path) -> GpadLineStore. Keyed by pid since forked workers inherit this along with the parent's files.
+LINE_STORES = {}
+
+
+def line_store_for(path):
+    key = (os.getpid(), path)
+    line_store = LINE_STORES.get(key)
+    if line_store is None:
+        line_store = GpadLineStore(path)
+        LINE_STORES[key] = line_store
+    return line_store
+
+
+def close_line_stores():
+    # Closes the files this process opened. The stores stay registered and reopen on their next read.
+    pid = os.getpid()
+    for (store_pid, _), line_store in LINE_STORES.items():
+        if store_pid == pid:
+            line_store.close()
+
+
+class GpadReader:
+    """
+    Turns GPAD lines into GpadRecords. The fast path only checks what it needs to tokenize a line and hands anything
+    unusual (wrong column count, empty IDs, non-YYYYMMDD dates, taxon columns, malformed extensions) to ontobio's
+    GpadParser, so well-formed lines come out the same either way. strict=True runs every line through GpadParser's
+    ID validation instead, dropping the lines it rejects.
+    """
+
+    def __init__(self, strict=False):
+        self.strict = strict
+        self.gpad_parser = GpadParser()
+
+    def is_header(self, line):
+        return line.startswith("!")
+
+    def parse(self, lines):
+        for line in lines:
+            if self.is_header(line):
+                continue
+            yield from self.parse_line(line)
+
+    def parse_source(self, gpad_source):
+        # Records from a plain local file only keep their line's offset. Streamed (remote or gzipped) files keep
+        # lines inline since there's nothing to read them back from.
+        if not gpad_source.is_seekable():
+            with gpad_source.open() as gf:
+                yield from self.parse(gf)
+            return
+        line_store = line_store_for(gpad_source.location)
+        offset = 0
+        with open(gpad_source.location, "rb") as gf:
+            for raw_line in gf:
+                line_offset = offset
+                offset += len(raw_line)
+                line = decode_line(raw_line)
+                if self.is_header(line):
+                    continue
+                for record in self.parse_line(line):
+                    record.line_ref = line_offset
+                    record.line_store = line_store
+                    yield record
+
+    def parse_line(self, line):
+        if not self.strict:
+            record = self.tokenize(line)
+            if record is not None:
+                return [record]
+        return [GpadRecord.from_assoc(a) for a in self.gpad_parser.parse_line(line).associations if "header" not in a]
+
+    def tokenize(self, line):
+        # None when the line needs ontobio's parsing (and error reporting)
+        vals = [el.strip() for el in line.split("\t")]
+        if len(vals) < 10 or len(vals) > 12:
+            return None
+        if len(vals) < 12:
+            vals += [""] * (12 - len(vals))
+        db, db_object_id, qualifier, goid, reference, evidence, withfrom, taxon, date, assigned_by, xp, props = vals
+        if not db or not db_object_id or ":" not in goid or not reference or taxon:
+            return None
+        if len(date) != 8 or not date.isdigit():
+            return None
+
+        qualifiers = tuple(sys.intern(q) for q in qualifier.split("|")) if qualifier else EMPTY
+        negated = "NOT" in qualifiers
+        if negated:
+            qualifiers = tuple(q for q in qualifiers if q != "NOT")
+
+        extensions = []
+        if xp:
+            for xp_or in sorted(xp.split("|")):
+                intersection = []
+                for xp_and in sorted(xp_or.split(",")):
+                    if xp_and == "":
+                        continue
+                    expression = RELATION_EXPRESSION.findall(xp_and)
+                    if len(expression) != 1 or ":" not in expression[0][1]:
+                        return None
+                    relation, filler = expression[0]
+                    intersection.append((sys.intern(relation), sys.intern(filler)))
+                if intersection:
+                    extensions.append(tuple(intersection))
+
+        return GpadRecord(
+            source_line=line,
+            subject_id=sys.intern(db + ":" + db_object_id),
+            qualifiers=qualifiers,
+            negated=negated,
+            object_id=sys.intern(goid),
+            references=intern_ids(reference, "[|]"),
+            evidence_type=sys.intern(evidence),
+            with_from=intern_ids(withfrom, "[|,]"),
+            with_from_groups=tuple(intern_ids(group, "[,]") for group in withfrom.split("|")),
+            interacting_taxon=None,
+            date=date,
+            provided_by=sys.intern(assigned_by),
+            extensions=tuple(extensions),
+            annotation_properties=line_properties(line) if props else None,
+        )
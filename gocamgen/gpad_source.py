@@ -0,0 +1,99 @@
+import gzip
+import io
+import os
+import time
+import logging
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class GpadSource:
+    """
+    A local, gzipped or HTTP(S) GPAD file. open() streams lines straight off the file or wire, gunzipping on the
+    fly, so nothing gets buffered whole or written to a temporary copy.
+    """
+
+    def __init__(self, location):
+        self.location = location
+        self.last_modified = None
+
+    def is_remote(self):
+        return self.location.startswith("http://") or self.location.startswith("https://")
+
+    def is_gzipped(self):
+        return self.location.endswith(".gz")
+
+    def is_seekable(self):
+        # Lines of a plain local file can be read back by byte offset
+        return not self.is_remote() and not self.is_gzipped()
+
+    def open(self):
+        if self.is_remote():
+            logger.info("Streaming GPAD from {}".format(self.location))
+            response = requests.get(self.location, stream=True)
+            response.raise_for_status()
+            self.last_modified = response.headers.get("Last-Modified")
+            # Undo any Content-Encoding (e.g. server-side gzip) before our own .gz handling
+            response.raw.decode_content = True
+            # Otherwise urllib3 marks the body closed at EOF and TextIOWrapper trips over it
+            response.raw.auto_close = False
+            binary_stream = response.raw
+            if self.is_gzipped():
+                binary_stream = gzip.GzipFile(fileobj=binary_stream)
+            return ResponseTextStream(binary_stream, response)
+        if self.is_gzipped():
+            return gzip.open(self.location, "rt")
+        return open(self.location)
+
+    def read_header(self):
+        # Only the leading "!" lines are read - the stream is dropped as soon as annotation lines start
+        header_data = {
+            "date": ""
+        }
+        date_key = "!date: "
+        with self.open() as gf:
+            for l in gf:
+                if not l.startswith("!"):
+                    break
+                if l.startswith(date_key):
+                    header_data["date"] = l.split(date_key)[1].split("$")[0].strip()
+        return header_data
+
+    def download_date(self):
+        if self.is_remote():
+            if self.last_modified:
+                return self.last_modified
+            return time.ctime()
+        return time.ctime(os.path.getmtime(self.location))
+
+    def report_path(self):
+        if self.is_remote():
+            # Same place the downloaded, gunzipped copy used to land
+            target = self.location.split("/")[-1]
+            if target.endswith(".gz"):
+                target = os.path.splitext(target)[0]
+            return "{}.report".format(target)
+        return "{}.report".format(self.location)
+
+    def __str__(self):
+        return self.location
+
+
+class ResponseTextStream(io.TextIOWrapper):
+    # Text stream over an HTTP response body that also releases the connection when closed
+    def __init__(self, binary_stream, response):
+        io.TextIOWrapper.__init__(self, binary_stream, encoding="utf-8")
+        self.response = response
+
+    def close(self):
+        try:
+            io.TextIOWrapper.close(self)
+        finally:
+            self.response.close()
+
+
+def as_gpad_source(gpad_file):
+    if isinstance(gpad_file, GpadSource):
+        return gpad_file
+    return GpadSource(gpad_file)
@@ -0,0 +1,62 @@
+import datetime
+import json
+import uuid
+from rdflib.term import URIRef, BNode
+
+MODEL_BASE = "http://model.geneontology.org"
+# Namespace for the uuid5s of deterministic IRIs
+MODEL_IRI_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, MODEL_BASE)
+
+
+class IriMinter:
+    """
+    Hands out the model, individual and blank node IDs for one model. By default these are random (uuid4), same as
+    ontobio's genid(). Given a model_key (the gene ID), every ID is instead a uuid5 of the model key, the current
+    scope (the collapsed annotation being translated) and a per-scope counter, so re-running unchanged input
+    writes byte-identical models.
+    """
+
+    def __init__(self, model_key=None):
+        self.model_key = model_key
+        self.scope = ""
+        self.counters = {}  # (scope, kind) -> IDs minted so far
+
+    def is_deterministic(self):
+        return self.model_key is not None
+
+    def set_scope(self, scope):
+        self.scope = scope
+
+    def next_uuid(self, kind):
+        if not self.is_deterministic():
+            return uuid.uuid4()
+        counter_key = (self.scope, kind)
+        count = self.counters.get(counter_key, 0) + 1
+        self.counters[counter_key] = count
+        return uuid.uuid5(MODEL_IRI_NAMESPACE, "\n".join([self.model_key, self.scope, kind, str(count)]))
+
+    def model_iri(self):
+        if not self.is_deterministic():
+            return URIRef(str(uuid.uuid4()), base=MODEL_BASE)
+        return URIRef(str(uuid.uuid5(MODEL_IRI_NAMESPACE, self.model_key)), base=MODEL_BASE)
+
+    def individual_iri(self, base):
+        return URIRef(str(self.next_uuid("individual")), base=base)
+
+    def blank_node(self):
+        if not self.is_deterministic():
+            return BNode()
+        return BNode("b" + self.next_uuid("bnode").hex)
+
+
+def collapsed_association_scope(collapsed_association):
+    # Header of a CollapsedAssociation is plain dicts and lists
+    return json.dumps(collapsed_association.header, sort_keys=True)
+
+
+def latest_annotation_date(assocs):
+    # Stands in for "today" as the model date when IRIs are deterministic - only moves when the annotations do
+    dates = [a["date"] for a in assocs if a.get("date")]
+    if not dates:
+        return None
+    return datetime.datetime.strptime(max(dates), "%Y%m%d")
@@ -0,0 +1,99 @@
+import json
+import logging
+import os
+from gocamgen.errors import JournaledError, error_type_name
+
+logger = logging.getLogger(__name__)
+
+
+class RunJournal:
+    """
+    Append-only JSON lines log of genes a run has finished with - their output path, any errors and, for
+    N-Quads output, the file offset right after the gene's quads. A --resume run skips these genes and picks
+    the report back up from here.
+    """
+
+    def __init__(self, journal_path, run_params=None):
+        self.journal_path = journal_path
+        self.run_params = run_params
+        self.entries = {}  # gene -> {"path": ..., "errors": [[type name, message]], "nquads_offset": ...}
+        self.nquads_offset = None
+        self.journal_file = None
+
+    @staticmethod
+    def journal_path_for(output_directory=None, output_file=None):
+        # output_file is the N-Quads file or archive when models don't go to separate files
+        if output_file:
+            return output_file + ".journal.jsonl"
+        if output_directory:
+            return os.path.normpath(output_directory) + ".journal.jsonl"
+        return "models.journal.jsonl"
+
+    def load(self):
+        if not os.path.isfile(self.journal_path):
+            return self
+        with open(self.journal_path) as jf:
+            for line in jf:
+                try:
+                    entry = json.loads(line)
+                except json.decoder.JSONDecodeError:
+                    # Run died mid-write. Everything up to here is still good.
+                    logger.warning("Ignoring truncated entry at end of journal {}".format(self.journal_path))
+                    break
+                if "run" in entry:
+                    if self.run_params is not None and entry["run"] != self.run_params:
+                        raise ValueError("Journal {} is from a run with different parameters: {}".format(
+                            self.journal_path, entry["run"]))
+                    continue
+                self.entries[entry["gene"]] = entry
+                if entry.get("nquads_offset") is not None:
+                    self.nquads_offset = entry["nquads_offset"]
+        return self
+
+    def open(self, resume=False):
+        if resume and os.path.isfile(self.journal_path):
+            # Rewrite the good entries so a truncated last line doesn't corrupt what gets appended
+            tmp_path = self.journal_path + ".tmp"
+            with open(tmp_path, "w") as jf:
+                self.write_entry(jf, {"run": self.run_params})
+                for entry in self.entries.values():
+                    self.write_entry(jf, entry)
+            os.replace(tmp_path, self.journal_path)
+            self.journal_file = open(self.journal_path, "a")
+        else:
+            self.entries = {}
+            self.nquads_offset = None
+            self.journal_file = open(self.journal_path, "w")
+            self.write_entry(self.journal_file, {"run": self.run_params})
+        return self
+
+    def record(self, gene, output_path, gene_errors, nquads_offset=None):
+        entry = {
+            "gene": gene,
+            "path": output_path,
+            "errors": [[error_type_name(ex), str(ex)] for ex in gene_errors],
+            "nquads_offset": nquads_offset,
+        }
+        self.entries[gene] = entry
+        if nquads_offset is not None:
+            self.nquads_offset = nquads_offset
+        self.write_entry(self.journal_file, entry)
+
+    @staticmethod
+    def write_entry(journal_file, entry):
+        journal_file.write(json.dumps(entry) + "\n")
+        # Flushed per gene so a killed run loses at most the gene it was working on
+        journal_file.flush()
+
+    def is_done(self, gene):
+        return gene in self.entries
+
+    def restore_errors(self, errors):
+        for gene, entry in self.entries.items():
+            for type_name, message in entry["errors"]:
+                errors.add_error(gene, JournaledError(type_name, message))
+
+    def close(self):
+        if self.journal_file is not None:
+            self.journal_file.close()
+            self.journal_file = None
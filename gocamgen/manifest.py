@@ -0,0 +1,110 @@
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FORMAT_VERSION = 1
+
+
+class ModelManifest:
+    """
+    Per-gene content hashes of the last run's model inputs, stored next to the output directory so an
+    --incremental run only re-translates genes whose annotations (or the ontologies/rules) changed.
+    """
+
+    def __init__(self, manifest_path, context_hash=None):
+        self.manifest_path = manifest_path
+        self.context_hash = context_hash
+        self.entries = {}  # gene -> {"hash": ..., "path": ...}
+
+    @staticmethod
+    def manifest_path_for(output_directory):
+        return os.path.normpath(output_directory) + ".manifest.json"
+
+    def load(self):
+        if not os.path.isfile(self.manifest_path):
+            return self
+        with open(self.manifest_path) as mf:
+            try:
+                manifest_ds = json.load(mf)
+            except json.decoder.JSONDecodeError:
+                logger.warning("Corrupt manifest file: {} - Rebuilding all models".format(self.manifest_path))
+                return self
+        if manifest_ds.get("format_version") != MANIFEST_FORMAT_VERSION:
+            return self
+        self.entries = manifest_ds["genes"]
+        if self.context_hash is not None and manifest_ds.get("context_hash") != self.context_hash:
+            # Different ontologies or filter rules - every model has to be redone. Paths are kept so models of
+            # genes that are gone still get removed.
+            logger.info("Ontology/rule versions changed since last run. Rebuilding all models")
+            for entry in self.entries.values():
+                entry["hash"] = None
+        return self
+
+    def save(self):
+        manifest_ds = {
+            "format_version": MANIFEST_FORMAT_VERSION,
+            "context_hash": self.context_hash,
+            "genes": self.entries,
+        }
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as mf:
+            json.dump(manifest_ds, mf)
+        os.replace(tmp_path, self.manifest_path)
+
+    def is_current(self, gene, gene_hash, output_path=None):
+        # output_path is where this run would write the model, e.g. a different --layout moves it
+        entry = self.entries.get(gene)
+        if entry is None or entry["hash"] != gene_hash:
+            return False
+        if output_path is not None and entry["path"] != output_path:
+            return False
+        return os.path.exists(entry["path"])
+
+    def record(self, gene, gene_hash, output_path):
+        entry = self.entries.get(gene)
+        if entry is not None and entry["path"] != output_path and os.path.exists(entry["path"]):
+            # Written somewhere else now - don't leave the old model behind
+            os.remove(entry["path"])
+        self.entries[gene] = {"hash": gene_hash, "path": output_path}
+
+    def mark_stale(self, gene, output_path):
+        # No hash matches, so the gene is redone next run, but its model is still tracked for removal
+        self.record(gene, None, output_path)
+
+    def remove_missing_genes(self, current_genes):
+        # Genes that dropped out of the GPAD (or got entirely filtered out) lose their models
+        removed = []
+        for gene in list(self.entries):
+            if gene not in current_genes:
+                output_path = self.entries.pop(gene)["path"]
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+                removed.append(gene)
+        return removed
+
+
+def gene_content_hash(assocs, context_hash=""):
+    # Collapsing is a pure function of the filtered lines plus the ontology/rule versions in context_hash, so
+    # hashing the filtered source lines covers the collapsed associations too. Sorted so line order doesn't matter.
+    sha = hashlib.sha256(context_hash.encode())
+    for line in sorted(a["source_line"].rstrip() for a in assocs):
+        sha.update(line.encode())
+        sha.update(b"\n")
+    return sha.hexdigest()
+
+
+def run_context_hash(ontology_fingerprints, filter_rule, output_options=None):
+    # output_options: run options that change a model's output, e.g. {"deterministic_ids": True}
+    sha = hashlib.sha256()
+    for handle in sorted(ontology_fingerprints):
+        sha.update("{}={}\n".format(handle, ontology_fingerprints[handle]).encode())
+    if output_options:
+        for option in sorted(output_options):
+            sha.update("{}={}\n".format(option, output_options[option]).encode())
+    sha.update("filter_rule={}\n".format(filter_rule.id).encode())
+    with open(filter_rule.rule_filepath(), "rb") as rf:
+        sha.update(rf.read())
+    return sha.hexdigest()
@@ -0,0 +1,210 @@
+from ontobio.ontol import Ontology, LogicalDefinition, PropertyChainAxiom
+from ontobio.ontol_factory import OntologyFactory
+import networkx
+import requests
+from requests.exceptions import RequestException
+import hashlib
+import logging
+import os
+import pickle
+import re
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the compiled layout changes so stale snapshots get rebuilt instead of misread
+SNAPSHOT_FORMAT_VERSION = 1
+DEFAULT_SNAPSHOT_DIR = "resources/ontology_snapshots"
+# Node meta we actually consult (labels live on the node itself). Definitions, synonyms, comments etc. are dropped.
+KEPT_META_KEYS = ["xrefs", "deprecated", "basicPropertyValues", "subsets"]
+VERSION_PATTERNS = [
+    re.compile(r'owl:versionIRI\s+rdf:resource="([^"]+)"'),  # RDF/XML
+    re.compile(r'^data-version:\s*(\S+)', re.MULTILINE),  # OBO
+]
+
+
+class OntologySnapshotCache:
+    """
+    Compiles ontologies into a compact pickled form (nodes, labels, edges, logical definitions, property chains) so
+    later runs can skip OntologyFactory entirely. A snapshot is reused as long as it still matches the source's
+    checksum (local files) or version IRI (PURLs).
+    """
+
+    def __init__(self, snapshot_dir=DEFAULT_SNAPSHOT_DIR, offline=False):
+        self.snapshot_dir = snapshot_dir
+        # Offline: trust any existing snapshot without checking the source
+        self.offline = offline
+        # handle -> fingerprint of whatever was actually loaded, for callers that key caches on ontology versions
+        self.fingerprints = {}
+
+    def load(self, handle):
+        ontology, fingerprint = self.load_with_fingerprint(handle)
+        self.fingerprints[handle] = fingerprint
+        return ontology
+
+    def load_with_fingerprint(self, handle):
+        snapshot_path = self.snapshot_path(handle)
+        snapshot = read_snapshot(snapshot_path)
+        fingerprint = None
+        if snapshot is not None:
+            if self.offline:
+                logger.info("Offline - using {} snapshot without checking source".format(handle))
+                return snapshot_to_ontology(snapshot), snapshot["fingerprint"]
+            fingerprint = source_fingerprint(handle)
+            if fingerprint is None:
+                logger.warning("Couldn't check {} for changes. Using existing snapshot".format(handle))
+                return snapshot_to_ontology(snapshot), snapshot["fingerprint"]
+            if fingerprint == snapshot["fingerprint"]:
+                logger.info("Loaded {} from snapshot {}".format(handle, snapshot_path))
+                return snapshot_to_ontology(snapshot), snapshot["fingerprint"]
+            logger.info("Snapshot for {} is stale ({} != {}). Recompiling".format(handle, snapshot["fingerprint"],
+                                                                                 fingerprint))
+        if fingerprint is None:
+            fingerprint = source_fingerprint(handle)
+        ontology = OntologyFactory().create(handle)
+        if fingerprint is None:
+            fingerprint = ("version", ontology_version(ontology))
+        snapshot = compile_ontology(ontology, handle, fingerprint)
+        write_snapshot(snapshot, snapshot_path)
+        logger.info("Compiled {} snapshot to {}".format(handle, snapshot_path))
+        return snapshot_to_ontology(snapshot), snapshot["fingerprint"]
+
+    def load_derived(self, name, handles, build):
+        # Lookup tables computed from loaded ontologies. Kept only as long as every source ontology's fingerprint
+        # still matches, so load() the handles first.
+        fingerprints = [self.fingerprints.get(handle) for handle in handles]
+        derived_path = os.path.join(self.snapshot_dir, "{}.derived.snapshot".format(name))
+        snapshot = read_snapshot(derived_path)
+        if snapshot is not None and snapshot["fingerprints"] == fingerprints:
+            logger.info("Loaded {} from snapshot {}".format(name, derived_path))
+            return snapshot["data"]
+        data = build()
+        if None not in fingerprints:
+            write_snapshot({"format_version": SNAPSHOT_FORMAT_VERSION, "fingerprints": fingerprints, "data": data},
+                           derived_path)
+        return data
+
+    def snapshot_path(self, handle):
+        handle_hash = hashlib.sha256(handle.encode()).hexdigest()[0:16]
+        name = re.sub(r"[^A-Za-z0-9_.\-]", "_", os.path.basename(handle.rstrip("/")))
+        return os.path.join(self.snapshot_dir, "{}-{}.snapshot".format(name, handle_hash))
+
+
+def compile_ontology(ontology, handle, fingerprint):
+    graph = ontology.get_graph()
+    nodes = []
+    for n, d in graph.nodes(data=True):
+        attrs = {k: v for k, v in d.items() if k != "meta"}
+        meta = d.get("meta")
+        if meta:
+            kept_meta = {k: meta[k] for k in KEPT_META_KEYS if k in meta}
+            if kept_meta:
+                attrs["meta"] = kept_meta
+        nodes.append((n, attrs))
+    edges = [(u, v, d.get("pred")) for u, v, d in graph.edges(data=True)]
+    logical_definitions = [(ld.class_id, ld.genus_ids, ld.restrictions)
+                           for ld in (ontology.all_logical_definitions or [])]
+    property_chain_axioms = [(pca.predicate_id, pca.chain_predicate_ids)
+                             for pca in (getattr(ontology, "all_property_chain_axioms", None) or [])]
+    return {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "handle": handle,
+        "fingerprint": fingerprint,
+        "id": ontology.id,
+        "meta": ontology.meta,
+        "nodes": nodes,
+        "edges": edges,
+        "logical_definitions": logical_definitions,
+        "property_chain_axioms": property_chain_axioms,
+    }
+
+
+def snapshot_to_ontology(snapshot):
+    graph = networkx.MultiDiGraph()
+    graph.add_nodes_from(snapshot["nodes"])
+    graph.add_edges_from((u, v, {"pred": pred}) for u, v, pred in snapshot["edges"])
+    xref_graph = networkx.MultiGraph()
+    for n, attrs in snapshot["nodes"]:
+        for x in attrs.get("meta", {}).get("xrefs", []):
+            xref_graph.add_edge(x["val"], n, source=n)
+    payload = {
+        "id": snapshot["id"],
+        "meta": snapshot["meta"],
+        "graph": graph,
+        "xref_graph": xref_graph,
+        "logical_definitions": [LogicalDefinition(class_id, genus_ids, restrictions)
+                                for class_id, genus_ids, restrictions in snapshot["logical_definitions"]],
+        "property_chain_axioms": [PropertyChainAxiom(predicate_id, chain_predicate_ids)
+                                  for predicate_id, chain_predicate_ids in snapshot["property_chain_axioms"]],
+    }
+    return Ontology(handle=snapshot["handle"], payload=payload)
+
+
+def read_snapshot(snapshot_path):
+    if not os.path.isfile(snapshot_path):
+        return None
+    try:
+        with open(snapshot_path, "rb") as sf:
+            snapshot = pickle.load(sf)
+    except (pickle.UnpicklingError, EOFError, AttributeError, ValueError) as ex:
+        logger.warning("Corrupt ontology snapshot {} ({}) - Recompiling...".format(snapshot_path, ex))
+        return None
+    if snapshot.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        return None
+    return snapshot
+
+
+def write_snapshot(snapshot, snapshot_path):
+    os.makedirs(os.path.dirname(snapshot_path) or ".", exist_ok=True)
+    # Write-then-rename so an interrupted run never leaves a truncated snapshot behind
+    tmp_path = snapshot_path + ".tmp"
+    with open(tmp_path, "wb") as sf:
+        pickle.dump(snapshot, sf, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, snapshot_path)
+
+
+def source_fingerprint(handle):
+    if os.path.isfile(handle):
+        return ("sha256", file_checksum(handle))
+    if handle.startswith("http://") or handle.startswith("https://"):
+        version = read_remote_version(handle)
+        if version is not None:
+            return ("version", version)
+    return None
+
+
+def file_checksum(filepath, block_size=1 << 20):
+    sha = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def read_remote_version(url, max_bytes=1 << 16):
+    # The version IRI/data-version sits in the ontology header, so the first few KB are plenty
+    try:
+        with requests.get(url, stream=True, timeout=30) as response:
+            if response.status_code != 200:
+                return None
+            head = b""
+            for chunk in response.iter_content(chunk_size=8192):
+                head += chunk
+                if len(head) >= max_bytes:
+                    break
+    except RequestException as ex:
+        logger.warning("Couldn't fetch header of {}: {}".format(url, ex))
+        return None
+    return parse_version(head.decode("utf-8", errors="replace"))
+
+
+def parse_version(header_text):
+    for pattern in VERSION_PATTERNS:
+        match = pattern.search(header_text)
+        if match:
+            return match.group(1)
+    return None
+
+
+def ontology_version(ontology):
+    meta = ontology.meta or {}
+    return meta.get("version")
@@ -0,0 +1,140 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+REGULATES = "RO:0002211"
+RO_HANDLE = "http://purl.obolibrary.org/obo/ro.owl"
+GOREL_HANDLE = "http://release.geneontology.org/2019-03-18/ontology/extensions/gorel.obo"
+
+
+def normalize_relation_label(label):
+    # GPAD extensions say "has_input", RO labels say "has input"
+    return label.replace("_", " ").strip()
+
+
+class RelationResolver:
+    """
+    Extension relation label -> RO/BFO ID lookup, built once from RO and GOREL instead of walking every node's
+    label per extension. GOREL relations resolve to their RO/BFO xref, or failing that, their first xref (usually
+    GOREL itself), which resolve() flags so the model can declare it.
+    """
+
+    def __init__(self, ro_relations=None, gorel_relations=None):
+        self.ro_relations = ro_relations if ro_relations is not None else {}  # label -> ID
+        self.gorel_relations = gorel_relations if gorel_relations is not None else {}  # label -> (ID, is_fallback)
+
+    @staticmethod
+    def from_ontologies(ro_ontology, gorel_ontology=None):
+        resolver = RelationResolver()
+        for n in ro_ontology.nodes():
+            node_label = ro_ontology.label(n)
+            if node_label:
+                # First node with a label wins, same as the old linear scan
+                resolver.ro_relations.setdefault(normalize_relation_label(node_label), n)
+        if gorel_ontology is not None:
+            for n in gorel_ontology.nodes():
+                node_label = gorel_ontology.label(n)
+                if not node_label:
+                    continue
+                key = normalize_relation_label(node_label)
+                if key in resolver.gorel_relations:
+                    continue
+                xrefs = gorel_ontology.node(n).get('meta', {}).get('xrefs')
+                if not xrefs:
+                    continue
+                resolved = None
+                for xref in xrefs:
+                    val = xref['val']
+                    if val.startswith('RO') or val.startswith('BFO'):
+                        resolved = (val, False)
+                        break
+                if resolved is None:
+                    resolved = (xrefs[0]['val'], True)
+                resolver.gorel_relations[key] = resolved
+        return resolver
+
+    def resolve(self, relation_label):
+        # Returns (relation ID, is_fallback). is_fallback means a non-RO GOREL xref the model has to declare itself.
+        key = normalize_relation_label(relation_label)
+        relation = self.ro_relations.get(key)
+        if relation is not None:
+            return relation, False
+        return self.gorel_relations.get(key, (None, False))
+
+    def to_data(self):
+        return {"ro_relations": self.ro_relations, "gorel_relations": self.gorel_relations}
+
+    @staticmethod
+    def from_data(data):
+        return RelationResolver(data["ro_relations"], data["gorel_relations"])
+
+
+def load_relation_resolver(snapshot_cache, ro_handle, gorel_handle, ro_ontology, gorel_ontology):
+    # Saved next to the RO/GOREL snapshots and rebuilt whenever either of them changes
+    data = snapshot_cache.load_derived("relation_labels", [ro_handle, gorel_handle],
+                                       lambda: RelationResolver.from_ontologies(ro_ontology, gorel_ontology).to_data())
+    return RelationResolver.from_data(data)
+
+
+class RelationAlgebra:
+    """
+    The bits of RO (and GO logical definitions) that regulation extensions get translated with, precomputed
+    when the builder starts: the regulates family, subPropertyOf parents, property chains and each GO term's
+    regulates restrictions. Lookups never touch the ontology graphs.
+    """
+
+    def __init__(self, regulates_family, super_properties, chain_links, regulates_restrictions):
+        self.regulates_family = frozenset(regulates_family)
+        self.super_properties = super_properties  # relation -> subPropertyOf parents
+        self.chain_links = chain_links  # relation -> 2nd predicate of its first property chain
+        self.regulates_restrictions = regulates_restrictions  # GO term -> regulates-family restrictions in its LDs
+
+    @staticmethod
+    def from_ontologies(ro_ontology, go_ontology):
+        regulates_family = ro_ontology.descendants(REGULATES, reflexive=True)
+        super_properties = {r: tuple(ro_ontology.parents(r, relations=['subPropertyOf'])) for r in regulates_family}
+        chain_links = {}
+        for pca in (getattr(ro_ontology, "all_property_chain_axioms", None) or []):
+            if pca.predicate_id not in chain_links:
+                chain_links[pca.predicate_id] = pca.chain_predicate_ids[1]  # always 2nd idx?
+        regulates_family_set = frozenset(regulates_family)
+        regulates_restrictions = {}
+        for ld in (go_ontology.all_logical_definitions or []):
+            for r in ld.restrictions:
+                if r[0] in regulates_family_set:
+                    regulates_restrictions.setdefault(ld.class_id, []).append(tuple(r))
+        return RelationAlgebra(regulates_family, super_properties, chain_links,
+                               {term: tuple(rs) for term, rs in regulates_restrictions.items()})
+
+    def restrictions(self, term):
+        return self.regulates_restrictions.get(term, ())
+
+    def causally_upstream_relation(self, relation):
+        if relation in self.regulates_family:
+            # For GO:0045944 the parents are both RO:0002304 and RO:0002211 - regulates_rel will only ever be
+            # regulates, positively regulates, or negatively regulates, so take the one that isn't regulates.
+            for p in self.super_properties.get(relation, ()):
+                if not p == REGULATES:
+                    return p
+            return None
+        # input relations could have some unique logical difference (e.g. positively_regulates vs acts_upstream_of)
+        return self.chain_links[relation]
+
+    def to_data(self):
+        return {
+            "regulates_family": sorted(self.regulates_family),
+            "super_properties": self.super_properties,
+            "chain_links": self.chain_links,
+            "regulates_restrictions": self.regulates_restrictions,
+        }
+
+    @staticmethod
+    def from_data(data):
+        return RelationAlgebra(data["regulates_family"], data["super_properties"], data["chain_links"],
+                               data["regulates_restrictions"])
+
+
+def load_relation_algebra(snapshot_cache, ro_handle, go_handle, ro_ontology, go_ontology):
+    data = snapshot_cache.load_derived("relation_algebra", [ro_handle, go_handle],
+                                       lambda: RelationAlgebra.from_ontologies(ro_ontology, go_ontology).to_data())
+    return RelationAlgebra.from_data(data)
@@ -0,0 +1,87 @@
+import json
+import time
+
+# Report order. "translate" includes the time spent in "collapse" and building ("template_miss") or reusing
+# ("template_hit") annotation subgraph templates.
+STAGES = ["parse", "filter", "group", "collapse", "template_hit", "template_miss", "translate", "write"]
+
+
+class StageTimer:
+    """
+    Accumulates wall time, CPU time and item counts per pipeline stage. Worker processes each keep their own
+    timer and the parent merge()s them into the run's totals.
+    """
+
+    def __init__(self):
+        self.stages = {}  # stage -> {"wall": ..., "cpu": ..., "count": ...}
+
+    @staticmethod
+    def clock():
+        return time.perf_counter(), time.process_time()
+
+    def add(self, stage, wall, cpu, count=1):
+        totals = self.stages.get(stage)
+        if totals is None:
+            totals = {"wall": 0.0, "cpu": 0.0, "count": 0}
+            self.stages[stage] = totals
+        totals["wall"] += wall
+        totals["cpu"] += cpu
+        totals["count"] += count
+
+    def add_since(self, stage, start, count=1):
+        # start is a clock() reading
+        wall, cpu = StageTimer.clock()
+        self.add(stage, wall - start[0], cpu - start[1], count)
+
+    def stage(self, stage, count=1):
+        return TimedStage(self, stage, count)
+
+    def merge(self, other_timer):
+        for stage, totals in other_timer.stages.items():
+            self.add(stage, totals["wall"], totals["cpu"], totals["count"])
+
+    def ordered_stages(self):
+        extra_stages = sorted(s for s in self.stages if s not in STAGES)
+        return [s for s in STAGES + extra_stages if s in self.stages]
+
+    def to_dict(self):
+        stats = {}
+        for stage in self.ordered_stages():
+            totals = self.stages[stage]
+            stats[stage] = {
+                "wall_sec": round(totals["wall"], 6),
+                "cpu_sec": round(totals["cpu"], 6),
+                "count": totals["count"],
+                "per_sec": round(totals["count"] / totals["wall"], 3) if totals["wall"] > 0 else None,
+            }
+        return stats
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def summary_lines(self):
+        lines = []
+        for stage, stats in self.to_dict().items():
+            throughput = ""
+            if stats["per_sec"] is not None:
+                throughput = ", {:.1f}/sec".format(stats["per_sec"])
+            lines.append("{}: {:.2f} sec wall, {:.2f} sec CPU, {} items{}".format(stage, stats["wall_sec"],
+                                                                                 stats["cpu_sec"], stats["count"],
+                                                                                 throughput))
+        return lines
+
+
+class TimedStage:
+    # Plain class instead of contextlib.contextmanager - this wraps per-model calls and should stay cheap
+    def __init__(self, stage_timer, stage, count=1):
+        self.stage_timer = stage_timer
+        self.stage = stage
+        self.count = count
+        self.start = None
+
+    def __enter__(self):
+        self.start = StageTimer.clock()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stage_timer.add_since(self.stage, self.start, self.count)
@@ -21,11 +21,33 @@ logger = logging.getLogger(__name__)
 
 class AnnotationSubgraph(MultiDiGraph):
 
-    def __init__(self, annot):
+    def __init__(self, annot=None):
         MultiDiGraph.__init__(self)
         # self.source_line = annot.get("source_line").rstrip().replace("\t", " ")
         self.class_counts = {}
 
+    def substitute_class(self, from_class, to_class):
+        # Copy with every from_class instance node made a to_class instance. Node order, and with it the order
+        # individuals get declared in, stays the same.
+        next_num = self.class_counts.get(to_class, 0)
+        mapping = {}
+        for n in self:
+            if AnnotationSubgraph.node_class(n) == from_class:
+                next_num += 1
+                mapping[n] = "{}-{}".format(to_class, next_num)
+        subgraph = AnnotationSubgraph()
+        for n, data in self.nodes(data=True):
+            node_id = mapping.get(n, n)
+            subgraph.add_node(node_id, **data)
+            if n in mapping:
+                subgraph.nodes[node_id]["sparql_var"] = node_id.replace(":", "_").replace("-", "_")
+        for u, v, data in self.edges(data=True):
+            MultiDiGraph.add_edge(subgraph, mapping.get(u, u), mapping.get(v, v), **data)
+        subgraph.class_counts = dict(self.class_counts)
+        subgraph.class_counts[to_class] = next_num
+        subgraph.class_counts.pop(from_class, None)
+        return subgraph
+
     def add_edge(self, u_for_edge, relation, v_for_edge, key=None, **attr):
         attr["relation"] = relation
         MultiDiGraph.add_edge(self, u_for_edge, v_for_edge, key, **attr)
@@ -0,0 +1,62 @@
+from collections import OrderedDict
+
+# Stands in for the gene product's ID in template subgraphs
+GENE_PLACEHOLDER = "GENE:PRODUCT"
+
+
+def annotation_shape_key(collapsed_association):
+    # Everything about a collapsed association that its subgraphs depend on, except the gene
+    return (
+        tuple(collapsed_association.qualifiers()),
+        collapsed_association.object_id(),
+        tuple(ext_set.extensions for ext_set in collapsed_association.extension_sets()),
+        tuple(collapsed_association.with_from() or ()),
+    )
+
+
+class AnnotationTemplate:
+    """
+    The AnnotationSubgraphs translated from one annotation shape, with GENE_PLACEHOLDER for the gene product,
+    plus any fallback (non-RO) relations the translation has to declare in the model.
+    """
+
+    def __init__(self, subgraphs, relation_declarations):
+        self.subgraphs = subgraphs
+        self.relation_declarations = relation_declarations  # [(relation ID, relation label)]
+
+    def instantiate(self, gp_id):
+        # Fresh copies, since writing a subgraph to a model records instance IRIs on its nodes
+        return [subgraph.substitute_class(GENE_PLACEHOLDER, gp_id) for subgraph in self.subgraphs]
+
+
+class TranslationTemplateCache:
+    """
+    Least recently used AnnotationTemplates by annotation_shape_key(), shared by every model a GoCamBuilder
+    translates. Templates only depend on the ontologies, so nothing ever needs invalidating.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.templates = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        template = self.templates.get(key)
+        if template is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.templates.move_to_end(key)
+        return template
+
+    def put(self, key, template):
+        if self.max_size <= 0:
+            return
+        self.templates[key] = template
+        self.templates.move_to_end(key)
+        while len(self.templates) > self.max_size:
+            self.templates.popitem(last=False)
+
+    def __len__(self):
+        return len(self.templates)
@@ -0,0 +1,112 @@
+import rdflib
+from rdflib.namespace import RDF, RDFS, XSD
+
+# Same prefixes an empty rdflib 4 Graph starts out with
+DEFAULT_NAMESPACES = [
+    ("xml", "http://www.w3.org/XML/1998/namespace"),
+    ("rdf", str(RDF)),
+    ("rdfs", str(RDFS)),
+    ("xsd", str(XSD)),
+]
+
+
+class TripleBuffer:
+    """
+    Construction-time triple store for a model. Terms are interned to ints and only the (s, p) and (p, o)
+    indexes the translator queries are kept. A model only uses a few dozen predicates, so subject- or object-only
+    patterns are answered by trying each of them. to_graph() builds the rdflib Graph once the model is done.
+    """
+
+    def __init__(self):
+        self.terms = []  # int -> term
+        self.term_ids = {}  # term -> int
+        self.triple_ids = {}  # (s, p, o) ints, in insertion order (dict as an ordered set)
+        self.sp_index = {}  # (s, p) -> [o]
+        self.po_index = {}  # (p, o) -> [s]
+        self.predicates = {}  # p ints, in first-use order
+        self.namespace_prefixes = {}  # namespace -> prefix, in binding order
+        for prefix, namespace in DEFAULT_NAMESPACES:
+            self.bind(prefix, namespace)
+
+    def intern(self, term):
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            term_id = len(self.terms)
+            self.terms.append(term)
+            self.term_ids[term] = term_id
+        return term_id
+
+    def add(self, triple):
+        s, p, o = triple
+        triple_id = (self.intern(s), self.intern(p), self.intern(o))
+        if triple_id in self.triple_ids:
+            return
+        self.triple_ids[triple_id] = None
+        self.sp_index.setdefault(triple_id[0:2], []).append(triple_id[2])
+        self.po_index.setdefault(triple_id[1:3], []).append(triple_id[0])
+        self.predicates[triple_id[1]] = None
+
+    def triples(self, pattern):
+        # None is a wildcard, same as rdflib's Graph.triples()
+        s, p, o = pattern
+        ids = []
+        for term in pattern:
+            if term is None:
+                ids.append(None)
+            else:
+                term_id = self.term_ids.get(term)
+                if term_id is None:
+                    return  # Term isn't in the model at all
+                ids.append(term_id)
+        s_id, p_id, o_id = ids
+        terms = self.terms
+        # Snapshot the matches first so callers can add triples while iterating
+        if s_id is not None and p_id is not None:
+            matches = [(s_id, p_id, oi) for oi in self.sp_index.get((s_id, p_id), ()) if o_id is None or oi == o_id]
+        elif p_id is not None and o_id is not None:
+            matches = [(si, p_id, o_id) for si in self.po_index.get((p_id, o_id), ())]
+        elif s_id is not None:
+            matches = [(s_id, pi, oi) for pi in self.predicates for oi in self.sp_index.get((s_id, pi), ())
+                       if o_id is None or oi == o_id]
+        elif o_id is not None:
+            matches = [(si, pi, o_id) for pi in self.predicates for si in self.po_index.get((pi, o_id), ())]
+        else:
+            # Only (None, p, None) and (None, None, None) scan
+            matches = [t for t in self.triple_ids if p_id is None or t[1] == p_id]
+        for si, pi, oi in matches:
+            yield terms[si], terms[pi], terms[oi]
+
+    def __contains__(self, pattern):
+        for _ in self.triples(pattern):
+            return True
+        return False
+
+    def __iter__(self):
+        terms = self.terms
+        for si, pi, oi in list(self.triple_ids):
+            yield terms[si], terms[pi], terms[oi]
+
+    def __len__(self):
+        return len(self.triple_ids)
+
+    def bind(self, prefix, namespace):
+        namespace = str(namespace)
+        if prefix in self.namespace_prefixes.values() and self.namespace_prefixes.get(namespace) != prefix:
+            # Prefix already means something else - keep the first binding
+            return
+        self.namespace_prefixes[namespace] = prefix
+
+    def namespaces(self):
+        for namespace, prefix in self.namespace_prefixes.items():
+            yield prefix, rdflib.URIRef(namespace)
+
+    def to_graph(self, identifier=None, store=None):
+        if store is not None:
+            graph = rdflib.Graph(identifier=identifier, store=store)
+        else:
+            graph = rdflib.Graph(identifier=identifier)
+        for prefix, namespace in self.namespaces():
+            graph.bind(prefix, namespace)
+        for triple in self:
+            graph.add(triple)
+        return graph
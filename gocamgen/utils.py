@@ -83,7 +83,7 @@ class ShexHelper:
         if aspect == "C":
             # Oh great, now we gotta look further into the ontology
             # TODO: ensure reflexive=True in all ancestors calls in ontobio.util.go_utils.get_ancestors_through_subont()
-            if complex_term in go_aspector.get_isa_closure(class_term) + [class_term]:
+            if go_aspector.is_isa_under(class_term, complex_term):
                 return shape_map[complex_term]
             else:
                 return shape_map["GO:0005575"]
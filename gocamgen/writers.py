@@ -0,0 +1,218 @@
+from rdflib.graph import ConjunctiveGraph
+from rdflib.namespace import RDF
+from rdflib.term import URIRef, BNode, Literal
+from os import path
+import io
+import logging
+import re
+import tarfile
+import time
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+# Deliberately stricter than Turtle's PN_PREFIX/PN_LOCAL - anything else is just written out as a full <IRI>
+PREFIX_PATTERN = re.compile(r"^([A-Za-z]([A-Za-z0-9_\-]*[A-Za-z0-9_\-])?)?$")
+LOCAL_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_]([A-Za-z0-9_\-.]*[A-Za-z0-9_\-])?$")
+BNODE_LABEL_PATTERN = re.compile(r"^[A-Za-z0-9_]+$")
+IRI_ESCAPE_PATTERN = re.compile(r'[\x00-\x20<>"{}|^`\\]')
+LITERAL_ESCAPES = {"\\": "\\\\", '"': '\\"', "\n": "\\n", "\r": "\\r", "\t": "\\t"}
+LITERAL_ESCAPE_PATTERN = re.compile(r'[\\"\n\r\t]')
+
+
+def model_nquads(model):
+    # Each model owns its store, so the conjunctive view over it holds exactly this model's graph
+    return ConjunctiveGraph(store=model.graph.store).serialize(format="nquads", encoding="utf-8")
+
+
+class NQuadsWriter:
+    # Appends each finished model's quads to a single N-Quads file so output starts flowing right away and
+    # no model has to stay in memory until the end of the run.
+    def __init__(self, filepath, resume_offset=None):
+        self.filepath = filepath
+        self.model_count = 0
+        if resume_offset is not None and path.isfile(filepath):
+            if path.getsize(filepath) < resume_offset:
+                raise ValueError("{} is shorter than its journal says ({} bytes)".format(filepath, resume_offset))
+            # Drop whatever got written after the last journaled model
+            self.out_file = open(filepath, "r+b")
+            self.out_file.truncate(resume_offset)
+            self.out_file.seek(resume_offset)
+        else:
+            self.out_file = open(filepath, "wb")
+
+    def write_model(self, model):
+        self.write_data(model_nquads(model))
+
+    def write_data(self, nquads_data):
+        self.out_file.write(nquads_data)
+        self.model_count += 1
+
+    def checkpoint(self):
+        # Offset of the end of the last complete model, flushed so it's safe to journal
+        self.out_file.flush()
+        return self.out_file.tell()
+
+    def close(self):
+        self.out_file.close()
+        logger.info("{} models written out in N-Quads format to {}".format(self.model_count, self.filepath))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ModelArchiveWriter:
+    """
+    Streams serialized models into a single .tar, .tar.gz/.tgz or .zip instead of one file (and inode) per
+    model. A "<archive>.index.tsv" maps each gene to its member name and the offset of that member's header -
+    in the uncompressed tar stream, or of its local header in a zip.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.index_path = filepath + ".index.tsv"
+        self.tar_file = None
+        self.zip_file = None
+        if filepath.endswith(".zip"):
+            self.zip_file = zipfile.ZipFile(filepath, "w", compression=zipfile.ZIP_DEFLATED)
+        elif filepath.endswith(".tar.gz") or filepath.endswith(".tgz"):
+            self.tar_file = tarfile.open(filepath, "w:gz")
+        elif filepath.endswith(".tar"):
+            self.tar_file = tarfile.open(filepath, "w")
+        else:
+            raise ValueError("Archive {} must end in .tar, .tar.gz, .tgz or .zip".format(filepath))
+        self.index_file = open(self.index_path, "w")
+        self.index_file.write("gene\tmember\toffset\n")
+        self.model_count = 0
+
+    def write_data(self, gene, member_name, model_data):
+        if self.tar_file is not None:
+            offset = self.tar_file.offset
+            member_info = tarfile.TarInfo(member_name)
+            member_info.size = len(model_data)
+            member_info.mtime = time.time()
+            self.tar_file.addfile(member_info, io.BytesIO(model_data))
+        else:
+            self.zip_file.writestr(member_name, model_data)
+            offset = self.zip_file.getinfo(member_name).header_offset
+        self.index_file.write("{}\t{}\t{}\n".format(gene, member_name, offset))
+        self.model_count += 1
+
+    def close(self):
+        if self.tar_file is not None:
+            self.tar_file.close()
+        else:
+            self.zip_file.close()
+        self.index_file.close()
+        logger.info("{} models written to {} (index: {})".format(self.model_count, self.filepath, self.index_path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def read_archive_index(index_path):
+    # gene -> (member name, offset)
+    index = {}
+    with open(index_path) as index_file:
+        next(index_file)  # header
+        for line in index_file:
+            gene, member_name, offset = line.rstrip("\n").split("\t")
+            index[gene] = (member_name, int(offset))
+    return index
+
+
+class FastTripleWriter:
+    """
+    Writes a graph as Turtle ("ttl") or N-Triples ("nt") in a single pass over its triples. Unlike rdflib's
+    turtle serializer nothing is sorted or built up in memory - prefixed names come straight from the graph's
+    bound namespaces and consecutive triples about the same subject share it via ";".
+    """
+
+    def __init__(self, graph, format="ttl"):
+        if format not in ("ttl", "nt"):
+            raise ValueError("Fast writer only supports ttl and nt, not {}".format(format))
+        self.graph = graph
+        self.format = format
+        self.prefixes = []  # (namespace, prefix), longest namespace first
+        if format == "ttl":
+            for prefix, namespace in graph.namespaces():
+                if PREFIX_PATTERN.match(prefix) and not IRI_ESCAPE_PATTERN.search(str(namespace)):
+                    self.prefixes.append((str(namespace), prefix))
+            self.prefixes.sort(key=lambda p: len(p[0]), reverse=True)
+        self.term_cache = {}
+        self.bnode_labels = {}
+
+    def write(self, out_file):
+        # out_file is a text-mode file handle
+        if self.format == "ttl":
+            for namespace, prefix in self.prefixes:
+                out_file.write("@prefix {}: <{}> .\n".format(prefix, namespace))
+            out_file.write("\n")
+        previous_subject = None
+        for s, p, o in self.graph:
+            if self.format == "nt":
+                out_file.write("{} {} {} .\n".format(self.term(s), self.term(p), self.term(o)))
+            elif s == previous_subject:
+                out_file.write(" ;\n    {} {}".format(self.predicate(p), self.term(o)))
+            else:
+                if previous_subject is not None:
+                    out_file.write(" .\n")
+                out_file.write("{} {} {}".format(self.term(s), self.predicate(p), self.term(o)))
+                previous_subject = s
+        if previous_subject is not None:
+            out_file.write(" .\n")
+
+    def predicate(self, p):
+        if p == RDF.type and self.format == "ttl":
+            return "a"
+        return self.term(p)
+
+    def term(self, t):
+        rendered = self.term_cache.get(t)
+        if rendered is None:
+            if isinstance(t, URIRef):
+                rendered = self.uri(t)
+            elif isinstance(t, BNode):
+                rendered = "_:" + self.bnode_label(t)
+            elif isinstance(t, Literal):
+                rendered = self.literal(t)
+            else:
+                raise ValueError("Can't serialize term {!r}".format(t))
+            self.term_cache[t] = rendered
+        return rendered
+
+    def uri(self, uri):
+        uri = str(uri)
+        for namespace, prefix in self.prefixes:
+            if uri.startswith(namespace):
+                local_name = uri[len(namespace):]
+                if LOCAL_NAME_PATTERN.match(local_name):
+                    return "{}:{}".format(prefix, local_name)
+        return "<{}>".format(IRI_ESCAPE_PATTERN.sub(lambda m: "\\u{:04X}".format(ord(m.group(0))), uri))
+
+    def bnode_label(self, bnode):
+        label = str(bnode)
+        if BNODE_LABEL_PATTERN.match(label):
+            return label
+        if bnode not in self.bnode_labels:
+            self.bnode_labels[bnode] = "b{}".format(len(self.bnode_labels))
+        return self.bnode_labels[bnode]
+
+    def literal(self, literal):
+        lexical = '"{}"'.format(LITERAL_ESCAPE_PATTERN.sub(lambda m: LITERAL_ESCAPES[m.group(0)], str(literal)))
+        if literal.language:
+            return "{}@{}".format(lexical, literal.language)
+        if literal.datatype:
+            return "{}^^{}".format(lexical, self.term(URIRef(literal.datatype)))
+        return lexical
+
+
+def write_graph_fast(graph, filename, format="ttl"):
+    with open(filename, "w", encoding="utf-8", buffering=1024 * 1024) as out_file:
+        FastTripleWriter(graph, format).write(out_file)
@@ -13,6 +13,7 @@ setup(
     url="https://github.com/dustine32/gocamgen",
     install_requires=[
         "ontobio==1.13.1",
-        "PyShEx==0.7.11"
+        "PyShEx==0.7.11",
+        "numpy"
     ]
 )
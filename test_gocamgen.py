@@ -1,14 +1,44 @@
 import gocamgen
-from gocamgen.gocamgen import expand_uri_wrapper, ACTS_UPSTREAM_OF_RELATIONS
+from gocamgen.gocamgen import expand_uri_wrapper, ACTS_UPSTREAM_OF_RELATIONS, ENABLED_BY
 import unittest
 import logging
-from gocamgen.filter_rule import WBFilterRule, MGIFilterRule
-from gen_models_by_gene import AssocExtractor, GoCamBuilder
+from gocamgen.filter_rule import WBFilterRule, MGIFilterRule, AssocFilter
+from gen_models_by_gene import AssocExtractor, StreamingAssocExtractor, GoCamBuilder, model_output_path
 from gocamgen.triple_pattern_finder import TriplePattern, TriplePatternFinder, TriplePair, TriplePairCollection
 from rdflib.term import URIRef
+from rdflib.namespace import OWL, RDF
+from rdflib.graph import Graph
+from rdflib.compare import isomorphic
 from gocamgen.rdflib_sparql_wrapper import RdflibSparqlWrapper
 from gocamgen.subgraphs import AnnotationSubgraph
 from gocamgen.utils import ShexHelper
+from gocamgen.manifest import ModelManifest, gene_content_hash, run_context_hash
+from gocamgen.ontology_snapshot import OntologySnapshotCache, compile_ontology, write_snapshot, source_fingerprint
+from gocamgen.gpad_source import GpadSource
+from gocamgen.relations import RelationResolver, RelationAlgebra, load_relation_resolver
+from gocamgen.gpad_extensions_mapper import setup_ontologies, translate_relation_to_ro
+from gocamgen.stage_timer import StageTimer
+from gocamgen.collapsed_assoc import CollapsedAssociationSet, normalize_extension_sets, extract_properties, \
+    get_with_froms, with_from_groups_from_line
+from gocamgen.template_cache import TranslationTemplateCache
+from gocamgen.closure_index import AncestorClosureIndex
+from gocamgen.gpad_reader import GpadReader, close_line_stores
+from gocamgen.gpad_cache import load_gpad_cache, gpad_cache_dir
+from gocamgen.journal import RunJournal
+from gocamgen.writers import NQuadsWriter, ModelArchiveWriter, read_archive_index
+from gocamgen.errors import GeneErrorSet, GocamgenException, error_type_name
+from ontobio.ontol import Ontology, LogicalDefinition, PropertyChainAxiom
+from ontobio.io.gpadparser import GpadParser
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from functools import partial
+import gzip
+import os
+import pickle
+import shutil
+import tarfile
+import tempfile
+import threading
+import zipfile
 
 # logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger("gocamgen.gocamgen")
@@ -30,6 +60,451 @@ class TestReferencePreference(unittest.TestCase):
         self.assertEqual(result, "PMID:9834189")
 
 
+class TestStreamingAssocExtractor(unittest.TestCase):
+
+    def test_streaming_groups_match_full_parse(self):
+        gpad_file = "resources/test/wb.gpad.WBGene00003167"
+        assocs_by_gene = AssocExtractor(gpad_file, WBFilterRule()).group_assocs()
+
+        # Tiny sort buffer forces a multi-run external sort
+        extractor = StreamingAssocExtractor(gpad_file, WBFilterRule(), presorted=False, sort_buffer_lines=2)
+        streamed = {}
+        for gene, assocs in extractor.group_assocs():
+            self.assertNotIn(gene, streamed, "Gene {} yielded in more than one group".format(gene))
+            streamed[gene] = [a["source_line"] for a in assocs]
+
+        self.assertEqual(streamed.keys(), assocs_by_gene.keys())
+        for gene, assocs in assocs_by_gene.items():
+            self.assertEqual(streamed[gene], [a["source_line"] for a in assocs])
+
+
+class TestGpadReader(unittest.TestCase):
+
+    def test_fast_records_match_ontobio(self):
+        gpad_parser = GpadParser()
+        fast_reader = GpadReader()
+        strict_reader = GpadReader(strict=True)
+        with open("resources/test/wb.gpad.WBGene00003167") as gf:
+            for line in gf:
+                if line.startswith("!"):
+                    continue
+                expected = [extract_properties(a) for a in gpad_parser.parse_line(line).associations]
+                for reader in [fast_reader, strict_reader]:
+                    records = reader.parse_line(line)
+                    self.assertEqual([r.as_assoc() for r in records], expected)
+                    self.assertEqual([get_with_froms(r) for r in records],
+                                     [with_from_groups_from_line(a["source_line"]) for a in expected])
+
+        # Dropped in strict mode, where the subject ID fails ontobio's validation
+        bad_line = "WB\tWBGene 00003167\tenables\tGO:0005515\tPMID:1\tECO:0000353\t\t\t20190101\tWB\t\t\n"
+        self.assertEqual(len(fast_reader.parse_line(bad_line)), 1)
+        self.assertEqual(strict_reader.parse_line(bad_line), [])
+
+    def test_records_read_lines_back_by_offset(self):
+        gpad_file = "resources/test/wb.gpad.WBGene00003167"
+        with open(gpad_file) as gf:
+            inline_records = list(GpadReader().parse(gf))
+        records = list(GpadReader().parse_source(GpadSource(gpad_file)))
+        self.assertTrue(all(isinstance(r.line_ref, int) for r in records))
+        self.assertEqual([r.as_assoc() for r in records], [r.as_assoc() for r in inline_records])
+        # Workers get records pickled, and the store reopens the file by path
+        unpickled = pickle.loads(pickle.dumps(records))
+        self.assertEqual([r["source_line"] for r in unpickled], [r["source_line"] for r in inline_records])
+
+    @unittest.skipUnless(os.path.isdir("/proc/self/fd"), "Needs /proc to count open files")
+    def test_unpickled_records_share_open_file(self):
+        gpad_file = "resources/test/wb.gpad.WBGene00003167"
+        records = list(GpadReader().parse_source(GpadSource(gpad_file)))
+        records[0].source_line
+        open_fds = len(os.listdir("/proc/self/fd"))
+        # One pickled task per gene, like the worker pool sends
+        for _ in range(50):
+            gene, task_records = pickle.loads(pickle.dumps(("WB:WBGene00003167", records)))
+            for r in task_records:
+                r.source_line
+            self.assertEqual(len(os.listdir("/proc/self/fd")), open_fds)
+        close_line_stores()
+        self.assertEqual(task_records[0]["source_line"], records[0]["source_line"])
+
+
+class TestGpadCache(unittest.TestCase):
+
+    def test_cache_matches_parse_and_rebuilds_when_stale(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            gpad_file = os.path.join(tmp_dir, "wb.gpad")
+            shutil.copyfile("resources/test/wb.gpad.WBGene00003167", gpad_file)
+            parsed = [r.as_assoc() for r in GpadReader().parse_source(GpadSource(gpad_file))]
+            gpad_cache = load_gpad_cache(gpad_file)
+            self.assertTrue(os.path.isdir(gpad_cache_dir(gpad_file)))
+            self.assertEqual([r.as_assoc() for r in gpad_cache.records()], parsed)
+
+            gene = parsed[0]["subject"]["id"]
+            gene_rows = gpad_cache.rows_for_subject(gene)
+            self.assertEqual([r.as_assoc() for r in gpad_cache.records(gene_rows)],
+                             [a for a in parsed if a["subject"]["id"] == gene])
+            self.assertEqual(len(gpad_cache.rows_for_subject("WB:NotAGene")), 0)
+            assocs_by_gene = AssocExtractor(gpad_file, WBFilterRule(), gpad_cache=gpad_cache, genes=[gene]).group_assocs()
+            self.assertEqual(list(assocs_by_gene), [gene])
+            streamed = dict(StreamingAssocExtractor(gpad_file, WBFilterRule(), gpad_cache=gpad_cache).group_assocs())
+            self.assertEqual(streamed.keys(), AssocExtractor(gpad_file, WBFilterRule()).group_assocs().keys())
+
+            # Appending a line changes the size, so the cache is rebuilt
+            with open(gpad_file, "a") as gf:
+                gf.write(parsed[0]["source_line"])
+            self.assertEqual(len(load_gpad_cache(gpad_file)), len(parsed) + 1)
+
+
+class TestAssocFilter(unittest.TestCase):
+
+    def test_compiled_filter(self):
+        with open("resources/test/wb.gpad.WBGene00003167") as gf:
+            assocs = list(GpadReader().parse(gf))
+        assoc_filter = AssocFilter(WBFilterRule())
+        filtered = assoc_filter.filter(assocs)
+        self.assertEqual(filtered, [a for a in assocs if assoc_filter.validate_line(a)])
+        # One EcoMap lookup per distinct ECO class
+        self.assertEqual(set(assoc_filter.eco_codes), {a["evidence"]["type"] for a in assocs})
+
+        assoc = filtered[0].as_assoc()
+        iea_assoc = dict(assoc, evidence={"type": "ECO:0000501", "has_supporting_reference": ["GO_REF:0000002"]})
+        self.assertFalse(assoc_filter.validate_line(iea_assoc))
+        ikr_assoc = dict(assoc, evidence={"type": "ECO:0000320", "has_supporting_reference": ["PMID:21873635"]})
+        self.assertFalse(assoc_filter.validate_line(ikr_assoc))
+        self.assertFalse(assoc_filter.validate_line(dict(assoc, provided_by="MGI")))
+
+
+class TestGpadSource(unittest.TestCase):
+
+    def test_remote_gzipped_source_streams_same_lines(self):
+        gpad_file = "resources/test/wb.gpad.WBGene00003167"
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with open(gpad_file, "rb") as gf, gzip.open(os.path.join(tmp_dir, "wb.gpad.gz"), "wb") as gzf:
+                shutil.copyfileobj(gf, gzf)
+            handler = partial(SimpleHTTPRequestHandler, directory=tmp_dir)
+            server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                source = GpadSource("http://127.0.0.1:{}/wb.gpad.gz".format(server.server_address[1]))
+                with source.open() as remote_lines, open(gpad_file) as local_lines:
+                    self.assertEqual(list(remote_lines), list(local_lines))
+                self.assertEqual(source.report_path(), "wb.gpad.report")
+
+                assocs_by_gene = AssocExtractor(gpad_file, WBFilterRule()).group_assocs()
+                streamed = dict(StreamingAssocExtractor(source, WBFilterRule()).group_assocs())
+                self.assertEqual(streamed.keys(), assocs_by_gene.keys())
+            finally:
+                server.shutdown()
+                server.server_close()
+
+
+class TestStageTimer(unittest.TestCase):
+
+    def test_extractor_stage_counts(self):
+        gpad_file = "resources/test/wb.gpad.WBGene00003167"
+        stage_timer = StageTimer()
+        assocs_by_gene = AssocExtractor(gpad_file, WBFilterRule(), stage_timer=stage_timer).group_assocs()
+        stats = stage_timer.to_dict()
+        self.assertEqual(list(stats), ["parse", "filter", "group"])
+        self.assertEqual(stats["parse"]["count"], stats["filter"]["count"])
+        self.assertEqual(stats["group"]["count"], len(assocs_by_gene))
+
+        streaming_timer = StageTimer()
+        extractor = StreamingAssocExtractor(gpad_file, WBFilterRule(), stage_timer=streaming_timer)
+        list(extractor.group_assocs())
+        self.assertEqual(streaming_timer.to_dict()["filter"]["count"], stats["filter"]["count"])
+        # Streaming groups every gene before filtering
+        with open(gpad_file) as gf:
+            all_genes = {r.subject_id for r in GpadReader().parse(gf)}
+        self.assertEqual(streaming_timer.to_dict()["group"]["count"], len(all_genes))
+
+        # Per-worker timers fold into the run's totals
+        worker_timer = StageTimer()
+        worker_timer.add("translate", 1.5, 1.0, count=2)
+        stage_timer.merge(worker_timer)
+        stage_timer.merge(worker_timer)
+        self.assertEqual(stage_timer.to_dict()["translate"]["count"], 4)
+        self.assertAlmostEqual(stage_timer.to_dict()["translate"]["wall_sec"], 3.0)
+
+
+class TestOntologySnapshot(unittest.TestCase):
+
+    def test_snapshot_round_trip(self):
+        ont = Ontology()
+        ont.add_node("GO:0003674", "molecular_function")
+        ont.add_node("GO:0005488", "binding")
+        ont.add_parent("GO:0005488", "GO:0003674")
+        ont.all_logical_definitions = [LogicalDefinition("GO:0005488", ["GO:0003674"], [("RO:0002211", "GO:0003674")])]
+        ont.all_property_chain_axioms = []
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Any local file will do as the "source" - the snapshot is keyed on its checksum
+            source_file = os.path.join(tmp_dir, "tiny.obo")
+            with open(source_file, "w") as sf:
+                sf.write("format-version: 1.2\n")
+            cache = OntologySnapshotCache(tmp_dir)
+            write_snapshot(compile_ontology(ont, source_file, source_fingerprint(source_file)),
+                           cache.snapshot_path(source_file))
+
+            loaded = cache.load(source_file)
+            self.assertEqual(loaded.label("GO:0005488"), "binding")
+            self.assertIn("GO:0003674", loaded.ancestors("GO:0005488"))
+            self.assertEqual(loaded.logical_definitions("GO:0005488")[0].restrictions,
+                             [("RO:0002211", "GO:0003674")])
+
+
+class TestRelationResolver(unittest.TestCase):
+
+    def test_resolve_ro_and_gorel_labels(self):
+        ro = Ontology()
+        ro.add_node("RO:0002233", "has input")
+        ro.add_node("BFO:0000050", "part of")
+        gorel = Ontology()
+        gorel.add_node("GOREL:0000752", "has_direct_input", meta={"xrefs": [{"val": "RO:0002400"}]})
+        gorel.add_node("GOREL:0001006", "acts_on_population_of", meta={"xrefs": [{"val": "GOREL:0001006"}]})
+        resolver = RelationResolver.from_ontologies(ro, gorel)
+
+        self.assertEqual(resolver.resolve("has_input"), ("RO:0002233", False))
+        self.assertEqual(resolver.resolve("part of"), ("BFO:0000050", False))
+        self.assertEqual(resolver.resolve("has_direct_input"), ("RO:0002400", False))
+        self.assertEqual(resolver.resolve("acts_on_population_of"), ("GOREL:0001006", True))
+        self.assertEqual(resolver.resolve("not_a_relation"), (None, False))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = OntologySnapshotCache(tmp_dir)
+            cache.fingerprints = {"ro": ("sha256", "a"), "gorel": ("sha256", "b")}
+            load_relation_resolver(cache, "ro", "gorel", ro, gorel)
+            # Second load comes off disk - empty ontologies would resolve nothing
+            persisted = load_relation_resolver(cache, "ro", "gorel", Ontology(), Ontology())
+            self.assertEqual(persisted.resolve("has_direct_input"), ("RO:0002400", False))
+            cache.fingerprints["ro"] = ("sha256", "c")
+            rebuilt = load_relation_resolver(cache, "ro", "gorel", Ontology(), Ontology())
+            self.assertEqual(rebuilt.resolve("has_direct_input"), (None, False))
+
+        # The extensions census resolves through whichever resolver its ontologies were last set up with
+        setup_ontologies(go_ontology=Ontology(), ro_ontology=ro, relation_resolver=resolver)
+        self.assertEqual(translate_relation_to_ro("has_direct_input"), "RO:0002400")
+        setup_ontologies(go_ontology=Ontology(), ro_ontology=Ontology())
+        self.assertIsNone(translate_relation_to_ro("has_input"))
+
+
+class TestRelationAlgebra(unittest.TestCase):
+
+    def test_regulation_lookups(self):
+        ro = Ontology()
+        for rel in ["RO:0002211", "RO:0002213", "RO:0002304", "RO:0002263", "RO:0004034"]:
+            ro.add_node(rel)
+        ro.add_parent("RO:0002213", "RO:0002211", relation="subPropertyOf")
+        ro.add_parent("RO:0002213", "RO:0002304", relation="subPropertyOf")
+        ro.all_property_chain_axioms = [PropertyChainAxiom("RO:0004034", ["RO:0002327", "RO:0002304"])]
+        go = Ontology()
+        go.all_logical_definitions = [LogicalDefinition("GO:0045944", ["GO:0065007"],
+                                                        [("RO:0002213", "GO:0006366"), ("BFO:0000050", "GO:0008150")])]
+        algebra = RelationAlgebra.from_ontologies(ro, go)
+
+        self.assertIn("RO:0002211", algebra.regulates_family)
+        self.assertIn("RO:0002213", algebra.regulates_family)
+        self.assertEqual(algebra.restrictions("GO:0045944"), (("RO:0002213", "GO:0006366"),))
+        self.assertEqual(algebra.restrictions("GO:0008150"), ())
+        self.assertEqual(algebra.causally_upstream_relation("RO:0002213"), "RO:0002304")
+        self.assertEqual(algebra.causally_upstream_relation("RO:0004034"), "RO:0002304")
+        self.assertEqual(RelationAlgebra.from_data(algebra.to_data()).restrictions("GO:0045944"),
+                         algebra.restrictions("GO:0045944"))
+
+
+class TestAncestorClosureIndex(unittest.TestCase):
+
+    def test_closure_matches_ontology_ancestors(self):
+        go = Ontology()
+        for term in ["GO:0005488", "GO:0005515", "GO:0042802", "GO:0005575", "GO:0032991", "GO:0043234"]:
+            go.add_node(term)
+        go.add_parent("GO:0005515", "GO:0005488")
+        go.add_parent("GO:0042802", "GO:0005515")
+        go.add_parent("GO:0032991", "GO:0005575")
+        go.add_parent("GO:0043234", "GO:0032991")
+        go.add_parent("GO:0042802", "GO:0032991", relation="BFO:0000050")
+        index = AncestorClosureIndex.from_ontology(go)
+
+        for term in go.nodes():
+            self.assertEqual(sorted(index.ancestors(term)), sorted(go.ancestors(term, reflexive=True)))
+            self.assertEqual(sorted(index.ancestors(term, isa_only=True)),
+                             sorted(go.ancestors(term, relations=["subClassOf"], reflexive=True)))
+        self.assertTrue(index.is_under("GO:0042802", "GO:0005488"))
+        self.assertTrue(index.is_under("GO:0042802", "GO:0032991"))
+        self.assertFalse(index.is_under("GO:0042802", "GO:0032991", isa_only=True))
+        self.assertTrue(index.is_under("GO:9999999", "GO:9999999"))
+        self.assertFalse(index.is_under("GO:9999999", "GO:0005488"))
+        self.assertEqual(list(index.under_root(["GO:0043234", "GO:0005515", "GO:9999999"], "GO:0005575")),
+                         [True, False, False])
+        reloaded = AncestorClosureIndex.from_data(index.to_data())
+        self.assertEqual(reloaded.bulk_ancestors(["GO:0042802"]), index.bulk_ancestors(["GO:0042802"]))
+
+
+class TestCollapsedAssociationSet(unittest.TestCase):
+
+    def test_collapse_keeps_first_seen_order(self):
+        gpad_line = "WB\tWBGene00003167\t{}\t{}\t{}\tECO:0000314\t\t\t20190101\tWB\t{}\t\n"
+        gpad_reader = GpadReader()
+        assoc_set = CollapsedAssociationSet([gpad_reader.parse_line(gpad_line.format(*cols))[0] for cols in [
+            ("part_of", "GO:0005634", "PMID:1", ""),
+            ("enables", "GO:0003677", "PMID:2", "occurs_in(WBbt:0005772)"),
+            ("part_of", "GO:0005634", "PMID:3", ""),
+            ("enables", "GO:0003677", "PMID:4", "occurs_in(WBbt:0005772)"),
+            ("enables", "GO:0003677", "PMID:5", ""),
+        ]])
+        assoc_set.go_ontology = Ontology()
+        assoc_set.collapse_annotations()
+        collapsed = list(assoc_set)
+        self.assertEqual([(ca.object_id(), len(ca.lines)) for ca in collapsed],
+                         [("GO:0005634", 2), ("GO:0003677", 2), ("GO:0003677", 1)])
+        self.assertEqual(collapsed[1].lines[1].references, ["PMID:4"])
+
+
+class TestExtensionSets(unittest.TestCase):
+
+    def test_occurs_in_split_and_dedupe(self):
+        def ext(relation, filler):
+            return {"property": relation, "filler": filler}
+        union_of = [
+            {"intersection_of": [ext("occurs_in", "CL:0000001"), ext("occurs_in", "CL:0000002"),
+                                 ext("occurs_in", "EMAPA:1"), ext("occurs_in", "EMAPA:2"),
+                                 ext("has_input", "UniProtKB:P12345"), ext("has_input", "UniProtKB:P12345")]},
+            {"intersection_of": [ext("part_of", "UBERON:0000001"), ext("part_of", "CL:0000003")]},
+            {"intersection_of": [ext("part_of", "CL:0000003"), ext("part_of", "UBERON:0000001")]},
+        ]
+        ext_sets = normalize_extension_sets(union_of)
+        # 2 CL x 2 EMAPA occurs_in splits, each only once, plus the one part_of set
+        self.assertEqual(len(ext_sets), 5)
+        self.assertEqual(len(set(ext_sets)), 5)
+        part_of_set = ext_sets[0]
+        self.assertEqual(part_of_set.nested, (("part_of", ("CL:0000003", "UBERON:0000001"), True),))
+        self.assertEqual(part_of_set.unnested, ())
+        for ext_set in ext_sets[1:]:
+            self.assertEqual(ext_set.unnested, (("has_input", "UniProtKB:P12345"),))
+            occurs_in_terms = ext_set.nested[0][1]
+            self.assertEqual([t.split(":")[0] for t in occurs_in_terms], ["CL", "EMAPA"])
+
+
+class TestModelManifest(unittest.TestCase):
+
+    def test_only_changed_genes_are_stale(self):
+        assocs = [{"source_line": "WB\tWBGene00003167\tenables\tGO:0000977\n"},
+                  {"source_line": "WB\tWBGene00003167\tenables\tGO:0003700\n"}]
+        gene_hash = gene_content_hash(assocs, "ctx")
+        # Line order within a gene shouldn't matter, ontology/rule context should
+        self.assertEqual(gene_hash, gene_content_hash(list(reversed(assocs)), "ctx"))
+        self.assertNotEqual(gene_hash, gene_content_hash(assocs, "other ctx"))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            model_path = os.path.join(tmp_dir, "WB_WBGene00003167.ttl")
+            open(model_path, "w").close()
+            gone_model_path = os.path.join(tmp_dir, "WB_WBGene00000001.ttl")
+            open(gone_model_path, "w").close()
+            manifest = ModelManifest(os.path.join(tmp_dir, "models.manifest.json"), "ctx")
+            manifest.record("WB:WBGene00003167", gene_hash, model_path)
+            manifest.record("WB:WBGene00000001", "abc", gone_model_path)
+            manifest.save()
+
+            manifest = ModelManifest(manifest.manifest_path, "ctx").load()
+            self.assertTrue(manifest.is_current("WB:WBGene00003167", gene_hash))
+            self.assertFalse(manifest.is_current("WB:WBGene00003167", gene_content_hash(assocs[0:1], "ctx")))
+            # Same content, but this run writes the model somewhere else (e.g. --layout sharded)
+            sharded_path = model_output_path("WB:WBGene00003167", tmp_dir, "sharded")
+            self.assertFalse(manifest.is_current("WB:WBGene00003167", gene_hash, sharded_path))
+            self.assertTrue(manifest.is_current("WB:WBGene00003167", gene_hash,
+                                                model_output_path("WB:WBGene00003167", tmp_dir)))
+            self.assertEqual(manifest.remove_missing_genes({"WB:WBGene00003167"}), ["WB:WBGene00000001"])
+            self.assertFalse(os.path.exists(gone_model_path))
+
+            # New ontology/rule context invalidates every hash but still knows where the models are
+            manifest.mark_stale("WB:WBGene00003167", model_path)
+            self.assertFalse(manifest.is_current("WB:WBGene00003167", gene_hash))
+            manifest.record("WB:WBGene00003167", gene_hash, model_path)
+            manifest.save()
+            manifest = ModelManifest(manifest.manifest_path, "new ctx").load()
+            self.assertFalse(manifest.is_current("WB:WBGene00003167", gene_hash))
+            self.assertEqual(manifest.remove_missing_genes(set()), ["WB:WBGene00003167"])
+            self.assertFalse(os.path.exists(model_path))
+
+        # Options that change the models written invalidate them too
+        flat_options = {"layout": "flat", "deterministic_ids": False}
+        flat_context = run_context_hash({"go": "abc"}, WBFilterRule(), flat_options)
+        reordered_options = dict(reversed(list(flat_options.items())))
+        self.assertEqual(flat_context, run_context_hash({"go": "abc"}, WBFilterRule(), reordered_options))
+        self.assertNotEqual(flat_context, run_context_hash({"go": "abc"}, WBFilterRule(),
+                                                           {"layout": "sharded", "deterministic_ids": False}))
+
+
+class TestRunJournal(unittest.TestCase):
+
+    def test_resume_truncates_partial_nquads(self):
+        run_params = {"gpad_file": "wb.gpad", "nquads": "models.nq"}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            nquads_path = os.path.join(tmp_dir, "models.nq")
+            journal = RunJournal(RunJournal.journal_path_for(output_file=nquads_path), run_params).open()
+            nquads_writer = NQuadsWriter(nquads_path)
+            nquads_writer.write_data(b"<a> <b> <c> <g1> .\n")
+            journal.record("WB:WBGene00000001", None, [], nquads_offset=nquads_writer.checkpoint())
+            nquads_writer.write_data(b"<a> <b> <d> <g2> .\n")
+            journal.record("WB:WBGene00000002", None, [GocamgenException("No MF")],
+                           nquads_offset=nquads_writer.checkpoint())
+            # Run gets killed partway through the next model and the journal entry for it
+            nquads_writer.write_data(b"<a> <b> <e>")
+            nquads_writer.checkpoint()
+            with open(journal.journal_path, "a") as jf:
+                jf.write('{"gene": "WB:WBGe')
+
+            resumed = RunJournal(journal.journal_path, run_params).load()
+            self.assertTrue(resumed.is_done("WB:WBGene00000002"))
+            self.assertFalse(resumed.is_done("WB:WBGene00000003"))
+            errors = GeneErrorSet()
+            resumed.restore_errors(errors)
+            self.assertEqual([error_type_name(ex) for ex in errors.errors["WB:WBGene00000002"]],
+                             ["GocamgenException"])
+
+            resumed.open(resume=True)
+            nquads_writer = NQuadsWriter(nquads_path, resume_offset=resumed.nquads_offset)
+            nquads_writer.write_data(b"<a> <b> <f> <g3> .\n")
+            resumed.record("WB:WBGene00000003", None, [], nquads_offset=nquads_writer.checkpoint())
+            nquads_writer.close()
+            resumed.close()
+            with open(nquads_path) as nf:
+                self.assertEqual(nf.read(), "<a> <b> <c> <g1> .\n<a> <b> <d> <g2> .\n<a> <b> <f> <g3> .\n")
+            self.assertEqual(len(RunJournal(journal.journal_path, run_params).load().entries), 3)
+
+            with self.assertRaises(ValueError):
+                RunJournal(journal.journal_path, {"gpad_file": "mgi.gpa"}).load()
+
+
+class TestModelArchive(unittest.TestCase):
+
+    def test_sharded_paths_and_archive_index(self):
+        sharded_path = model_output_path("WB:WBGene00003167", "models", layout="sharded")
+        shard_dir, filename = os.path.split(sharded_path)
+        self.assertEqual(filename, "WB_WBGene00003167.ttl")
+        self.assertEqual(os.path.dirname(shard_dir), "models")
+        self.assertEqual(len(os.path.basename(shard_dir)), 2)
+        self.assertEqual(model_output_path("WB:WBGene00003167", "models"), os.path.join("models", filename))
+
+        models = {"WB:WBGene00003167": b"<a> <b> <c> .\n", "WB:WBGene00000018": b"<d> <e> <f> .\n"}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for archive_name in ["models.tar", "models.zip"]:
+                archive_path = os.path.join(tmp_dir, archive_name)
+                with ModelArchiveWriter(archive_path) as archive_writer:
+                    for gene, model_data in models.items():
+                        archive_writer.write_data(gene, model_output_path(gene, layout="sharded"), model_data)
+                index = read_archive_index(archive_writer.index_path)
+                self.assertEqual(index.keys(), models.keys())
+                member_name, offset = index["WB:WBGene00000018"]
+                if archive_name.endswith(".tar"):
+                    with tarfile.open(archive_path) as tf:
+                        self.assertEqual(tf.extractfile(member_name).read(), models["WB:WBGene00000018"])
+                        self.assertEqual(tf.getmember(member_name).offset, offset)
+                else:
+                    with zipfile.ZipFile(archive_path) as zf:
+                        self.assertEqual(zf.read(member_name), models["WB:WBGene00000018"])
+                        self.assertEqual(zf.getinfo(member_name).header_offset, offset)
+
+
 class TestGoCamModel(unittest.TestCase):
     BUILDER = GoCamBuilder()  # Takes a sec to init so only make once
 
@@ -305,6 +780,143 @@ class TestGoCamModel(unittest.TestCase):
         shape = shex_helper.shape_from_class("GO:0003674", TestGoCamModel.BUILDER.ext_mapper.go_aspector)
         self.assertEqual(shape, "MolecularFunction")
 
+    def test_axiom_index_matches_graph(self):
+        model = self.gen_model(gpad_file="resources/test/wb.gpad.WBGene00003167", test_gene="WB:WBGene00003167",
+                               filter_rule=WBFilterRule())
+        axiom_count = 0
+        for axiom_id in model.graph.subjects(RDF.type, OWL.Axiom):
+            annotated_triple = (model.graph.value(axiom_id, OWL.annotatedSource),
+                                model.graph.value(axiom_id, OWL.annotatedProperty),
+                                model.graph.value(axiom_id, OWL.annotatedTarget))
+            indexed_axiom_id = model.find_bnode(annotated_triple)
+            self.assertIsNotNone(indexed_axiom_id)
+            self.assertEqual(model.graph.value(indexed_axiom_id, OWL.annotatedTarget), annotated_triple[2])
+            axiom_count += 1
+        self.assertGreater(axiom_count, 0)
+        self.assertIsNone(model.find_bnode((URIRef("http://example.org/a"), ENABLED_BY, URIRef("http://example.org/b"))))
+
+    def test_individual_index_matches_graph(self):
+        model = self.gen_model(gpad_file="resources/test/wb.gpad.WBGene00003167", test_gene="WB:WBGene00003167",
+                               filter_rule=WBFilterRule())
+        for class_id in ["WB:WBGene00003167", "GO:0000977"]:
+            class_uri = URIRef(expand_uri_wrapper(class_id))
+            individuals = model.uri_list_for_individual(class_id)
+            self.assertGreater(len(individuals), 0)
+            self.assertEqual(set(individuals), set(model.graph.subjects(RDF.type, class_uri)))
+            for individual in individuals:
+                self.assertEqual(model.class_for_uri(individual), class_id)
+        self.assertEqual(model.uri_list_for_individual("GO:0000000"), [])
+
+    def test_evidence_interning(self):
+        model = gocamgen.gocamgen.GoCamModel("test evidence interning")
+        axiom_a = model.create_axiom("GO:0003674", ENABLED_BY, "WB:WBGene00003167")
+        axiom_b = model.create_axiom("GO:0005515", ENABLED_BY, "WB:WBGene00003167")
+        ev_a = gocamgen.gocamgen.GoCamEvidence("ECO:0000314", ["PMID:123", "WB_REF:WBPaper1"], date="2019-01-01",
+                                               contributors=["WB"])
+        ev_b = gocamgen.gocamgen.GoCamEvidence("ECO:0000314", ["WB_REF:WBPaper1", "PMID:123"], date="2019-01-01",
+                                               contributors=["WB"])
+        ev_c = gocamgen.gocamgen.GoCamEvidence("ECO:0000314", ["PMID:123", "WB_REF:WBPaper1"], date="2019-02-01",
+                                               contributors=["WB"])
+        model.add_evidence(axiom_a, ev_a)
+        model.add_evidence(axiom_b, ev_b)
+        model.add_evidence(axiom_b, ev_c)
+        self.assertEqual(ev_a.id, ev_b.id)
+        self.assertNotEqual(ev_a.id, ev_c.id)
+        evidence_individuals = set(model.graph.subjects(RDF.type, URIRef(expand_uri_wrapper("ECO:0000314"))))
+        self.assertEqual(evidence_individuals, {ev_a.id, ev_c.id})
+
+    def test_fast_writer_round_trip(self):
+        model = self.gen_model(gpad_file="resources/test/wb.gpad.WBGene00003167", test_gene="WB:WBGene00003167",
+                               filter_rule=WBFilterRule())
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for out_format, parse_format in [("ttl", "turtle"), ("nt", "nt")]:
+                out_filename = os.path.join(tmp_dir, "WB_WBGene00003167.{}".format(out_format))
+                model.write(out_filename, format=out_format, fast=True)
+                parsed_graph = Graph()
+                parsed_graph.parse(out_filename, format=parse_format)
+                self.assertTrue(isomorphic(model.graph, parsed_graph),
+                                "Fast {} output doesn't parse back to the model's graph".format(out_format))
+
+    def test_triple_buffer_materializes_to_graph(self):
+        model = self.gen_model(gpad_file="resources/test/wb.gpad.WBGene00003167", test_gene="WB:WBGene00003167",
+                               filter_rule=WBFilterRule())
+        buffer = model.writer.writer.buffer
+        self.assertIsNotNone(buffer, "Translation shouldn't have built the rdflib graph")
+        buffered_triples = set(buffer)
+        typed_individuals = set(buffer.triples((None, RDF.type, OWL.NamedIndividual)))
+        graph = model.graph
+        self.assertIsNone(model.writer.writer.buffer)
+        self.assertEqual(buffered_triples, set(graph))
+        self.assertEqual(typed_individuals, set(graph.triples((None, RDF.type, OWL.NamedIndividual))))
+        # Single-term patterns go through their own indexes
+        individual = next(iter(typed_individuals))[0]
+        for pattern in [(individual, None, None), (None, None, individual), (None, RDF.type, None),
+                        (individual, None, OWL.NamedIndividual)]:
+            self.assertEqual(set(buffer.triples(pattern)), set(graph.triples(pattern)))
+
+    def test_deterministic_ids(self):
+        test_gene = "WB:WBGene00003167"
+        assocs = AssocExtractor("resources/test/wb.gpad.WBGene00003167", WBFilterRule()).group_assocs()[test_gene]
+        builder = TestGoCamModel.BUILDER
+        builder.deterministic_ids = True
+        try:
+            outputs = [builder.translate_to_model(test_gene, assocs).serialize(format="nt", fast=True)
+                       for i in range(2)]
+        finally:
+            builder.deterministic_ids = False
+        self.assertEqual(outputs[0], outputs[1])
+        random_output = builder.translate_to_model(test_gene, assocs).serialize(format="nt", fast=True)
+        self.assertNotEqual(outputs[0], random_output)
+
+    def test_template_cache(self):
+        test_gene = "WB:WBGene00003167"
+        assocs = AssocExtractor("resources/test/wb.gpad.WBGene00003167", WBFilterRule()).group_assocs()[test_gene]
+        # Same annotations on another gene. Extensions naming the first gene keep it as filler (reusing its
+        # templates) and get a copy naming the new gene itself.
+        other_gene = "WB:WBGene00099999"
+        other_lines = []
+        for a in assocs:
+            cols = a["source_line"].split("\t")
+            cols[1] = "WBGene00099999"
+            other_lines.append("\t".join(cols))
+            if test_gene in cols[10]:
+                cols[10] = cols[10].replace(test_gene, other_gene)
+                other_lines.append("\t".join(cols))
+        other_assocs = list(GpadReader().parse(other_lines))
+        builder = TestGoCamModel.BUILDER
+        shared_cache = builder.template_cache
+        builder.deterministic_ids = True
+        try:
+            builder.template_cache = TranslationTemplateCache(max_size=0)
+            uncached_output = builder.translate_to_model(test_gene, assocs).serialize(format="nt", fast=True)
+            uncached_other_output = builder.translate_to_model(other_gene, other_assocs).serialize(format="nt",
+                                                                                                   fast=True)
+            template_cache = TranslationTemplateCache()
+            builder.template_cache = template_cache
+            first_output = builder.translate_to_model(test_gene, assocs).serialize(format="nt", fast=True)
+            misses = template_cache.misses
+            second_output = builder.translate_to_model(test_gene, assocs).serialize(format="nt", fast=True)
+            hits = template_cache.hits
+            other_output = builder.translate_to_model(other_gene, other_assocs).serialize(format="nt", fast=True)
+        finally:
+            builder.deterministic_ids = False
+            builder.template_cache = shared_cache
+        # Second model is built entirely from templates and comes out the same as translating from scratch
+        self.assertEqual(template_cache.misses, misses)
+        self.assertGreater(template_cache.hits, 0)
+        self.assertEqual(uncached_output, first_output)
+        self.assertEqual(first_output, second_output)
+        # Templates substituted onto a different gene match translating that gene from scratch
+        self.assertGreater(template_cache.hits, hits)
+        self.assertIn(b"WBGene00099999", other_output)
+        self.assertEqual(uncached_other_output, other_output)
+
+        bounded_cache = TranslationTemplateCache(max_size=1)
+        bounded_cache.put("a", "template a")
+        bounded_cache.put("b", "template b")
+        self.assertEqual(len(bounded_cache), 1)
+        self.assertIsNone(bounded_cache.get("a"))
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file